@@ -0,0 +1,107 @@
+"""Benchmark of the zone summaries against per-event publishing.
+
+Runs the synthetic scene of batch_benchmark through the probe analytics
+once publishing every event and once publishing only the zone summaries,
+then reports the messages and bytes sent by each and the cost of the
+aggregation per frame. Also checks the summaries against the events: the
+entries and exits of every zone must add up to the ENTRY and EXIT events.
+
+    python3 -m benchmarks.aggregate_benchmark --sources 16 --batches 3000 --window 10
+"""
+from benchmarks import fake_pyds
+fake_pyds.install()
+
+import argparse
+import json
+import sys
+import time
+from collections import Counter
+
+from benchmarks.batch_benchmark import FPS, FRAME_HEIGHT, FRAME_WIDTH, FakeClock, Scene, \
+    make_config, parse_class_mix
+from pipeline.aggregates import ZoneAggregator, encode_summary
+from pipeline.analytics import BatchAnalytics
+from pipeline.config import compile_config
+from pipeline.control import AnalyticsState
+from pipeline.events import EventType
+from pipeline.occupancy import OccupancyTracker
+from pipeline.overlay import ZoneOverlay
+from pipeline.publisher import EventPublisher, MemoryTransport
+from pipeline.zones import ZoneEngine
+
+
+def run(args: argparse.Namespace, sources, batches, aggregator):
+    clock = FakeClock()
+    state = AnalyticsState(sources, ZoneEngine(sources, FRAME_WIDTH, FRAME_HEIGHT),
+                           ZoneOverlay(sources, interval=0), frozenset())
+    transport = MemoryTransport()
+    # Not started, submit only queues, the queue is published at the end
+    publisher = EventPublisher(transport, max_queue=len(batches) * 1000)
+    occupancy = OccupancyTracker(exit_timeout=args.exit_timeout,
+                                 dwell_interval=args.dwell_interval)
+    analytics = BatchAnalytics(state, occupancy, publisher, clock, aggregator=aggregator,
+                               publish_events=aggregator is None)
+    events = []
+    start = time.perf_counter()
+    for batch in batches:
+        _, batch_events = analytics.process_batch(batch)
+        events.extend(batch_events)
+        clock.now += 1 / FPS
+    elapsed = time.perf_counter() - start
+    if aggregator is not None:
+        for summary in aggregator.summarize(clock.now):
+            publisher.submit_message(encode_summary(summary))
+    publisher.start()
+    publisher.close()
+    return elapsed, events, transport.messages
+
+
+def main(args: argparse.Namespace) -> int:
+    sources = compile_config(make_config(args.sources, "grid", args.zones))
+    scene = Scene(args.sources, args.objects, parse_class_mix(args.class_mix), [4.0, 2.0],
+                  args.miss_rate, args.seed)
+    batches = [scene.next_batch() for _ in range(args.batches)]
+    frames = args.sources * args.batches
+
+    plain, events, event_messages = run(args, sources, batches, None)
+    aggregated, _, summary_messages = run(
+        args, sources, batches, ZoneAggregator(args.window, tuple(args.grid)))
+
+    def size(messages):
+        return sum(len(value) for _, value in messages)
+
+    print(f"frames={frames} events={len(events)} seconds={args.batches / FPS:.0f}")
+    print(f"events: {len(event_messages)} messages, {size(event_messages)} bytes")
+    print(f"summaries: {len(summary_messages)} messages, {size(summary_messages)} bytes, "
+          f"{size(event_messages) / max(size(summary_messages), 1):.1f}x fewer bytes")
+    print(f"aggregation overhead: {1e6 * (aggregated - plain) / frames:.2f} us/frame")
+
+    expected = Counter((e.type, e.source_id, e.zone) for e in events
+                       if e.type in (EventType.ENTRY, EventType.EXIT))
+    counted = Counter()
+    for _, value in summary_messages:
+        summary = json.loads(value)
+        for zone, (entries, exits) in enumerate(zip(summary["in"], summary["out"])):
+            counted[(EventType.ENTRY, summary["s"], zone)] += entries
+            counted[(EventType.EXIT, summary["s"], zone)] += exits
+    if +counted != expected:
+        print("MISMATCH the summary entries and exits differ from the events")
+        return 1
+    print("Summaries match the events")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sources", default=8, type=int)
+    parser.add_argument("--objects", default=20, type=int, help="Tracked objects per source")
+    parser.add_argument("--zones", default=4, type=int, help="Zones per source")
+    parser.add_argument("--class_mix", default="car=0.45,person=0.45,bicycle=0.05,roadsign=0.05")
+    parser.add_argument("--miss_rate", default=0.05, type=float)
+    parser.add_argument("--batches", default=1800, type=int)
+    parser.add_argument("--exit_timeout", default=0.5, type=float)
+    parser.add_argument("--dwell_interval", default=1.0, type=float)
+    parser.add_argument("--window", default=10.0, type=float, help="Summary window in seconds")
+    parser.add_argument("--grid", default=[16, 9], type=int, nargs=2)
+    parser.add_argument("--seed", default=0, type=int)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,292 @@
+"""Benchmark of the probe and event path on synthetic batch metadata.
+
+Drives pipeline.analytics.BatchAnalytics, the code run by the pipeline probe,
+with batches built on the fake pyds layer of benchmarks/fake_pyds.py. Tracked
+objects move across the frames of every source so the zone engine, the
+occupancy state machine, the overlay and the event metadata generation all
+see a realistic load. Runs on CPU only:
+
+    python3 -m benchmarks.batch_benchmark --sources 1 4 16 64
+    python3 -m benchmarks.batch_benchmark --save benchmarks/baselines/batch.json
+    python3 -m benchmarks.batch_benchmark --check benchmarks/baselines/batch.json
+
+Metrics per scenario: frames/s, us per object, metadata allocations per
+frame (pool acquisitions and buffers made through pyds), peak Python memory
+per batch and events per frame. The allocation and event counts are
+deterministic for a seed and must match the baseline exactly, the timings
+may regress by at most --tolerance.
+"""
+from benchmarks import fake_pyds
+fake_pyds.install()
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+import numpy as np
+
+from pipeline.analytics import BatchAnalytics
+from pipeline.config import CLASS_BICYCLE, CLASS_CAR, CLASS_PERSON, CLASS_ROADSIGN, compile_config
+from pipeline.control import AnalyticsState
+from pipeline.occupancy import OccupancyTracker
+from pipeline.overlay import ZoneOverlay
+from pipeline.publisher import EventPublisher, MemoryTransport
+from pipeline.zones import ZoneEngine
+
+FRAME_WIDTH = 1920
+FRAME_HEIGHT = 1080
+FPS = 30.0
+CLASS_NAMES = {"car": CLASS_CAR, "bicycle": CLASS_BICYCLE,
+               "person": CLASS_PERSON, "roadsign": CLASS_ROADSIGN}
+LAYOUTS = ("grid", "concave", "none")
+# Metrics that only depend on the seed, compared exactly with the baseline
+EXACT_METRICS = ("allocations_per_frame", "events_per_frame")
+TIMED_METRICS = ("us_per_object",)
+
+
+def zone_lines(points: List[List[float]]) -> List:
+    return [[points[i], points[(i + 1) % len(points)]] for i in range(len(points))]
+
+
+def make_zones(layout: str, num_zones: int) -> List:
+    if layout == "none" or num_zones == 0:
+        return []
+    columns = int(np.ceil(np.sqrt(num_zones)))
+    w, h = FRAME_WIDTH / columns, FRAME_HEIGHT / columns
+    zones = []
+    for i in range(num_zones):
+        x, y = (i % columns) * w + 4, (i // columns) * h + 4
+        zw, zh = w - 8, h - 8
+        if layout == "grid":
+            points = [[x, y], [x + zw, y], [x + zw, y + zh], [x, y + zh]]
+        else:
+            points = [[x, y], [x + zw, y], [x + zw, y + zh / 2], [x + zw / 2, y + zh / 2],
+                      [x + zw / 2, y + zh], [x, y + zh]]
+        zones.append(zone_lines(points))
+    return zones
+
+
+def make_config(num_sources: int, layout: str, num_zones: int) -> Dict:
+    zones = make_zones(layout, num_zones)
+    return {str(s): {"uri": "file:///dev/null", "car_confidence": 0.4,
+                     "person_confidence": 0.4, "restricted_zones": zones}
+            for s in range(num_sources)}
+
+
+def parse_class_mix(value: str) -> Dict[int, float]:
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        if name not in CLASS_NAMES:
+            raise ValueError(f"Unknown class '{name}', expected one of {', '.join(CLASS_NAMES)}")
+        mix[CLASS_NAMES[name]] = float(weight)
+    return mix
+
+
+class Scene():
+    """Tracked objects moving linearly across the frames of every source.
+
+    Each track keeps its class and tracking id, draws a confidence per frame
+    from a beta distribution and is missed by the detector with the given
+    probability, so objects enter, dwell in and leave the zones.
+    """
+
+    def __init__(self, num_sources: int, num_objects: int, class_mix: Dict[int, float],
+                 confidence: List[float], miss_rate: float, seed: int) -> None:
+        self._rng = random.Random(seed)
+        self._confidence = confidence
+        self._miss_rate = miss_rate
+        classes, weights = list(class_mix), list(class_mix.values())
+        self._tracks = []
+        next_id = 0
+        for source_id in range(num_sources):
+            tracks = []
+            for _ in range(num_objects):
+                width, height = self._rng.uniform(30, 150), self._rng.uniform(60, 200)
+                tracks.append([next_id, self._rng.choices(classes, weights)[0],
+                               self._rng.uniform(0, FRAME_WIDTH - width),
+                               self._rng.uniform(0, FRAME_HEIGHT - height),
+                               self._rng.uniform(-8, 8), self._rng.uniform(-4, 4),
+                               width, height])
+                next_id += 1
+            self._tracks.append(tracks)
+        self.frame_num = 0
+
+    def next_batch(self) -> fake_pyds.NvDsBatchMeta:
+        rng = self._rng
+        alpha, beta = self._confidence
+        frames = []
+        for source_id, tracks in enumerate(self._tracks):
+            objects = []
+            for track in tracks:
+                object_id, class_id, left, top, dx, dy, width, height = track
+                # Bounce on the frame borders
+                if not 0 <= left + dx <= FRAME_WIDTH - width:
+                    track[4] = dx = -dx
+                if not 0 <= top + dy <= FRAME_HEIGHT - height:
+                    track[5] = dy = -dy
+                track[2], track[3] = left + dx, top + dy
+                if rng.random() < self._miss_rate:
+                    continue
+                objects.append(fake_pyds.NvDsObjectMeta(
+                    class_id, rng.betavariate(alpha, beta), object_id,
+                    fake_pyds.NvOSD_RectParams(track[2], track[3], width, height)))
+            frames.append(fake_pyds.NvDsFrameMeta(source_id, self.frame_num, objects))
+        self.frame_num += 1
+        return fake_pyds.NvDsBatchMeta(frames)
+
+
+class FakeClock():
+    """Advances one frame interval per batch"""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def run_scenario(args: argparse.Namespace, num_sources: int) -> Dict:
+    sources = compile_config(make_config(num_sources, args.layout, args.zones))
+    class_mix = parse_class_mix(args.class_mix)
+
+    def run(measure_memory: bool):
+        scene = Scene(num_sources, args.objects, class_mix, args.confidence,
+                      args.miss_rate, args.seed)
+        batches = [scene.next_batch() for _ in range(args.batches)]
+        clock = FakeClock()
+        state = AnalyticsState(sources, ZoneEngine(sources, FRAME_WIDTH, FRAME_HEIGHT),
+                               ZoneOverlay(sources, interval=args.overlay_interval),
+                               frozenset())
+        publisher = None
+        if args.sink == "async":
+            # Not started, submit only queues, as seen by the streaming thread
+            publisher = EventPublisher(MemoryTransport(), max_queue=len(batches) * 1000)
+        analytics = BatchAnalytics(state, OccupancyTracker(exit_timeout=args.exit_timeout,
+                                                           dwell_interval=args.dwell_interval),
+                                   publisher, clock)
+        fake_pyds.reset_allocations()
+        objects = events = 0
+        peak = 0
+        if measure_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        for batch in batches:
+            if measure_memory:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+            frames, batch_events = analytics.process_batch(batch)
+            if measure_memory:
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+            events += len(batch_events)
+            clock.now += 1 / FPS
+        elapsed = time.perf_counter() - start
+        if measure_memory:
+            tracemalloc.stop()
+        for batch in batches:
+            l_frame = batch.frame_meta_list
+            while l_frame is not None:
+                l_obj = l_frame.data.obj_meta_list
+                while l_obj is not None:
+                    objects += 1
+                    l_obj = l_obj.next
+                l_frame = l_frame.next
+        return elapsed, objects, events, sum(fake_pyds.ALLOCATIONS.values()), peak
+
+    elapsed = min(run(False)[0] for _ in range(args.repeat))
+    _, objects, events, allocations, peak = run(True)
+    frames = num_sources * args.batches
+    return {
+        "sources": num_sources,
+        "frames": frames,
+        "objects": objects,
+        "frames_per_second": round(frames / elapsed, 1),
+        "us_per_object": round(1e6 * elapsed / max(objects, 1), 3),
+        "allocations_per_frame": round(allocations / frames, 4),
+        "peak_kib_per_batch": round(peak / 1024, 1),
+        "events_per_frame": round(events / frames, 4),
+    }
+
+
+def scenario_config(args: argparse.Namespace) -> Dict:
+    return {key: getattr(args, key) for key in
+            ("objects", "zones", "layout", "class_mix", "confidence", "miss_rate",
+             "batches", "overlay_interval", "exit_timeout", "dwell_interval", "sink", "seed")}
+
+
+def check(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Regressions of the results against a baseline"""
+    failures = []
+    if baseline["config"] != results["config"]:
+        return [f"Scenario config differs from the baseline: {baseline['config']}"]
+    for key, expected in baseline["scenarios"].items():
+        measured = results["scenarios"].get(key)
+        if measured is None:
+            continue
+        for metric in EXACT_METRICS:
+            if measured[metric] != expected[metric]:
+                failures.append(f"{key} sources: {metric} {measured[metric]} "
+                                f"!= baseline {expected[metric]}")
+        for metric in TIMED_METRICS:
+            if measured[metric] > expected[metric] * (1 + tolerance):
+                failures.append(f"{key} sources: {metric} {measured[metric]} is more than "
+                                f"{tolerance:.0%} above baseline {expected[metric]}")
+    return failures
+
+
+def main(args: argparse.Namespace) -> int:
+    results = {"config": scenario_config(args), "scenarios": {}}
+    print(f"{'sources':>8} {'frames/s':>10} {'us/object':>10} {'allocs/frame':>13} "
+          f"{'KiB/batch':>10} {'events/frame':>13}")
+    for num_sources in args.sources:
+        result = run_scenario(args, num_sources)
+        results["scenarios"][str(num_sources)] = result
+        print(f"{num_sources:>8} {result['frames_per_second']:>10.1f} "
+              f"{result['us_per_object']:>10.3f} {result['allocations_per_frame']:>13.4f} "
+              f"{result['peak_kib_per_batch']:>10.1f} {result['events_per_frame']:>13.4f}")
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=4)
+            file.write("\n")
+    if args.check:
+        with open(args.check, "r") as file:
+            baseline = json.load(file)
+        failures = check(results, baseline, args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            return 1
+        print(f"No regression against {args.check}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sources", default=[1, 4, 16, 32, 64], type=int, nargs="+")
+    parser.add_argument("--objects", default=20, type=int, help="Tracked objects per source")
+    parser.add_argument("--zones", default=4, type=int, help="Zones per source")
+    parser.add_argument("--layout", default="grid", choices=LAYOUTS)
+    parser.add_argument("--class_mix", default="car=0.45,person=0.45,bicycle=0.05,roadsign=0.05")
+    parser.add_argument("--confidence", default=[4.0, 2.0], type=float, nargs=2,
+                        metavar=("ALPHA", "BETA"), help="Beta distribution of the confidences")
+    parser.add_argument("--miss_rate", default=0.05, type=float,
+                        help="Probability a track is not detected in a frame")
+    parser.add_argument("--batches", default=60, type=int)
+    parser.add_argument("--overlay_interval", default=1, type=int)
+    parser.add_argument("--exit_timeout", default=0.5, type=float)
+    parser.add_argument("--dwell_interval", default=1.0, type=float)
+    parser.add_argument("--sink", default="attach", choices=("attach", "async"),
+                        help="Attach NvDsEventMsgMeta to the frames or queue to a publisher")
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--save", default=None, type=str, help="Write the results as a baseline")
+    parser.add_argument("--check", default=None, type=str,
+                        help="Exit with 1 if the results regress against this baseline")
+    parser.add_argument("--tolerance", default=0.3, type=float,
+                        help="Allowed relative slowdown of the timed metrics")
+    sys.exit(main(parser.parse_args()))
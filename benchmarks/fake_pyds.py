@@ -0,0 +1,307 @@
+"""Pure Python stand-in for the parts of pyds used by the probe path.
+
+Mirrors the attribute names of the DeepStream bindings so pipeline.analytics,
+pipeline.overlay and pipeline.metadata run unchanged on synthetic batches.
+Metadata acquired from the pools or allocated through the bindings is
+counted in ALLOCATIONS, the quantity that puts pressure on the real pools.
+``install()`` must run before any pipeline module is imported.
+"""
+import copy
+import ctypes
+import sys
+from collections import Counter
+from enum import IntEnum
+
+MAX_ELEMENTS_IN_DISPLAY_META = 16
+
+# Metadata allocations by kind since the last reset_allocations()
+ALLOCATIONS = Counter()
+# C buffers handed out by address, kept alive until freed
+_BUFFERS = {}
+
+
+def install() -> None:
+    """Register this module as pyds"""
+    sys.modules["pyds"] = sys.modules[__name__]
+
+
+def reset_allocations() -> None:
+    ALLOCATIONS.clear()
+    _BUFFERS.clear()
+
+
+class NvDsEventType(IntEnum):
+    NVDS_EVENT_ENTRY = 0
+    NVDS_EVENT_EXIT = 1
+    NVDS_EVENT_MOVING = 2
+    NVDS_EVENT_STOPPED = 3
+
+
+class NvDsObjectType(IntEnum):
+    NVDS_OBJECT_TYPE_VEHICLE = 0
+    NVDS_OBJECT_TYPE_PERSON = 1
+    NVDS_OBJECT_TYPE_UNKNOWN = 7
+
+
+class NvDsMetaType(IntEnum):
+    NVDS_EVENT_MSG_META = 8
+
+
+class GList():
+    __slots__ = ("data", "next")
+
+    def __init__(self, data, next=None) -> None:
+        self.data = data
+        self.next = next
+
+
+def glist(items) -> GList:
+    """Linked list of items, None when empty, like the bindings return"""
+    head = None
+    for item in reversed(items):
+        head = GList(item, head)
+    return head
+
+
+class NvOSD_ColorParams():
+    __slots__ = ("red", "green", "blue", "alpha")
+
+    def __init__(self) -> None:
+        self.red = self.green = self.blue = self.alpha = 0.0
+
+    def set(self, red: float, green: float, blue: float, alpha: float) -> None:
+        self.red, self.green, self.blue, self.alpha = red, green, blue, alpha
+
+
+class NvOSD_RectParams():
+    __slots__ = ("left", "top", "width", "height", "border_width", "border_color")
+
+    def __init__(self, left: float, top: float, width: float, height: float) -> None:
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.border_width = 3
+        self.border_color = NvOSD_ColorParams()
+
+
+class NvOSD_TextParams():
+    __slots__ = ("display_text", "set_bg_clr")
+
+    def __init__(self) -> None:
+        self.display_text = ""
+        self.set_bg_clr = 1
+
+
+class NvOSD_LineParams():
+    __slots__ = ("x1", "y1", "x2", "y2", "line_width", "line_color")
+
+    def __init__(self) -> None:
+        self.x1 = self.y1 = self.x2 = self.y2 = 0
+        self.line_width = 0
+        self.line_color = NvOSD_ColorParams()
+
+
+class NvDsLabelInfo():
+    __slots__ = ("result_class_id", "result_label", "result_prob")
+
+    def __init__(self, result_class_id: int, result_label: str, result_prob: float) -> None:
+        self.result_class_id = result_class_id
+        self.result_label = result_label
+        self.result_prob = result_prob
+
+    @staticmethod
+    def cast(data):
+        return data
+
+
+class NvDsClassifierMeta():
+    __slots__ = ("unique_component_id", "label_info_list")
+
+    def __init__(self, unique_component_id: int, labels) -> None:
+        self.unique_component_id = unique_component_id
+        self.label_info_list = glist(labels)
+
+    @staticmethod
+    def cast(data):
+        return data
+
+
+class NvDsObjectMeta():
+    __slots__ = ("class_id", "confidence", "object_id", "rect_params", "text_params",
+                 "unique_component_id", "classifier_meta_list")
+
+    def __init__(self, class_id: int, confidence: float, object_id: int,
+                 rect_params: NvOSD_RectParams, unique_component_id: int = 1) -> None:
+        self.class_id = class_id
+        self.confidence = confidence
+        self.object_id = object_id
+        self.rect_params = rect_params
+        self.text_params = NvOSD_TextParams()
+        self.unique_component_id = unique_component_id
+        self.classifier_meta_list = None
+
+    @staticmethod
+    def cast(data):
+        return data
+
+
+class NvDsFrameMeta():
+    __slots__ = ("source_id", "frame_num", "buf_pts", "ntp_timestamp", "obj_meta_list",
+                 "display_meta_list", "frame_user_meta_list")
+
+    def __init__(self, source_id: int, frame_num: int, objects) -> None:
+        self.source_id = source_id
+        self.frame_num = frame_num
+        self.buf_pts = 0
+        self.ntp_timestamp = 0
+        self.obj_meta_list = glist(objects)
+        self.display_meta_list = []
+        self.frame_user_meta_list = []
+
+    @staticmethod
+    def cast(data):
+        return data
+
+
+class NvDsBatchMeta():
+    __slots__ = ("frame_meta_list",)
+
+    def __init__(self, frames) -> None:
+        self.frame_meta_list = glist(frames)
+
+
+class NvDsDisplayMeta():
+    __slots__ = ("num_lines", "line_params")
+
+    def __init__(self) -> None:
+        self.num_lines = 0
+        self.line_params = [NvOSD_LineParams() for _ in range(MAX_ELEMENTS_IN_DISPLAY_META)]
+
+
+class NvDsBaseMeta():
+    __slots__ = ("meta_type",)
+
+    def __init__(self) -> None:
+        self.meta_type = 0
+
+
+class NvDsUserMeta():
+    __slots__ = ("user_meta_data", "base_meta", "copy_func", "release_func")
+
+    def __init__(self) -> None:
+        self.user_meta_data = None
+        self.base_meta = NvDsBaseMeta()
+
+    @staticmethod
+    def cast(data):
+        return data
+
+
+class NvDsRect():
+    __slots__ = ("top", "left", "width", "height")
+
+    def __init__(self) -> None:
+        self.top = self.left = self.width = self.height = 0.0
+
+
+class NvDsObjectSignature():
+    __slots__ = ("signature", "size")
+
+    def __init__(self) -> None:
+        self.signature = 0
+        self.size = 0
+
+
+class NvDsEventMsgMeta():
+    __slots__ = ("type", "objType", "bbox", "location", "coordinate", "objSignature",
+                 "objClassId", "sensorId", "moduleId", "placeId", "componentId",
+                 "frameId", "confidence", "trackingId", "ts", "objectId", "sensorStr",
+                 "otherAttrs", "videoPath", "extMsg", "extMsgSize")
+
+    def __init__(self) -> None:
+        self.bbox = NvDsRect()
+        self.objSignature = NvDsObjectSignature()
+        self.ts = None
+        self.sensorStr = None
+
+    @staticmethod
+    def cast(data):
+        return data
+
+
+def nvds_acquire_display_meta_from_pool(batch_meta) -> NvDsDisplayMeta:
+    ALLOCATIONS["display_meta"] += 1
+    return NvDsDisplayMeta()
+
+
+def nvds_add_display_meta_to_frame(frame_meta, display_meta) -> None:
+    frame_meta.display_meta_list.append(display_meta)
+
+
+def nvds_acquire_user_meta_from_pool(batch_meta) -> NvDsUserMeta:
+    ALLOCATIONS["user_meta"] += 1
+    return NvDsUserMeta()
+
+
+def nvds_add_user_meta_to_frame(frame_meta, user_meta) -> None:
+    frame_meta.frame_user_meta_list.append(user_meta)
+
+
+def user_copyfunc(user_meta, func) -> None:
+    user_meta.copy_func = func
+
+
+def user_releasefunc(user_meta, func) -> None:
+    user_meta.release_func = func
+
+
+def alloc_nvds_event_msg_meta() -> NvDsEventMsgMeta:
+    ALLOCATIONS["event_msg_meta"] += 1
+    return NvDsEventMsgMeta()
+
+
+def alloc_buffer(size: int) -> int:
+    """Address of a zeroed C buffer, like the bindings return"""
+    ALLOCATIONS["buffer"] += 1
+    buffer = ctypes.create_string_buffer(size)
+    address = ctypes.addressof(buffer)
+    _BUFFERS[address] = buffer
+    return address
+
+
+def generate_ts_rfc3339(address: int, size: int) -> None:
+    stamp = b"1970-01-01T00:00:00.000Z"[:size]
+    ctypes.memmove(address, stamp, len(stamp))
+
+
+def get_ptr(obj):
+    return obj
+
+
+def memdup(ptr, size: int):
+    """Duplicate a C buffer given by address, or a fake struct"""
+    if not isinstance(ptr, int):
+        ALLOCATIONS["event_msg_meta"] += 1
+        return copy.copy(ptr)
+    duplicate = alloc_buffer(size)
+    if ptr:
+        ctypes.memmove(duplicate, ptr, size)
+    return duplicate
+
+
+def get_string(ptr):
+    return ptr
+
+
+def free_buffer(ptr) -> None:
+    if isinstance(ptr, int):
+        _BUFFERS.pop(ptr, None)
+
+
+def unset_callback_funcs() -> None:
+    pass
+
+
+def gst_buffer_get_nvds_batch_meta(buffer):
+    return buffer
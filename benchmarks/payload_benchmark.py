@@ -0,0 +1,92 @@
+"""Size and encode time of the compact payloads against the full schema.
+
+The full schema message mirrors what nvmsgconv emits with payload-type 0:
+one message per object repeating the sensor, place and analytics blocks
+of msgconv_config.txt. Runs on CPU only:
+
+    python3 -m benchmarks.payload_benchmark --objects 20 --frames 300
+"""
+import argparse
+import json
+import random
+import time
+import timeit
+import uuid
+from datetime import datetime, timezone
+
+from pipeline.events import Event, EventType
+from pipeline.payload import CompactEncoder, decode, load_static_metadata
+
+
+def full_schema_message(event: Event, static: dict) -> bytes:
+    sensor, place, analytics = static["sensor0"], static["place0"], static["analytics0"]
+    timestamp = datetime.fromtimestamp(event.timestamp, timezone.utc).isoformat(timespec="milliseconds")
+    message = {
+        "messageid": str(uuid.uuid4()),
+        "mdsversion": "1.0",
+        "@timestamp": timestamp,
+        "place": {"id": place["id"], "name": place["name"], "type": place["type"],
+                  "location": dict(zip(("lat", "lon", "alt"),
+                                       map(float, place["location"].split(";")))),
+                  "aisle": {"id": place["place-sub-field1"], "name": place["place-sub-field2"],
+                            "level": place["place-sub-field3"],
+                            "coordinate": dict(zip("xyz", map(float, place["coordinate"].split(";"))))}},
+        "sensor": {"id": sensor["id"], "type": sensor["type"], "description": sensor["description"],
+                   "location": dict(zip(("lat", "lon", "alt"),
+                                        map(float, sensor["location"].split(";")))),
+                   "coordinate": dict(zip("xyz", map(float, sensor["coordinate"].split(";"))))},
+        "analyticsModule": {"id": analytics["id"], "description": analytics["description"],
+                            "source": analytics["source"], "version": analytics["version"]},
+        "object": {"id": str(event.tracking_id), "speed": 0.0, "direction": 0.0,
+                   "orientation": 0.0, "person": {"age": 0, "gender": "", "hair": "",
+                                                  "cap": "", "apparel": "",
+                                                  "confidence": event.confidence},
+                   "bbox": {"topleftx": int(event.left), "toplefty": int(event.top),
+                            "bottomrightx": int(event.left + event.width),
+                            "bottomrighty": int(event.top + event.height)},
+                   "location": {"lat": 0.0, "lon": 0.0, "alt": 0.0},
+                   "coordinate": {"x": 0.0, "y": 0.0, "z": 0.0}},
+        "event": {"id": str(uuid.uuid4()), "type": event.type.name.lower()},
+        "videoPath": "",
+    }
+    return json.dumps(message, indent=2).encode()
+
+
+def make_events(frames: int, objects: int, rng: random.Random) -> list:
+    now = time.time()
+    return [Event(rng.choice(list(EventType)), 0, frame, rng.randrange(1 << 20),
+                  rng.randrange(4), rng.choice((0, 2)), rng.random(),
+                  (rng.uniform(0, 1800), rng.uniform(0, 950), rng.uniform(20, 120),
+                   rng.uniform(40, 130)), now + frame / 30, rng.uniform(0, 60))
+            for frame in range(frames) for _ in range(objects)]
+
+
+def main(args: argparse.Namespace) -> None:
+    static = load_static_metadata(args.msg_config_path)
+    events = make_events(args.frames, args.objects, random.Random(args.seed))
+
+    encoders = {
+        "full": lambda evs: [(None, full_schema_message(e, static)) for e in evs],
+        "compact-json": CompactEncoder(static, binary=False),
+        "compact-binary": CompactEncoder(static, binary=True),
+    }
+    for name, encoder in encoders.items():
+        messages = encoder(events)
+        if name != "full":
+            decoded = [decode(value) for _, value in messages[1:]]
+            assert sum(len(m["a"]) for m in decoded) == len(events)
+        size = sum(len(value) for _, value in messages)
+        elapsed = min(timeit.repeat(lambda: encoder(events), number=1, repeat=args.repeat))
+        print(f"{name:>15}: {len(messages):6d} messages {size / len(events):8.1f} B/event "
+              f"{1e6 * elapsed / len(events):6.2f} us/event")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--msg_config_path", default="configs/msgconv_config.txt", type=str)
+    parser.add_argument("--frames", default=300, type=int)
+    parser.add_argument("--objects", default=20, type=int)
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+    main(args)
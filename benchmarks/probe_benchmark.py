@@ -0,0 +1,91 @@
+"""Microbenchmark of the per-frame restricted zone evaluation.
+
+Compares the original probe logic, which builds the zone polygon from its
+lines for every object, against the ZoneEngine the probe evaluates every
+batch with, fed the per-object columns the probe collects. Runs on CPU
+only, no DeepStream needed:
+
+    python3 -m benchmarks.probe_benchmark --objects 50 --zones 4
+"""
+import argparse
+import random
+import timeit
+from typing import List, Tuple
+
+from shapely.geometry import MultiLineString, Point
+
+from pipeline.config import compile_config
+from pipeline.zones import ZoneEngine
+
+Box = Tuple[int, float, float, float, float, float]
+
+
+def make_config(num_zones: int) -> dict:
+    zones = []
+    for i in range(num_zones):
+        x0, y0 = 100 + 400 * (i % 4), 100 + 450 * (i // 4 % 2)
+        x1, y1 = x0 + 350, y0 + 400
+        zones.append([[[x0, y0], [x1, y0]], [[x1, y0], [x1, y1]],
+                      [[x1, y1], [x0, y1]], [[x0, y1], [x0, y0]]])
+    return {"0": {"uri": "file:///dev/null", "car_confidence": 0.1,
+                  "person_confidence": 0.1, "restricted_zones": zones}}
+
+
+def make_frame(num_objects: int, rng: random.Random) -> List[Box]:
+    """Objects as (class_id, confidence, left, top, width, height)"""
+    return [(rng.choice((0, 1, 2, 3)), rng.random(),
+             rng.uniform(0, 1800), rng.uniform(0, 950),
+             rng.uniform(20, 120), rng.uniform(40, 130))
+            for _ in range(num_objects)]
+
+
+def legacy_frame(raw_source: dict, frame: List[Box]) -> int:
+    alarms = 0
+    for class_id, confidence, left, top, width, height in frame:
+        if (class_id == 0 and confidence >= raw_source["car_confidence"]) or \
+           (class_id == 2 and confidence >= raw_source["person_confidence"]):
+            position = Point(left + width / 2, top + height)
+            for zone in raw_source["restricted_zones"]:
+                if MultiLineString(zone).convex_hull.contains(position):
+                    alarms += 1
+                    break
+    return alarms
+
+
+def engine_frame(engine: ZoneEngine, frame: List[Box]) -> int:
+    source_ids, class_ids, confidences, xs, ys = [], [], [], [], []
+    for class_id, confidence, left, top, width, height in frame:
+        source_ids.append(0)
+        class_ids.append(class_id)
+        confidences.append(confidence)
+        xs.append(left + width / 2)
+        ys.append(top + height)
+    hits = engine.evaluate(source_ids, class_ids, confidences, xs, ys)
+    return int((hits.zone >= 0).sum())
+
+
+def main(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    raw_config = make_config(args.zones)
+    engine = ZoneEngine(compile_config(raw_config))
+    frames = [make_frame(args.objects, rng) for _ in range(args.frames)]
+
+    assert sum(legacy_frame(raw_config["0"], f) for f in frames) == \
+        sum(engine_frame(engine, f) for f in frames)
+
+    for name, func, data in (("legacy", legacy_frame, raw_config["0"]),
+                             ("engine", engine_frame, engine)):
+        elapsed = min(timeit.repeat(lambda: [func(data, f) for f in frames],
+                                    number=1, repeat=args.repeat))
+        print(f"{name:>10}: {1e6 * elapsed / len(frames):9.1f} us/frame")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--objects", default=50, type=int)
+    parser.add_argument("--zones", default=4, type=int)
+    parser.add_argument("--frames", default=200, type=int)
+    parser.add_argument("--repeat", default=5, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+    main(args)
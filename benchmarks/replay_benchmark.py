@@ -0,0 +1,105 @@
+"""Benchmark of the detection recorder and of the offline replay.
+
+Runs the synthetic scene of batch_benchmark through the probe analytics
+with and without a DetectionRecorder, then replays the recording with the
+same config and checks that the replay emits exactly the events of the live
+run. Reports the recording overhead per frame and the replay speed relative
+to real time:
+
+    python3 -m benchmarks.replay_benchmark --sources 16 --batches 3000
+"""
+from benchmarks import fake_pyds
+fake_pyds.install()
+
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from typing import List
+
+from benchmarks.batch_benchmark import FPS, FRAME_HEIGHT, FRAME_WIDTH, FakeClock, Scene, \
+    make_config, parse_class_mix
+from pipeline.analytics import BatchAnalytics
+from pipeline.config import compile_config
+from pipeline.control import AnalyticsState
+from pipeline.events import Event
+from pipeline.occupancy import OccupancyTracker
+from pipeline.overlay import ZoneOverlay
+from pipeline.publisher import EventPublisher, MemoryTransport
+from pipeline.recording import DetectionRecorder
+from pipeline.replay import ReplayStats, replay
+from pipeline.zones import ZoneEngine
+
+
+def event_key(event: Event):
+    return (event.type, event.source_id, event.frame_num, event.tracking_id, event.zone,
+            event.class_id, round(event.timestamp, 6), round(event.dwell, 6))
+
+
+def run_live(args: argparse.Namespace, sources, batches, recorder) -> (float, List[Event]):
+    clock = FakeClock()
+    state = AnalyticsState(sources, ZoneEngine(sources, FRAME_WIDTH, FRAME_HEIGHT),
+                           ZoneOverlay(sources, interval=0), frozenset())
+    # Not started, submit only queues the events
+    publisher = EventPublisher(MemoryTransport(), max_queue=len(batches) * 1000)
+    occupancy = OccupancyTracker(exit_timeout=args.exit_timeout,
+                                 dwell_interval=args.dwell_interval)
+    analytics = BatchAnalytics(state, occupancy, publisher, clock, recorder=recorder)
+    events = []
+    start = time.perf_counter()
+    for batch in batches:
+        _, batch_events = analytics.process_batch(batch)
+        events.extend(batch_events)
+        clock.now += 1 / FPS
+    elapsed = time.perf_counter() - start
+    clock.now -= 1 / FPS
+    occupancy.flush(clock.now, events)
+    return elapsed, events
+
+
+def main(args: argparse.Namespace) -> int:
+    sources = compile_config(make_config(args.sources, "grid", args.zones))
+    scene = Scene(args.sources, args.objects, parse_class_mix(args.class_mix), [4.0, 2.0],
+                  args.miss_rate, args.seed)
+    batches = [scene.next_batch() for _ in range(args.batches)]
+    frames = args.sources * args.batches
+
+    directory = tempfile.mkdtemp(prefix="recording_")
+    try:
+        plain, _ = run_live(args, sources, batches, None)
+        recorder = DetectionRecorder(directory, FRAME_WIDTH, FRAME_HEIGHT,
+                                     chunk_size=args.chunk_size)
+        recorded, live_events = run_live(args, sources, batches, recorder)
+        recorder.close()
+
+        stats = ReplayStats()
+        replayed = list(replay(directory, sources, exit_timeout=args.exit_timeout,
+                               dwell_interval=args.dwell_interval, stats=stats))
+    finally:
+        shutil.rmtree(directory)
+
+    print(f"frames={frames} detections={stats.detections} events={len(live_events)}")
+    print(f"recording overhead: {1e6 * (recorded - plain) / frames:.2f} us/frame")
+    print(f"replay: {frames / stats.elapsed:.0f} frames/s, "
+          f"{args.batches / FPS / stats.elapsed:.0f}x real time")
+    if [event_key(e) for e in replayed] != [event_key(e) for e in live_events]:
+        print(f"MISMATCH replay emitted {len(replayed)} events, live {len(live_events)}")
+        return 1
+    print("Replay matches the live events")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sources", default=8, type=int)
+    parser.add_argument("--objects", default=20, type=int, help="Tracked objects per source")
+    parser.add_argument("--zones", default=4, type=int, help="Zones per source")
+    parser.add_argument("--class_mix", default="car=0.45,person=0.45,bicycle=0.05,roadsign=0.05")
+    parser.add_argument("--miss_rate", default=0.05, type=float)
+    parser.add_argument("--batches", default=600, type=int)
+    parser.add_argument("--exit_timeout", default=0.5, type=float)
+    parser.add_argument("--dwell_interval", default=1.0, type=float)
+    parser.add_argument("--chunk_size", default=16384, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    sys.exit(main(parser.parse_args()))
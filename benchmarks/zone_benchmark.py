@@ -0,0 +1,87 @@
+"""Benchmark of the batch zone engine against the per-object shapely path.
+
+Every source gets a grid of concave (L shaped) zones, like parking bays,
+and a batch holds one frame per source. Runs on CPU only:
+
+    python3 -m benchmarks.zone_benchmark --sources 16 --zones 100 --objects 30
+"""
+import argparse
+import random
+import timeit
+
+import numpy as np
+
+from pipeline.config import compile_config
+from pipeline.zones import ZoneEngine
+
+
+def l_shaped_zone(x: float, y: float, w: float, h: float) -> list:
+    points = [[x, y], [x + w, y], [x + w, y + h / 2], [x + w / 2, y + h / 2],
+              [x + w / 2, y + h], [x, y + h]]
+    return [[points[i], points[(i + 1) % len(points)]] for i in range(len(points))]
+
+
+def make_config(num_sources: int, num_zones: int) -> dict:
+    columns = int(np.ceil(np.sqrt(num_zones)))
+    w, h = 1920 / columns, 1080 / columns
+    zones = [l_shaped_zone((i % columns) * w + 2, (i // columns) * h + 2, w - 4, h - 4)
+             for i in range(num_zones)]
+    return {str(s): {"uri": "file:///dev/null", "car_confidence": 0.3,
+                     "person_confidence": 0.3, "restricted_zones": zones}
+            for s in range(num_sources)}
+
+
+def shapely_batch(sources, batch) -> list:
+    result = []
+    for source_id, class_id, confidence, x, y in zip(*batch):
+        source = sources[source_id]
+        hit = -1
+        if confidence >= source.threshold(class_id):
+            for index, zone in enumerate(source.zones):
+                if zone.contains(x, y):
+                    hit = index
+                    break
+        result.append(hit)
+    return result
+
+
+def main(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    sources = compile_config(make_config(args.sources, args.zones))
+    engine = ZoneEngine(sources, cell_size=args.cell_size)
+
+    batches = []
+    for _ in range(args.batches):
+        count = args.sources * args.objects
+        batches.append((
+            [s for s in range(args.sources) for _ in range(args.objects)],
+            [rng.choice((0, 1, 2, 3)) for _ in range(count)],
+            [rng.random() for _ in range(count)],
+            [rng.uniform(0, 1920) for _ in range(count)],
+            [rng.uniform(0, 1080) for _ in range(count)],
+        ))
+
+    for batch in batches:
+        expected = shapely_batch(sources, batch)
+        assert engine.evaluate(*batch).zone.tolist() == expected
+
+    objects = args.sources * args.objects
+    for name, func in (("shapely", lambda b: shapely_batch(sources, b)),
+                       ("engine", lambda b: engine.evaluate(*b))):
+        elapsed = min(timeit.repeat(lambda: [func(b) for b in batches],
+                                    number=1, repeat=args.repeat)) / len(batches)
+        print(f"{name:>10}: {1e6 * elapsed:9.1f} us/batch "
+              f"{1e6 * elapsed / objects:7.2f} us/object")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sources", default=16, type=int)
+    parser.add_argument("--zones", default=100, type=int)
+    parser.add_argument("--objects", default=30, type=int)
+    parser.add_argument("--batches", default=20, type=int)
+    parser.add_argument("--cell_size", default=64, type=int)
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+    main(args)
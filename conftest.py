@@ -0,0 +1,6 @@
+"""pytest setup: the repository root is importable and pyds is replaced by
+the pure Python stand-in of benchmarks/fake_pyds.py, so the probe logic runs
+on CPU without DeepStream."""
+from benchmarks import fake_pyds
+
+fake_pyds.install()
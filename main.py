@@ -1,8 +1,75 @@
 import json
 import logging
 import argparse
+import signal
+from typing import List, Optional, Tuple
 
+from pipeline.aggregates import ZoneAggregator
+from pipeline.config import SourceConfig, compile_config
+from pipeline.engines import EngineCache
+from pipeline.flow import QueuePolicy, parse_resolution
+from pipeline.instrumentation import Instrumentation
+from pipeline.interval import IntervalController
+from pipeline.journal import SegmentJournal, SpillingTransport
+from pipeline.metrics import JsonlSnapshotWriter, MetricsRegistry, MetricsServer
 from pipeline.pipeline import Pipeline
+from pipeline.payload import CompactEncoder, load_static_metadata
+from pipeline.publisher import (BACKPRESSURE_POLICIES, COMPRESSIONS, EventPublisher,
+                                create_transport, encode_json)
+from pipeline.recording import DetectionRecorder
+from pipeline.secondary import AttributeCache, SecondaryClassifier, SecondaryGate
+from pipeline.snapshots import SnapshotPool, SnapshotStore
+
+MSG_CONFIG_PATH = "configs/msgconv_config.txt"
+
+
+def create_publisher(args: argparse.Namespace,
+                     sources: List[Optional[SourceConfig]]) -> Optional[EventPublisher]:
+    if args.event_sink == "msgbroker":
+        if not args.protolib_path:
+            raise ValueError("--protolib_path is required by the msgbroker event sink")
+        return None
+    
+    if args.payload == "json":
+        encoder = encode_json
+    else:
+        encoder = CompactEncoder(load_static_metadata(MSG_CONFIG_PATH),
+                                 binary=args.payload == "compact-binary",
+                                 sources=sources)
+    
+    transport = create_transport(args.transport, args.connection_string)
+    if args.spill_dir:
+        journal = SegmentJournal(args.spill_dir,
+                                 segment_size=args.spill_segment_mb << 20,
+                                 max_bytes=args.spill_max_mb << 20,
+                                 max_age=args.spill_max_age)
+        transport = SpillingTransport(transport, journal)
+    return EventPublisher(transport,
+                          encoder=encoder,
+                          max_queue=args.max_queue,
+                          backpressure=args.backpressure,
+                          max_batch=args.max_batch,
+                          linger=args.linger_ms / 1000,
+                          compression=args.compression)
+
+
+def create_instrumentation(args: argparse.Namespace) -> Tuple[Optional[Instrumentation],
+                                                              Optional[MetricsServer]]:
+    if not (args.instrumentation or args.metrics_port or args.metrics_jsonl):
+        return None, None
+    
+    registry = MetricsRegistry()
+    writer = JsonlSnapshotWriter(registry, args.metrics_jsonl) if args.metrics_jsonl else None
+    instrumentation = Instrumentation(registry,
+                                      enabled=args.instrumentation,
+                                      poll_interval=args.metrics_interval,
+                                      snapshot_writer=writer)
+    instrumentation.toggle_on_signal(signal.SIGUSR1)
+    server = None
+    if args.metrics_port:
+        server = MetricsServer(registry, args.metrics_port, toggle=instrumentation.set_enabled,
+                               host=args.metrics_host)
+    return instrumentation, server
 
 
 def main(args: argparse.Namespace)-> None:
@@ -10,19 +77,233 @@ def main(args: argparse.Namespace)-> None:
     with open(args.config_path, "r") as file:
         app_config = json.load(file)
     
+    logging.info("Compiling the application config")
+    sources = compile_config(app_config)
+    
+    publisher = create_publisher(args, sources)
+    instrumentation, metrics_server = create_instrumentation(args)
+    
+    interval_controller = None
+    if args.adaptive_interval:
+        interval_controller = IntervalController(args.target_latency_ms / 1000,
+                                                 max_interval=args.max_interval)
+    
+    snapshots = None
+    if args.snapshot_dir:
+        if publisher is None:
+            raise ValueError("--snapshot_dir requires --event_sink async")
+        snapshots = SnapshotPool(SnapshotStore(args.snapshot_dir), publisher.submit,
+                                 workers=args.snapshot_workers,
+                                 max_pending=args.snapshot_queue,
+                                 min_interval=args.snapshot_interval,
+                                 max_size=args.snapshot_size)
+    
+    aggregator = None
+    if args.summary_window > 0:
+        if publisher is None:
+            raise ValueError("--summary_window requires --event_sink async")
+        aggregator = ZoneAggregator(args.summary_window, tuple(args.summary_grid))
+    elif args.summary_only:
+        raise ValueError("--summary_only requires --summary_window")
+    
+    recorder = None
+    if args.record_dir:
+        recorder = DetectionRecorder(args.record_dir, chunk_size=args.record_chunk_size)
+    
+    secondary = None
+    if args.secondary:
+        secondary = SecondaryGate(SecondaryClassifier.parse_all(args.secondary),
+                                  AttributeCache(ttl=args.attribute_ttl,
+                                                 retry=args.attribute_retry))
+    
+    engine_cache = None
+    if args.engine_cache_dir:
+        engine_cache = EngineCache(args.engine_cache_dir, max_entries=args.engine_cache_size)
+    
     logging.info("Building the pipeline")
-    pipeline = Pipeline(app_config,
+    pipeline = Pipeline(sources,
                         protolib_path=args.protolib_path,
-                        connection_string=args.connection_string)
+                        connection_string=args.connection_string,
+                        overlay_interval=args.overlay_interval,
+                        exit_timeout=args.exit_timeout,
+                        dwell_interval=args.dwell_interval,
+                        publisher=publisher,
+                        instrumentation=instrumentation,
+                        profile=args.profile,
+                        output_path=args.output_path,
+                        rtsp_port=args.rtsp_port,
+                        gpu_id=args.gpu_id,
+                        batch_size=args.batch_size,
+                        tracker_config_path=args.tracker_config if args.tracker else None,
+                        interval_controller=interval_controller,
+                        engine_cache=engine_cache,
+                        roi=args.roi,
+                        roi_padding=args.roi_padding,
+                        roi_object_height=args.roi_object_height,
+                        source_timeout=args.source_timeout,
+                        max_reconnect_backoff=args.max_reconnect_backoff,
+                        max_reconnect_failures=args.max_reconnect_failures,
+                        snapshots=snapshots,
+                        recorder=recorder,
+                        branch_policies={
+                            "messaging": QueuePolicy.parse(args.messaging_queue),
+                            "output": QueuePolicy.parse(args.output_queue),
+                        },
+                        muxer_resolution=parse_resolution(args.muxer_resolution),
+                        muxer_push_timeout=args.muxer_push_timeout_us,
+                        aggregator=aggregator,
+                        publish_events=not args.summary_only,
+                        secondary=secondary)
+    
+    if args.watch_config:
+        pipeline.watch_config(args.config_path)
     
     logging.info("Starting pipeline")
-    pipeline.run()
+    if metrics_server is not None:
+        metrics_server.start()
+    if publisher is not None:
+        publisher.start()
+    try:
+        pipeline.run()
+    finally:
+        # The pool publishes the events of its pending snapshots
+        if snapshots is not None:
+            snapshots.close()
+        # Exits of the objects still inside a zone, then the last, partial window
+        pipeline.close_analytics()
+        if recorder is not None:
+            recorder.close()
+        if publisher is not None:
+            publisher.close()
+        if metrics_server is not None:
+            metrics_server.close()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--config_path", required=True, type=str)
-    parser.add_argument("--protolib_path", required=True, type=str)
-    parser.add_argument("--connection_string", required=True, type=str)
+    parser.add_argument("--protolib_path", type=str)
+    parser.add_argument("--connection_string", required=True, type=str,
+                        help="<host>;<port>;<topic> for kafka, output path for the file transport")
+    parser.add_argument("--event_sink", default="msgbroker", choices=("msgbroker", "async"),
+                        help="Publish through nvmsgbroker or an asynchronous batched producer")
+    parser.add_argument("--transport", default="kafka", choices=("kafka", "file", "memory"),
+                        help="Transport of the async event sink")
+    parser.add_argument("--payload", default="json", choices=("json", "compact-json", "compact-binary"),
+                        help="Payload of the async event sink, compact ones send one message per frame")
+    parser.add_argument("--backpressure", default="drop_oldest", choices=BACKPRESSURE_POLICIES)
+    parser.add_argument("--max_queue", default=10000, type=int)
+    parser.add_argument("--max_batch", default=500, type=int)
+    parser.add_argument("--linger_ms", default=50.0, type=float)
+    parser.add_argument("--compression", default=None, choices=tuple(COMPRESSIONS))
+    parser.add_argument("--profile", default="display",
+                        help="Topology profile of configs/topology.json: display, headless or encode")
+    parser.add_argument("--output_path", default=None, type=str,
+                        help="Output file of the encode profile")
+    parser.add_argument("--rtsp_port", default=0, type=int,
+                        help="Serve the encode profile output over RTSP on this port instead of "
+                             "writing --output_path, 0 disables it")
+    parser.add_argument("--overlay_interval", default=1, type=int,
+                        help="Draw the restricted zones every N frames, 0 disables them")
+    parser.add_argument("--exit_timeout", default=2.0, type=float,
+                        help="Seconds an object must be absent from a zone to emit its exit event")
+    parser.add_argument("--dwell_interval", default=0.0, type=float,
+                        help="Seconds between dwell events of an object in a zone, 0 disables them")
+    parser.add_argument("--watch_config", action="store_true",
+                        help="Apply changes of the config file at runtime without a restart")
+    parser.add_argument("--instrumentation", action="store_true",
+                        help="Enable the timing probes at startup, SIGUSR1 toggles them at runtime")
+    parser.add_argument("--metrics_port", default=0, type=int,
+                        help="Serve Prometheus metrics on this port, 0 disables the endpoint")
+    parser.add_argument("--metrics_host", default="127.0.0.1", type=str,
+                        help="Address the unauthenticated metrics endpoint listens on, "
+                             "0.0.0.0 for every interface")
+    parser.add_argument("--metrics_jsonl", default=None, type=str,
+                        help="Append periodic metrics snapshots to this file")
+    parser.add_argument("--metrics_interval", default=1.0, type=float)
+    parser.add_argument("--gpu_id", default=0, type=int,
+                        help="GPU the DeepStream elements run on")
+    parser.add_argument("--batch_size", default=None, type=int,
+                        help="Inference batch size, defaults to the number of sources")
+    parser.add_argument("--tracker", action="store_true", default=True,
+                        help="Track the objects, the default, the occupancy events are keyed "
+                             "by tracking id")
+    parser.add_argument("--no_tracker", dest="tracker", action="store_false",
+                        help="Run without the tracker, every object in a zone is then one "
+                             "occupant, for detection-only setups")
+    parser.add_argument("--tracker_config", default="configs/tracker_config.txt", type=str)
+    parser.add_argument("--adaptive_interval", action="store_true",
+                        help="Skip inferences under load, the tracker fills in the skipped frames")
+    parser.add_argument("--target_latency_ms", default=100.0, type=float,
+                        help="Batch latency the adaptive interval keeps under")
+    parser.add_argument("--max_interval", default=4, type=int,
+                        help="Highest inference interval of the adaptive interval")
+    parser.add_argument("--engine_cache_dir", default="model/engines", type=str,
+                        help="Keep the TensorRT engines built here, empty to disable the cache")
+    parser.add_argument("--engine_cache_size", default=8, type=int,
+                        help="Engines kept in the cache, the least recently used are deleted")
+    parser.add_argument("--roi", action="store_true",
+                        help="Only infer on the regions around the restricted zones")
+    parser.add_argument("--roi_padding", default=16, type=int,
+                        help="Margin in pixels around the zones of the regions of interest")
+    parser.add_argument("--roi_object_height", default=200, type=int,
+                        help="Upward extension of the regions so objects standing in a zone fit")
+    parser.add_argument("--source_timeout", default=0.0, type=float,
+                        help="Reconnect live sources silent for this many seconds, 0, the "
+                             "default, disables it")
+    parser.add_argument("--max_reconnect_backoff", default=60.0, type=float,
+                        help="Longest delay between two reconnection attempts of a source")
+    parser.add_argument("--max_reconnect_failures", default=0, type=int,
+                        help="Give a source up after this many failures in a row, 0, the "
+                             "default, reconnects it forever")
+    parser.add_argument("--snapshot_dir", default=None, type=str,
+                        help="Store a JPEG crop of the object of every alarm in this directory, "
+                             "async event sink only")
+    parser.add_argument("--snapshot_workers", default=2, type=int)
+    parser.add_argument("--snapshot_queue", default=32, type=int,
+                        help="Snapshots pending at most, alarms beyond it are sent without one")
+    parser.add_argument("--snapshot_interval", default=10.0, type=float,
+                        help="Seconds between two snapshots of the same track")
+    parser.add_argument("--snapshot_size", default=256, type=int,
+                        help="Longest side of the snapshots in pixels")
+    parser.add_argument("--record_dir", default=None, type=str,
+                        help="Record the detections to this directory, see replay.py")
+    parser.add_argument("--record_chunk_size", default=65536, type=int,
+                        help="Detections per recording chunk")
+    parser.add_argument("--spill_dir", default=None, type=str,
+                        help="Journal events to this directory while the broker is down or "
+                             "slow, async event sink only")
+    parser.add_argument("--spill_segment_mb", default=64, type=int)
+    parser.add_argument("--spill_max_mb", default=1024, type=int,
+                        help="Disk space of the journal, the oldest events are dropped beyond it")
+    parser.add_argument("--spill_max_age", default=86400.0, type=float,
+                        help="Seconds after which journaled events are dropped")
+    parser.add_argument("--messaging_queue", default="block", type=str,
+                        help="Backpressure of the event branch, block or "
+                             "leaky[:<max buffers>[:<max ms>]], events are lost when leaky")
+    parser.add_argument("--output_queue", default="block", type=str,
+                        help="Backpressure of the display or encoder branch, with leaky a "
+                             "slow renderer drops frames instead of stalling the inference")
+    parser.add_argument("--muxer_resolution", default="1920x1080", type=str,
+                        help="Muxer output WIDTHxHEIGHT, or auto for the largest configured "
+                             "source resolution. The zones are in these coordinates")
+    parser.add_argument("--muxer_push_timeout_us", default=None, type=int,
+                        help="Muxer batch timeout, derived from the source frame rates by default")
+    parser.add_argument("--summary_window", default=0.0, type=float,
+                        help="Publish per-zone occupancy, dwell and heatmap summaries every "
+                             "this many seconds, async event sink only")
+    parser.add_argument("--summary_grid", default=[16, 9], type=int, nargs=2,
+                        metavar=("COLUMNS", "ROWS"), help="Cells of the summary heatmaps")
+    parser.add_argument("--summary_only", action="store_true",
+                        help="Publish the zone summaries only, not the individual events")
+    parser.add_argument("--secondary", default=[], action="append", metavar="NAME=CONFIG",
+                        help="Secondary classifier run on the tracked objects inside the zones, "
+                             "its label is reported under NAME, e.g. "
+                             "vehicle_type=configs/sgie_vehicletypes_config.txt. Repeatable, "
+                             "not with --no_tracker")
+    parser.add_argument("--attribute_ttl", default=30.0, type=float,
+                        help="Seconds the classifier labels of a track are reused")
+    parser.add_argument("--attribute_retry", default=1.0, type=float,
+                        help="Seconds before a track left unlabeled is classified again")
     args = parser.parse_args()
     main(args)
\ No newline at end of file
@@ -0,0 +1,248 @@
+"""Periodic per-zone occupancy and heatmap aggregates.
+
+Consumers that only need how busy the zones are over time get one summary
+per source and window instead of one message per object event. The
+accumulators of all the zones of all the sources live in flat NumPy arrays,
+a zone being addressed by the offset of its source plus its index, so a
+batch of zone hits is accumulated with a few ``bincount`` calls:
+
+* occupancy: objects inside the zone per frame, summed and maximum
+* entries and exits, and the dwell time of the exited objects
+* heatmap: feet positions of the objects inside the zone on a coarse grid
+  over the muxer frame
+
+Nothing here needs pyds, the accumulators can be fed synthetic hits.
+"""
+import json
+from typing import Collection, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from pipeline.config import SourceConfig
+from pipeline.events import Event, EventType
+from pipeline.publisher import Message
+from pipeline.zones import ZoneHits
+
+SUMMARY_VERSION = 1
+
+
+class ZoneSummary():
+    """Aggregates of the zones of one source over one window.
+
+    The per zone arrays are indexed by zone.
+    """
+    __slots__ = ("source_id", "start", "end", "frames", "mean_occupancy", "max_occupancy",
+                 "entries", "exits", "mean_dwell", "heatmap")
+
+    def __init__(self, source_id: int, start: float, end: float, frames: int,
+                 mean_occupancy: np.ndarray, max_occupancy: np.ndarray, entries: np.ndarray,
+                 exits: np.ndarray, mean_dwell: np.ndarray, heatmap: np.ndarray) -> None:
+        self.source_id = source_id
+        self.start = start
+        self.end = end
+        # Frames of the source seen in the window
+        self.frames = frames
+        self.mean_occupancy = mean_occupancy
+        self.max_occupancy = max_occupancy
+        self.entries = entries
+        self.exits = exits
+        # Of the objects that exited in the window, 0 without exits
+        self.mean_dwell = mean_dwell
+        # (zones, rows, columns) hit counts
+        self.heatmap = heatmap
+
+    def to_dict(self) -> Dict:
+        rows, columns = self.heatmap.shape[1:]
+        return {
+            "v": SUMMARY_VERSION,
+            "kind": "zones",
+            "s": self.source_id,
+            "t0": round(self.start, 3),
+            "t1": round(self.end, 3),
+            "f": self.frames,
+            "occ": np.round(self.mean_occupancy, 3).tolist(),
+            "max": self.max_occupancy.tolist(),
+            "in": self.entries.tolist(),
+            "out": self.exits.tolist(),
+            "dwell": np.round(self.mean_dwell, 3).tolist(),
+            "grid": [columns, rows],
+            "heat": [zone.ravel().tolist() for zone in self.heatmap],
+        }
+
+    def __repr__(self) -> str:
+        return (f"ZoneSummary(source={self.source_id}, {self.end - self.start:.1f}s, "
+                f"frames={self.frames}, zones={len(self.entries)})")
+
+
+def encode_summary(summary: ZoneSummary) -> Message:
+    """Encode a summary as minimal JSON, keyed by source like the events"""
+    return (str(summary.source_id).encode(),
+            json.dumps(summary.to_dict(), separators=(",", ":")).encode())
+
+
+class ZoneAggregator():
+    """Accumulates the zone hits of the batches into per window summaries.
+
+    Args:
+        window (float): Seconds covered by a summary
+        grid (Tuple[int, int]): Columns and rows of the heatmaps
+    """
+
+    def __init__(self, window: float = 60.0, grid: Tuple[int, int] = (16, 9)) -> None:
+        if window <= 0:
+            raise ValueError("The summary window must be positive")
+        if grid[0] < 1 or grid[1] < 1:
+            raise ValueError("The heatmap grid needs at least one cell")
+        self.window = window
+        self.grid = grid
+        self._frame_width = 1920
+        self._frame_height = 1080
+        self._source_ids = np.empty(0, dtype=np.int64)
+        self._offsets = np.full(0, -1, dtype=np.int64)
+        self._num_zones = np.zeros(0, dtype=np.int64)
+        self._total = 0
+        self._window_start = None
+        self._allocate()
+
+    def configure(self, sources: List[Optional[SourceConfig]], frame_width: int,
+                  frame_height: int) -> None:
+        """Lay the accumulators out for a config, the current window is discarded
+
+        Args:
+            sources (List[Optional[SourceConfig]]): Compiled sources indexed by source id
+            frame_width (int): Width of the muxer output
+            frame_height (int): Height of the muxer output
+        """
+        self._frame_width = frame_width
+        self._frame_height = frame_height
+        # Zone offset of every source id, -1 for the sources without zones
+        offsets = np.full(len(sources), -1, dtype=np.int64)
+        num_zones = np.zeros(len(sources), dtype=np.int64)
+        total = 0
+        for source in sources:
+            if source is None or not source.zones:
+                continue
+            offsets[source.source_id] = total
+            num_zones[source.source_id] = len(source.zones)
+            total += len(source.zones)
+        self._source_ids = np.flatnonzero(offsets >= 0)
+        self._offsets = offsets
+        self._num_zones = num_zones
+        self._total = total
+        self._allocate()
+        self._window_start = None
+
+    def _allocate(self) -> None:
+        columns, rows = self.grid
+        self._frames = np.zeros(len(self._offsets), dtype=np.int64)
+        self._occupancy = np.zeros(self._total, dtype=np.int64)
+        self._max_occupancy = np.zeros(self._total, dtype=np.int64)
+        self._entries = np.zeros(self._total, dtype=np.int64)
+        self._exits = np.zeros(self._total, dtype=np.int64)
+        self._dwell = np.zeros(self._total, dtype=np.float64)
+        self._heatmap = np.zeros(self._total * rows * columns, dtype=np.int64)
+
+    def update(self, now: float, frame_source_ids: Collection[int],
+               source_ids: Sequence[int], hits: Optional[ZoneHits],
+               feet_xs: Sequence[float], feet_ys: Sequence[float],
+               events: Sequence[Event]) -> List[ZoneSummary]:
+        """Accumulate a batch, called from the probe
+
+        The summaries of the window are returned once it has elapsed, the
+        batch then starts the next window.
+
+        Args:
+            now (float): Analytics time of the batch
+            frame_source_ids (Collection[int]): Source of every frame of the batch
+            source_ids (Sequence[int]): Source of every object of the batch
+            hits (Optional[ZoneHits]): Zone evaluation of the objects, None without objects
+            feet_xs (Sequence[float]): Bottom center x of every object
+            feet_ys (Sequence[float]): Bottom center y of every object
+            events (Sequence[Event]): Events emitted for the batch
+
+        Returns:
+            List[ZoneSummary]: Summaries of the elapsed window, if any
+        """
+        summaries = []
+        if self._window_start is None:
+            self._window_start = now
+        elif now - self._window_start >= self.window:
+            summaries = self.summarize(now)
+            self._window_start = now
+        if not self._total:
+            return summaries
+
+        offsets = self._offsets
+        frames = [source_id for source_id in frame_source_ids if source_id < len(offsets)]
+        self._frames[frames] += 1
+
+        if hits is not None and len(hits.hit_objects):
+            objects = hits.hit_objects
+            zones = offsets[np.asarray(source_ids)[objects]] + hits.hit_zones
+            # A batch holds at most one frame per source, so the counts of
+            # the batch are the occupancies of its frames
+            counts = np.bincount(zones, minlength=self._total)
+            self._occupancy += counts
+            np.maximum(self._max_occupancy, counts, out=self._max_occupancy)
+
+            columns, rows = self.grid
+            xs = np.asarray(feet_xs, dtype=np.float64)[objects]
+            ys = np.asarray(feet_ys, dtype=np.float64)[objects]
+            cx = np.clip((xs * columns / self._frame_width).astype(np.int64), 0, columns - 1)
+            cy = np.clip((ys * rows / self._frame_height).astype(np.int64), 0, rows - 1)
+            cells = (zones * rows + cy) * columns + cx
+            self._heatmap += np.bincount(cells, minlength=len(self._heatmap))
+
+        self.add_events(events)
+        return summaries
+
+    def add_events(self, events: Sequence[Event]) -> None:
+        """Count the entries and exits of events in the current window
+
+        Used on their own for the exits flushed when the window is cut
+        short, by a config change or on shutdown, which belong to the
+        window being summarized rather than to the next one.
+
+        Args:
+            events (Sequence[Event]): Events emitted since the last update
+        """
+        offsets = self._offsets
+        for event in events:
+            if event.source_id >= len(offsets) or offsets[event.source_id] < 0:
+                continue
+            zone = offsets[event.source_id] + event.zone
+            if event.type == EventType.ENTRY:
+                self._entries[zone] += 1
+            elif event.type == EventType.EXIT:
+                self._exits[zone] += 1
+                self._dwell[zone] += event.dwell
+
+    def summarize(self, now: float) -> List[ZoneSummary]:
+        """Summaries of the current window, the accumulators are reset
+
+        Args:
+            now (float): End of the window
+
+        Returns:
+            List[ZoneSummary]: One summary per source with zones that had frames
+        """
+        if self._window_start is None:
+            return []
+        columns, rows = self.grid
+        heatmap = self._heatmap.reshape(self._total, rows, columns)
+        summaries = []
+        for source_id in self._source_ids.tolist():
+            frames = int(self._frames[source_id])
+            if not frames:
+                continue
+            start = self._offsets[source_id]
+            zones = slice(start, start + self._num_zones[source_id])
+            exits = self._exits[zones].copy()
+            summaries.append(ZoneSummary(
+                source_id, self._window_start, now, frames,
+                self._occupancy[zones] / frames, self._max_occupancy[zones].copy(),
+                self._entries[zones].copy(), exits,
+                self._dwell[zones] / np.maximum(exits, 1), heatmap[zones].copy()))
+        self._allocate()
+        self._window_start = now
+        return summaries
@@ -0,0 +1,273 @@
+"""Per-batch analytics run by the pipeline probe.
+
+Walks the frame and object metadata of a batch, evaluates the zones, feeds
+the occupancy state machine and hands the resulting events to the publisher
+or attaches them to the frames. Only pyds is needed, no GStreamer, so the
+probe path can be driven with synthetic metadata, see benchmarks/.
+"""
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pyds
+
+from pipeline.aggregates import ZoneAggregator, ZoneSummary, encode_summary
+from pipeline.config import SourceConfig
+from pipeline.control import AnalyticsState
+from pipeline.events import Event
+from pipeline.metadata import EventMetaFactory, meta_copy_func, meta_free_func
+from pipeline.occupancy import OccupancyTracker
+from pipeline.publisher import EventPublisher
+from pipeline.recording import DetectionRecorder
+from pipeline.secondary import GATE_COMPONENT_ID, SecondaryGate
+from pipeline.snapshots import SnapshotPool
+from pipeline.zones import ZoneHits
+
+
+class BatchAnalytics():
+    """Analytics of the batches flowing through the probe pad.
+
+    Args:
+        state (AnalyticsState): Initial compiled config
+        occupancy (OccupancyTracker): Zone occupancy state machine
+        publisher (Optional[EventPublisher]): Asynchronous event sink, events
+            are attached to the frames as NvDsEventMsgMeta when None
+        clock (Callable[[], float]): Wall clock of the events
+        event_meta (Optional[EventMetaFactory]): Builds the attached event metas
+        snapshots (Optional[SnapshotPool]): Takes the snapshots of the alarms
+            and publishes their events, requires the publisher
+        recorder (Optional[DetectionRecorder]): Records the detections of
+            every batch for offline replay
+        aggregator (Optional[ZoneAggregator]): Accumulates the zone hits and
+            publishes periodic summaries, requires the publisher
+        publish_events (bool): Publish the events, False to only publish
+            the summaries of the aggregator
+        secondary (Optional[SecondaryGate]): Collects the labels of the
+            objects classified by the secondary classifiers and attaches the
+            attributes of their track to the events
+    """
+
+    def __init__(self, state: AnalyticsState, occupancy: OccupancyTracker,
+                 publisher: Optional[EventPublisher] = None,
+                 clock: Callable[[], float] = time.time,
+                 event_meta: Optional[EventMetaFactory] = None,
+                 snapshots: Optional[SnapshotPool] = None,
+                 recorder: Optional[DetectionRecorder] = None,
+                 aggregator: Optional[ZoneAggregator] = None,
+                 publish_events: bool = True,
+                 secondary: Optional[SecondaryGate] = None) -> None:
+        if snapshots is not None and publisher is None:
+            raise ValueError("Snapshots are only published by the asynchronous event sink")
+        if aggregator is not None and publisher is None:
+            raise ValueError("Zone summaries are only published by the asynchronous event sink")
+        if not publish_events and aggregator is None:
+            raise ValueError("Without events, only the zone summaries can be published")
+        if snapshots is not None and not publish_events:
+            raise ValueError("Snapshots are only taken for published events")
+        # Swapped as a whole by the pipeline on config reload
+        self.state = state
+        self.occupancy = occupancy
+        self._applied_state = state
+        self._publisher = publisher
+        self._clock = clock
+        self.event_meta = event_meta or EventMetaFactory(clock)
+        self._snapshots = snapshots
+        self._recorder = recorder
+        self._aggregator = aggregator
+        self._publish_events = publish_events
+        self._secondary = secondary
+        if aggregator is not None:
+            aggregator.configure(state.sources, state.zone_engine.frame_width,
+                                 state.zone_engine.frame_height)
+
+    def process_batch(self, batch_meta,
+                      frame_image: Optional[Callable] = None) -> Tuple[Dict, List[Event]]:
+        """Run the analytics on a batch
+
+        Args:
+            batch_meta (pyds.NvDsBatchMeta): Metadata of the batch
+            frame_image (Optional[Callable]): Maps the RGBA image of a frame
+                meta, for the snapshots
+
+        Returns:
+            Tuple[Dict, List[Event]]: Frame metas by source id and the events emitted
+        """
+        # The state is read once so the whole batch sees a single config
+        state = self.state
+        l_frame = batch_meta.frame_meta_list
+
+        secondary = self._secondary
+        # Detections of the whole batch, evaluated in one pass
+        frames = {}
+        first_frame_meta = None
+        objects = []
+        source_ids = []
+        class_ids = []
+        confidences = []
+        feet_xs = []
+        feet_ys = []
+
+        while l_frame is not None:
+            try:
+                frame_meta = pyds.NvDsFrameMeta.cast(l_frame.data)
+            except StopIteration:
+                break
+
+            source_id = frame_meta.source_id
+            frames[source_id] = frame_meta
+            if first_frame_meta is None:
+                first_frame_meta = frame_meta
+
+            # Display the restricted zones
+            state.zone_overlay.draw(batch_meta, frame_meta)
+
+            l_obj = frame_meta.obj_meta_list
+
+            while l_obj is not None:
+                try:
+                    obj_meta = pyds.NvDsObjectMeta.cast(l_obj.data)
+                except StopIteration:
+                    break
+
+                rect_params = obj_meta.rect_params
+                objects.append((obj_meta, frame_meta))
+                source_ids.append(source_id)
+                class_ids.append(obj_meta.class_id)
+                confidences.append(obj_meta.confidence)
+                feet_xs.append(rect_params.left + rect_params.width / 2)
+                feet_ys.append(rect_params.top + rect_params.height)
+                if secondary is not None and obj_meta.unique_component_id == GATE_COMPONENT_ID:
+                    secondary.collect(obj_meta, source_id)
+
+                try:
+                    l_obj = l_obj.next
+                except StopIteration:
+                    break
+
+            try:
+                l_frame = l_frame.next
+            except StopIteration:
+                break
+
+        now = self._clock()
+        if self._recorder is not None:
+            self._recorder.record(now, frames, objects, class_ids, confidences)
+        events = []
+        aggregator = self._aggregator
+        flushed = 0
+        if state is not self._applied_state:
+            self._applied_state = state
+            self.occupancy.flush(now, events, state.reset_sources)
+            if aggregator is not None:
+                # The zones may have changed, the window is cut short with its exits
+                aggregator.add_events(events)
+                self._publish_summaries(aggregator.summarize(now))
+                aggregator.configure(state.sources, state.zone_engine.frame_width,
+                                     state.zone_engine.frame_height)
+                flushed = len(events)
+        hits = None
+        if objects:
+            hits = self._evaluate_objects(state.zone_engine, objects, source_ids, class_ids,
+                                          confidences, feet_xs, feet_ys, now, events)
+        self.occupancy.expire(now, events)
+        if secondary is not None:
+            for event in events:
+                event.attributes = secondary.attributes(event.source_id, event.tracking_id)
+        if aggregator is not None:
+            self._publish_summaries(aggregator.update(now, frames.keys(), source_ids, hits,
+                                                      feet_xs, feet_ys, events[flushed:]))
+
+        if self._publisher is not None:
+            snapshots = self._snapshots
+            for event in events if self._publish_events else ():
+                if snapshots is not None:
+                    frame_meta = frames.get(event.source_id)
+                    image = None
+                    if frame_image is not None and frame_meta is not None:
+                        image = lambda frame_meta=frame_meta: frame_image(frame_meta)
+                    if snapshots.submit(event, image):
+                        # Published by the pool once the snapshot of the track is stored
+                        continue
+                self._publisher.submit(event)
+        elif first_frame_meta is not None:
+            sources = state.sources
+            for event in events:
+                # Exits are reported on the current frame of their source if present
+                frame_meta = frames.get(event.source_id, first_frame_meta)
+                source = sources[event.source_id] if event.source_id < len(sources) else None
+                self._attach_event(batch_meta, frame_meta, event, source)
+
+        return frames, events
+
+    def close(self) -> List[Event]:
+        """Exit the tracked occupancies and publish the last, partial window,
+        called once no more batches flow
+
+        Without the publisher the EXIT events have no frame to be attached
+        to, they are only returned.
+
+        Returns:
+            List[Event]: EXIT events of the objects still inside a zone
+        """
+        now = self._clock()
+        events = []
+        self.occupancy.flush(now, events)
+        if self._secondary is not None:
+            for event in events:
+                event.attributes = self._secondary.attributes(event.source_id, event.tracking_id)
+        if self._aggregator is not None:
+            self._aggregator.add_events(events)
+            self._publish_summaries(self._aggregator.summarize(now))
+        if self._publisher is not None and self._publish_events:
+            for event in events:
+                self._publisher.submit(event)
+        elif events:
+            logging.warning(f"{len(events)} EXIT events on shutdown are not published")
+        return events
+
+    def _publish_summaries(self, summaries: List[ZoneSummary]) -> None:
+        for summary in summaries:
+            self._publisher.submit_message(encode_summary(summary))
+
+    def _evaluate_objects(self, zone_engine, objects, source_ids, class_ids, confidences,
+                          feet_xs, feet_ys, now, events) -> ZoneHits:
+        hits = zone_engine.evaluate(source_ids, class_ids, confidences, feet_xs, feet_ys)
+        confident = hits.confident.tolist()
+        zones = hits.zone.tolist()
+
+        for i, (obj_meta, frame_meta) in enumerate(objects):
+            # Only high confidence detections are displayed
+            if not confident[i]:
+                obj_meta.rect_params.border_width = 0
+                obj_meta.text_params.display_text = ""
+                obj_meta.text_params.set_bg_clr = 0
+            elif zones[i] < 0:
+                # Making all the boxes outside the zones green
+                obj_meta.rect_params.border_color.set(0, 1.0, 0, 1.0)
+            else:
+                obj_meta.rect_params.border_color.set(1.0, 0, 0, 1.0)
+
+        # Every (object, zone) pair feeds the occupancy state machine
+        for i, zone in zip(hits.hit_objects.tolist(), hits.hit_zones.tolist()):
+            obj_meta, frame_meta = objects[i]
+            rect_params = obj_meta.rect_params
+            self.occupancy.observe(
+                now, frame_meta.source_id, obj_meta.object_id, zone, frame_meta.frame_num,
+                obj_meta.class_id, obj_meta.confidence,
+                (rect_params.left, rect_params.top, rect_params.width, rect_params.height),
+                events
+            )
+        return hits
+
+    def _attach_event(self, batch_meta, frame_meta, event: Event,
+                      source: Optional[SourceConfig]) -> None:
+        msg_meta = self.event_meta.create(event, frame_meta, source)
+        user_event_meta = pyds.nvds_acquire_user_meta_from_pool(batch_meta)
+        if user_event_meta:
+            user_event_meta.user_meta_data = msg_meta
+            user_event_meta.base_meta.meta_type = pyds.NvDsMetaType.NVDS_EVENT_MSG_META
+            pyds.user_copyfunc(user_event_meta, meta_copy_func)
+            pyds.user_releasefunc(user_event_meta, meta_free_func)
+            pyds.nvds_add_user_meta_to_frame(frame_meta, user_event_meta)
+        else:
+            logging.warning("Error in attaching event meta to buffer")
@@ -0,0 +1,30 @@
+"""Exponential backoff of the retried operations.
+
+Shared by the worker supervisor, the source watchdog and the journal
+forwarder, it only depends on the standard library so none of them pulls
+in the others.
+"""
+
+
+class Backoff():
+    """Exponential retry delay, reset after a run long enough
+
+    Args:
+        initial (float): First delay in seconds
+        maximum (float): Upper bound of the delay
+        reset_after (float): Uptime after which the delay starts over
+    """
+
+    def __init__(self, initial: float = 1.0, maximum: float = 60.0,
+                 reset_after: float = 60.0) -> None:
+        self.initial = initial
+        self.maximum = maximum
+        self.reset_after = reset_after
+        self.failures = 0
+
+    def next_delay(self, uptime: float) -> float:
+        if uptime >= self.reset_after:
+            self.failures = 0
+        delay = min(self.initial * 2 ** self.failures, self.maximum)
+        self.failures += 1
+        return delay
@@ -0,0 +1,200 @@
+import math
+import sys
+import numbers
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import shapely
+from shapely.geometry import Polygon
+
+# Class ids produced by the resnet10 detector, see model/labels.txt
+CLASS_CAR = 0
+CLASS_BICYCLE = 1
+CLASS_PERSON = 2
+CLASS_ROADSIGN = 3
+NUM_CLASSES = 4
+
+# Schema of a single source entry in app_config.json: key -> (type, required)
+SOURCE_SCHEMA = {
+    "uri": (str, True),
+    "car_confidence": (numbers.Real, True),
+    "person_confidence": (numbers.Real, True),
+    "restricted_zones": (list, True),
+    # Only used by the supervisor to shard the sources across workers
+    "expected_load": (numbers.Real, False),
+    "gpu_id": (numbers.Integral, False),
+    # Identity reported in the events, sensor_id selects the [sensorN] section
+    # of msgconv_config.txt and spreads the events over the broker partitions
+    "sensor_id": (numbers.Integral, False),
+    "place_id": (numbers.Integral, False),
+    "sensor_str": (str, False),
+    # Nominal frame rate and resolution, they size the muxer, see pipeline/flow.py
+    "fps": (numbers.Real, False),
+    "width": (numbers.Integral, False),
+    "height": (numbers.Integral, False),
+}
+
+
+class Zone():
+    """Restricted zone compiled once from the lines given in the config.
+
+    The lines form a closed chain, checked by validate_config, the polygon
+    is built from the start point of every line so concave zones keep their
+    exact shape.
+    The polygon is prepared so repeated containment queries reuse the
+    spatial index built by shapely, and its bounding box is kept as plain
+    floats for a cheap reject test before any geometry call.
+    """
+    __slots__ = ("lines", "vertices", "polygon", "min_x", "min_y", "max_x", "max_y")
+
+    def __init__(self, lines: Sequence[Sequence[Sequence[float]]]) -> None:
+        self.lines = tuple(
+            ((float(p1[0]), float(p1[1])), (float(p2[0]), float(p2[1])))
+            for p1, p2 in lines
+        )
+        self.vertices = tuple(line[0] for line in self.lines)
+        self.polygon = Polygon(self.vertices)
+        shapely.prepare(self.polygon)
+        self.min_x, self.min_y, self.max_x, self.max_y = self.polygon.bounds
+
+    def contains(self, x: float, y: float) -> bool:
+        """Check if a point lies inside the zone
+
+        Args:
+            x (float): Horizontal coordinate in muxer space
+            y (float): Vertical coordinate in muxer space
+
+        Returns:
+            bool: True if the point is inside the zone
+        """
+        if x <= self.min_x or x >= self.max_x or y <= self.min_y or y >= self.max_y:
+            return False
+        return bool(shapely.contains_xy(self.polygon, x, y))
+
+
+class SourceConfig():
+    """Typed, compiled configuration of a single source."""
+    __slots__ = ("source_id", "uri", "thresholds", "zones", "sensor_id", "place_id", "sensor_str",
+                 "fps", "width", "height")
+
+    def __init__(self, source_id: int, uri: str,
+                 thresholds: Tuple[float, ...], zones: Tuple[Zone, ...],
+                 sensor_id: Optional[int] = None, place_id: int = 0,
+                 sensor_str: Optional[str] = None, fps: Optional[float] = None,
+                 width: Optional[int] = None, height: Optional[int] = None) -> None:
+        self.source_id = source_id
+        self.uri = uri
+        # Minimum confidence per class id, inf for classes that are not monitored
+        self.thresholds = thresholds
+        self.zones = zones
+        self.sensor_id = source_id if sensor_id is None else sensor_id
+        self.place_id = place_id
+        # Interned once so every event of the source shares the same string
+        self.sensor_str = sys.intern(sensor_str or f"sensor-{self.sensor_id}")
+        self.fps = fps
+        self.width = width
+        self.height = height
+
+    @property
+    def is_live(self) -> bool:
+        return "rtsp://" in self.uri or "http://" in self.uri
+
+    def threshold(self, class_id: int) -> float:
+        """Minimum confidence for a class id, inf if the class is ignored"""
+        if 0 <= class_id < NUM_CLASSES:
+            return self.thresholds[class_id]
+        return math.inf
+
+
+def _validate_zone(zone: Any, path: str) -> None:
+    if not isinstance(zone, list) or len(zone) < 3:
+        raise ValueError(f"{path}: a zone must be a list of at least three lines")
+    for i, line in enumerate(zone):
+        if not isinstance(line, list) or len(line) != 2:
+            raise ValueError(f"{path}[{i}]: a line must be a pair of points")
+        for point in line:
+            if (not isinstance(point, list) or len(point) != 2
+                    or not all(isinstance(v, numbers.Real) for v in point)):
+                raise ValueError(f"{path}[{i}]: a point must be a pair of numbers")
+    # The polygon is built from the start points, the lines must follow each other
+    for i, line in enumerate(zone):
+        following = zone[(i + 1) % len(zone)]
+        if line[1] != following[0]:
+            raise ValueError(f"{path}[{i}]: the line must end where the next one starts, "
+                             f"the lines of a zone form a closed, ordered chain")
+    polygon = Polygon([line[0] for line in zone])
+    if not polygon.is_valid:
+        raise ValueError(f"{path}: invalid zone polygon, {shapely.is_valid_reason(polygon)}")
+
+
+def validate_config(config: Dict) -> None:
+    """Validate the raw application config against the source schema
+
+    Args:
+        config (Dict): Content of app_config.json
+
+    Raises:
+        ValueError: If the config does not follow the schema
+    """
+    if not isinstance(config, dict) or not config:
+        raise ValueError("The config must be a non empty object keyed by source id")
+
+    for key in config:
+        if not key.isdigit() or str(int(key)) != key:
+            raise ValueError(f"[{key}]: source ids must be non negative integers")
+
+    for key, source in config.items():
+        if not isinstance(source, dict):
+            raise ValueError(f"[{key}]: a source must be an object")
+        for field, (field_type, required) in SOURCE_SCHEMA.items():
+            if field not in source:
+                if required:
+                    raise ValueError(f"[{key}]: missing required field '{field}'")
+                continue
+            if not isinstance(source[field], field_type) or isinstance(source[field], bool):
+                raise ValueError(f"[{key}].{field}: expected {field_type.__name__}")
+
+        for field in ("car_confidence", "person_confidence"):
+            if not 0.0 <= source[field] <= 1.0:
+                raise ValueError(f"[{key}].{field}: must be between 0 and 1")
+
+        for field in ("fps", "width", "height"):
+            if field in source and source[field] <= 0:
+                raise ValueError(f"[{key}].{field}: must be positive")
+
+        for i, zone in enumerate(source["restricted_zones"]):
+            _validate_zone(zone, f"[{key}].restricted_zones[{i}]")
+
+
+def active_sources(sources: List[Optional[SourceConfig]]) -> List[SourceConfig]:
+    """Compiled sources without the holes left by unused source ids"""
+    return [source for source in sources if source is not None]
+
+
+def compile_config(config: Dict) -> List[Optional[SourceConfig]]:
+    """Validate the raw application config and compile it into
+    per-source objects indexed by source id
+
+    Args:
+        config (Dict): Content of app_config.json
+
+    Returns:
+        List[Optional[SourceConfig]]: Compiled sources, position i holds
+        source_id i or None if the id is not used
+    """
+    validate_config(config)
+
+    sources = [None] * (max(int(key) for key in config) + 1)
+    for key, source in config.items():
+        source_id = int(key)
+        thresholds = [math.inf] * NUM_CLASSES
+        thresholds[CLASS_CAR] = float(source["car_confidence"])
+        thresholds[CLASS_PERSON] = float(source["person_confidence"])
+        zones = tuple(Zone(zone) for zone in source["restricted_zones"])
+        sources[source_id] = SourceConfig(source_id, source["uri"], tuple(thresholds), zones,
+                                          sensor_id=source.get("sensor_id"),
+                                          place_id=source.get("place_id", 0),
+                                          sensor_str=source.get("sensor_str"),
+                                          fps=source.get("fps"),
+                                          width=source.get("width"),
+                                          height=source.get("height"))
+    return sources
@@ -0,0 +1,123 @@
+"""Runtime reconfiguration of the analytics.
+
+The probe reads everything it needs from one :class:`AnalyticsState`
+object. A reload compiles a complete new state next to the running one and
+publishes it with a single attribute assignment, so a batch is always
+evaluated against either the old or the new configuration, never a mix.
+"""
+import json
+import logging
+import os
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from pipeline.config import SourceConfig
+from pipeline.overlay import ZoneOverlay
+from pipeline.zones import ZoneEngine
+
+
+class AnalyticsState():
+    """Immutable bundle of the compiled config used by the probe.
+
+    Args:
+        sources (List[Optional[SourceConfig]]): Compiled sources indexed by source id
+        zone_engine (ZoneEngine): Engine compiled from the sources
+        zone_overlay (ZoneOverlay): Overlay compiled from the sources
+        reset_sources (FrozenSet[int]): Sources whose zone occupancies must be
+            flushed when the state is first used
+    """
+    __slots__ = ("sources", "zone_engine", "zone_overlay", "reset_sources")
+
+    def __init__(self, sources: List[Optional[SourceConfig]], zone_engine: ZoneEngine,
+                 zone_overlay: ZoneOverlay, reset_sources: FrozenSet[int] = frozenset()) -> None:
+        self.sources = sources
+        self.zone_engine = zone_engine
+        self.zone_overlay = zone_overlay
+        self.reset_sources = reset_sources
+
+
+def _source_signature(source: SourceConfig) -> Tuple:
+    return (source.thresholds, tuple(zone.lines for zone in source.zones))
+
+
+def diff_sources(old: List[Optional[SourceConfig]],
+                 new: List[Optional[SourceConfig]]) -> Tuple[List[int], List[int], List[int]]:
+    """Compare two compiled configs
+
+    A source whose uri changed is reported as removed and added again.
+    Changes of the identity (sensor_id, place_id, sensor_str) or of the
+    nominal frame rate and resolution are not reported, the new state
+    carries them and the occupancies of the source are kept.
+
+    Args:
+        old (List[Optional[SourceConfig]]): Running config
+        new (List[Optional[SourceConfig]]): Requested config
+
+    Returns:
+        Tuple[List[int], List[int], List[int]]: Added, removed and changed
+        (zones or thresholds only) source ids
+    """
+    added, removed, changed = [], [], []
+    for source_id in range(max(len(old), len(new))):
+        before = old[source_id] if source_id < len(old) else None
+        after = new[source_id] if source_id < len(new) else None
+        if before is None and after is None:
+            continue
+        if before is None:
+            added.append(source_id)
+        elif after is None:
+            removed.append(source_id)
+        elif before.uri != after.uri:
+            removed.append(source_id)
+            added.append(source_id)
+        elif _source_signature(before) != _source_signature(after):
+            changed.append(source_id)
+    return added, removed, changed
+
+
+class ConfigWatcher():
+    """Polls a config file and returns its content when it changed
+
+    A change is only read once the file stayed the same for a whole check
+    interval, so a file being written is not read half way. A file that is
+    not valid JSON is reported once and read again on its next change.
+
+    Args:
+        path (str): Path to app_config.json
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._stamp = self._file_stamp()
+        # Stamp of a change seen on the previous check, not read yet
+        self._pending = None
+
+    def _file_stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            return None
+        # The inode changes when an editor replaces the file
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def check(self) -> Optional[Dict]:
+        """Read the config if it changed and settled since the last checks
+
+        Returns:
+            Optional[Dict]: The new raw config, None if unchanged, still
+            changing or unreadable
+        """
+        stamp = self._file_stamp()
+        if stamp is None or stamp == self._stamp:
+            self._pending = None
+            return None
+        if stamp != self._pending:
+            self._pending = stamp
+            return None
+        self._stamp = stamp
+        self._pending = None
+        try:
+            with open(self._path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Unable to read {self._path}: {e}")
+            return None
@@ -0,0 +1,286 @@
+"""Selection and caching of the TensorRT engines used by nvinfer.
+
+nvinfer rebuilds its engine whenever the configured engine file does not
+match the requested batch size, which takes minutes on edge devices. The
+engine cache keeps every engine built so far under a name encoding its batch
+size, precision, GPU and a hash of the model files, and the selection writes
+a model config pointing to the smallest suitable engine, padding the batch
+when a larger engine exists. Only files are involved, no TensorRT.
+"""
+import configparser
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+# network-mode of the nvinfer config
+PRECISIONS = {0: "fp32", 1: "int8", 2: "fp16"}
+# Files and properties the engine is built from
+MODEL_FILE_KEYS = ("model-file", "proto-file", "onnx-file", "tlt-encoded-model",
+                   "uff-file", "int8-calib-file")
+MODEL_PROPERTY_KEYS = ("network-mode", "force-implicit-batch-dim", "output-blob-names",
+                       "infer-dims", "uff-input-blob-name", "input-dims")
+PATH_KEYS = MODEL_FILE_KEYS + ("model-engine-file", "labelfile-path", "custom-lib-path")
+
+# <model>_b<batch>_gpu<gpu>_<precision>[_<hash>].engine, the first form is
+# the one nvinfer serializes next to the model file
+_ENGINE_NAME = re.compile(r"^(?P<model>.+)_b(?P<batch>\d+)_gpu(?P<gpu>\d+)_(?P<precision>[a-z0-9]+)"
+                          r"(?:_(?P<hash>[0-9a-f]{12}))?\.engine$")
+_INDEX_FILE = "index.json"
+
+
+class EngineKey():
+    """What an engine was built for"""
+    __slots__ = ("model", "batch_size", "gpu_id", "precision", "model_hash")
+
+    def __init__(self, model: str, batch_size: int, gpu_id: int, precision: str,
+                 model_hash: Optional[str] = None) -> None:
+        self.model = model
+        self.batch_size = batch_size
+        self.gpu_id = gpu_id
+        self.precision = precision
+        self.model_hash = model_hash
+
+    @property
+    def filename(self) -> str:
+        suffix = f"_{self.model_hash}" if self.model_hash else ""
+        return f"{self.model}_b{self.batch_size}_gpu{self.gpu_id}_{self.precision}{suffix}.engine"
+
+    def matches(self, other: "EngineKey") -> bool:
+        """Same model, GPU and precision, whatever the batch size"""
+        return (self.model == other.model and self.gpu_id == other.gpu_id
+                and self.precision == other.precision
+                and (self.model_hash is None or other.model_hash is None
+                     or self.model_hash == other.model_hash))
+
+    @classmethod
+    def parse(cls, filename: str) -> Optional["EngineKey"]:
+        match = _ENGINE_NAME.match(filename)
+        if match is None:
+            return None
+        return cls(match["model"], int(match["batch"]), int(match["gpu"]),
+                   match["precision"], match["hash"])
+
+    def __repr__(self) -> str:
+        return f"EngineKey({self.filename})"
+
+
+class EngineCache():
+    """Directory of built engines with least recently used eviction.
+
+    Args:
+        cache_dir (str): Directory holding the engines, created if missing
+        max_entries (int): Engines kept, the least recently used are deleted
+        clock (Callable[[], float]): Clock of the last use times
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int = 8, clock=time.time) -> None:
+        if max_entries < 1:
+            raise ValueError("The engine cache must hold at least one engine")
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._clock = clock
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, _INDEX_FILE)
+        self._last_used = self._load_index()
+
+    def _load_index(self) -> Dict[str, float]:
+        try:
+            with open(self._index_path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self) -> None:
+        with open(self._index_path, "w") as file:
+            json.dump(self._last_used, file, indent=4, sort_keys=True)
+
+    def entries(self) -> List[EngineKey]:
+        """Engines in the cache, keyed by their file name"""
+        keys = (EngineKey.parse(name) for name in sorted(os.listdir(self.cache_dir)))
+        return [key for key in keys if key is not None and key.model_hash]
+
+    def path(self, key: EngineKey) -> str:
+        return os.path.join(self.cache_dir, key.filename)
+
+    def find(self, key: EngineKey) -> Optional[EngineKey]:
+        """Smallest cached engine for the key with at least its batch size"""
+        candidates = [entry for entry in self.entries()
+                      if entry.matches(key) and entry.batch_size >= key.batch_size]
+        return min(candidates, key=lambda entry: entry.batch_size, default=None)
+
+    def touch(self, key: EngineKey) -> None:
+        self._last_used[key.filename] = self._clock()
+        self._save_index()
+
+    def add(self, engine_path: str, key: EngineKey) -> str:
+        """Move a freshly built engine into the cache and evict old ones
+
+        Args:
+            engine_path (str): Engine serialized by nvinfer
+            key (EngineKey): What it was built for, with the model hash
+
+        Returns:
+            str: Path of the engine in the cache
+        """
+        destination = self.path(key)
+        shutil.move(engine_path, destination)
+        logging.info(f"Cached engine {destination}")
+        self.touch(key)
+        self.evict()
+        return destination
+
+    def evict(self) -> List[str]:
+        """Delete the least recently used engines above max_entries"""
+        entries = sorted(self.entries(), key=lambda entry: self._last_used.get(entry.filename, 0.0))
+        evicted = []
+        for entry in entries[:max(len(entries) - self.max_entries, 0)]:
+            os.remove(self.path(entry))
+            self._last_used.pop(entry.filename, None)
+            evicted.append(entry.filename)
+            logging.info(f"Evicted engine {entry.filename}")
+        if evicted:
+            self._save_index()
+        return evicted
+
+
+def _resolve(config_dir: str, path: str) -> str:
+    return path if os.path.isabs(path) else os.path.normpath(os.path.join(config_dir, path))
+
+
+def read_model_config(model_config_path: str) -> configparser.ConfigParser:
+    """nvinfer config with the paths made absolute"""
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str
+    config.read(model_config_path)
+    if not config.has_section("property"):
+        raise ValueError(f"{model_config_path}: missing [property] section")
+    config_dir = os.path.dirname(os.path.abspath(model_config_path))
+    for key in PATH_KEYS:
+        if key in config["property"]:
+            config["property"][key] = _resolve(config_dir, config["property"][key])
+    return config
+
+
+def model_hash(properties: Dict[str, str]) -> str:
+    """Hash of the model files and of the properties the engine depends on"""
+    digest = hashlib.sha256()
+    for key in MODEL_FILE_KEYS:
+        path = properties.get(key)
+        if not path:
+            continue
+        digest.update(key.encode())
+        if os.path.isfile(path):
+            with open(path, "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(chunk)
+        else:
+            # Engines shipped without the model, only the name is known
+            digest.update(os.path.basename(path).encode())
+    for key in MODEL_PROPERTY_KEYS:
+        digest.update(f"{key}={properties.get(key, '')}".encode())
+    return digest.hexdigest()[:12]
+
+
+def round_batch_size(batch_size: int) -> int:
+    """Batch size an engine is built for, the next power of two, so adding
+    a few sources does not need a new engine"""
+    return 1 << max(batch_size - 1, 0).bit_length()
+
+
+class EngineSelection():
+    """Outcome of select_engine"""
+    __slots__ = ("config_path", "batch_size", "engine_path", "key", "build_path", "cache")
+
+    def __init__(self, config_path: str, batch_size: int, engine_path: str, key: EngineKey,
+                 build_path: Optional[str], cache: EngineCache) -> None:
+        self.config_path = config_path
+        self.batch_size = batch_size
+        self.engine_path = engine_path
+        self.key = key
+        # Where nvinfer serializes the engine it builds, None if one was found
+        self.build_path = build_path
+        self.cache = cache
+
+    def adopt(self) -> Optional[str]:
+        """Move the engine nvinfer just built into the cache"""
+        if self.build_path is None or not os.path.isfile(self.build_path):
+            return None
+        path = self.cache.add(self.build_path, self.key)
+        self.build_path = None
+        return path
+
+
+def select_engine(model_config_path: str, cache: EngineCache, batch_size: int,
+                  gpu_id: int = 0, output_dir: Optional[str] = None) -> EngineSelection:
+    """Write a model config using the best engine for a batch size
+
+    Cached engines built from the same model files come first, then the
+    engines serialized next to the model file. The smallest engine with at
+    least batch_size is used. Without one, nvinfer builds an engine for the
+    batch size rounded up to a power of two, to be added to the cache once
+    built, see EngineSelection.adopt.
+
+    Args:
+        model_config_path (str): nvinfer config file
+        cache (EngineCache): Engine cache
+        batch_size (int): Frames per batch
+        gpu_id (int): GPU the engine runs on
+        output_dir (Optional[str]): Directory of the generated config, a
+            temporary one by default
+
+    Raises:
+        ValueError: If the config lacks a model file or a known network-mode
+
+    Returns:
+        EngineSelection: The generated config and the engine it uses
+    """
+    config = read_model_config(model_config_path)
+    properties = config["property"]
+    model_file = next((properties[key] for key in MODEL_FILE_KEYS[:-1] if key in properties), None)
+    if model_file is None:
+        raise ValueError(f"{model_config_path}: no model file")
+    precision = PRECISIONS.get(int(properties.get("network-mode", "0")))
+    if precision is None:
+        raise ValueError(f"{model_config_path}: unknown network-mode {properties['network-mode']}")
+
+    model_dir, model = os.path.split(model_file)
+    key = EngineKey(model, batch_size, gpu_id, precision, model_hash(properties))
+    build_path = None
+    found = cache.find(key)
+    if found is not None:
+        engine_path = cache.path(found)
+        cache.touch(found)
+    else:
+        # Engines serialized by nvinfer next to the model carry no hash
+        prebuilt = [EngineKey.parse(name) for name in sorted(os.listdir(model_dir))] \
+            if os.path.isdir(model_dir) else []
+        prebuilt = [entry for entry in prebuilt if entry is not None and not entry.model_hash
+                    and entry.model == model and entry.matches(key)
+                    and entry.batch_size >= batch_size]
+        found = min(prebuilt, key=lambda entry: entry.batch_size, default=None)
+        if found is not None:
+            engine_path = os.path.join(model_dir, found.filename)
+        else:
+            found = EngineKey(model, round_batch_size(batch_size), gpu_id, precision, key.model_hash)
+            build_path = os.path.join(model_dir, EngineKey(model, found.batch_size, gpu_id,
+                                                           precision).filename)
+            engine_path = build_path
+            logging.info(f"No engine for batch size {batch_size}, nvinfer builds {build_path}")
+    found.model_hash = key.model_hash
+
+    properties["model-engine-file"] = engine_path
+    properties["batch-size"] = str(found.batch_size)
+    properties["gpu-id"] = str(gpu_id)
+    output_dir = output_dir or tempfile.mkdtemp(prefix="nvinfer_")
+    config_path = os.path.join(output_dir, os.path.basename(model_config_path))
+    with open(config_path, "w") as file:
+        config.write(file, space_around_delimiters=False)
+    logging.info(f"Using engine {engine_path} (batch size {found.batch_size}) "
+                 f"for {batch_size} sources")
+    return EngineSelection(config_path, found.batch_size, engine_path, found, build_path, cache)
@@ -0,0 +1,54 @@
+from enum import IntEnum
+from typing import Dict, Optional
+
+
+class EventType(IntEnum):
+    """Type of a restricted zone event"""
+    ENTRY = 0
+    EXIT = 1
+    DWELL = 2
+
+
+class Event():
+    """Compact, pyds independent record of a restricted zone event.
+
+    Args:
+        type (EventType): Kind of event
+        source_id (int): Source the object was seen on
+        frame_num (int): Frame of the last sighting of the object
+        tracking_id (int): Tracking id of the object
+        zone (int): Index of the zone in the source config
+        class_id (int): Detector class id
+        confidence (float): Detector confidence of the last sighting
+        bbox (Tuple[float, float, float, float]): Last (left, top, width, height)
+        timestamp (float): Time of the event in seconds
+        dwell (float): Seconds since the object entered the zone
+        snapshot (Optional[str]): Reference of the object snapshot in the
+            snapshot store, see pipeline/snapshots.py
+        attributes (Optional[Dict[str, str]]): Labels of the secondary
+            classifiers by classifier name, see pipeline/secondary.py
+    """
+    __slots__ = ("type", "source_id", "frame_num", "tracking_id", "zone", "class_id",
+                 "confidence", "left", "top", "width", "height", "timestamp", "dwell",
+                 "snapshot", "attributes")
+
+    def __init__(self, type: EventType, source_id: int, frame_num: int, tracking_id: int,
+                 zone: int, class_id: int, confidence: float, bbox, timestamp: float,
+                 dwell: float = 0.0, snapshot: Optional[str] = None,
+                 attributes: Optional[Dict[str, str]] = None) -> None:
+        self.type = type
+        self.source_id = source_id
+        self.frame_num = frame_num
+        self.tracking_id = tracking_id
+        self.zone = zone
+        self.class_id = class_id
+        self.confidence = confidence
+        self.left, self.top, self.width, self.height = bbox
+        self.timestamp = timestamp
+        self.dwell = dwell
+        self.snapshot = snapshot
+        self.attributes = attributes
+
+    def __repr__(self) -> str:
+        return (f"Event({self.type.name}, source={self.source_id}, track={self.tracking_id}, "
+                f"zone={self.zone}, frame={self.frame_num}, dwell={self.dwell:.2f})")
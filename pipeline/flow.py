@@ -0,0 +1,250 @@
+"""Backpressure of the pipeline branches and sizing of the muxer.
+
+A queue left blocking on a branch after the tee lets a slow consumer, the
+broker or the renderer, stall the whole pipeline and with it the inference
+of every source. Each branch queue gets a policy instead: block, or leaky
+with a bound on the buffers and time it holds, the dropped buffers being
+counted. The muxer push timeout and output resolution are derived from the
+source frame rates and resolutions, configured or observed, rather than
+hardcoded. Nothing here needs GStreamer.
+"""
+import time
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+QUEUE_MODES = ("block", "leaky")
+# GstQueueLeaky values
+_LEAKY_NO = 0
+_LEAKY_DOWNSTREAM = 2
+
+
+class QueuePolicy():
+    """Backpressure policy of a branch queue.
+
+    block waits for room, as the default queue does. leaky drops the oldest
+    buffers once max_buffers or max_time is reached, bounding the latency
+    the branch adds.
+
+    Args:
+        mode (str): block or leaky
+        max_buffers (int): Buffers held at most, 0 for no limit
+        max_time (float): Seconds of data held at most, 0 for no limit
+    """
+    __slots__ = ("mode", "max_buffers", "max_time")
+
+    def __init__(self, mode: str = "block", max_buffers: int = 200, max_time: float = 1.0) -> None:
+        if mode not in QUEUE_MODES:
+            raise ValueError(f"Unknown queue mode '{mode}', expected one of {QUEUE_MODES}")
+        if max_buffers < 0 or max_time < 0:
+            raise ValueError("The queue limits must not be negative")
+        if mode == "leaky" and max_buffers == 0 and max_time == 0:
+            raise ValueError("A leaky queue needs a buffer or time limit")
+        self.mode = mode
+        self.max_buffers = max_buffers
+        self.max_time = max_time
+
+    @classmethod
+    def parse(cls, spec: str) -> "QueuePolicy":
+        """Parse <mode>[:<max buffers>[:<max time ms>]], e.g. leaky:4:200"""
+        parts = spec.split(":")
+        if len(parts) > 3:
+            raise ValueError(f"Invalid queue policy '{spec}'")
+        try:
+            max_buffers = int(parts[1]) if len(parts) > 1 else 200
+            max_time = float(parts[2]) / 1000 if len(parts) > 2 else 1.0
+        except ValueError as e:
+            raise ValueError(f"Invalid queue policy '{spec}'") from e
+        return cls(parts[0], max_buffers, max_time)
+
+    @property
+    def leaky(self) -> bool:
+        return self.mode == "leaky"
+
+    def properties(self) -> Dict[str, int]:
+        """Properties of the GStreamer queue implementing the policy"""
+        return {
+            "leaky": _LEAKY_DOWNSTREAM if self.leaky else _LEAKY_NO,
+            "max-size-buffers": self.max_buffers,
+            "max-size-time": int(self.max_time * 1e9),
+            # NVMM buffers only carry a handle, their size says nothing
+            "max-size-bytes": 0,
+        }
+
+    def __repr__(self) -> str:
+        return f"QueuePolicy({self.mode}, {self.max_buffers} buffers, {self.max_time * 1000:g} ms)"
+
+
+class QueueAccounting():
+    """Overruns and dropped buffers of the branch queues.
+
+    A queue emits overrun from the streaming thread when it is full, a leaky
+    queue then drops its oldest buffers until it has room again. Every
+    overrun of a leaky queue is counted as one dropped buffer, exact for the
+    buffer limit, a lower bound when the time limit drops several at once.
+    The counters only grow, the main loop reports the difference with what
+    it reported last.
+    """
+
+    def __init__(self) -> None:
+        self._leaky = {}
+        self._overruns = {}
+        self._dropped = {}
+        self._reported = {}
+
+    def add(self, name: str, leaky: bool) -> None:
+        self._leaky[name] = leaky
+        for counts in (self._overruns, self._dropped, self._reported):
+            counts[name] = 0
+
+    def overrun(self, name: str) -> int:
+        """Count an overrun, called from the overrun signal
+
+        Returns:
+            int: Buffers the queue drops for it
+        """
+        self._overruns[name] += 1
+        if not self._leaky[name]:
+            return 0
+        self._dropped[name] += 1
+        return 1
+
+    def update(self, name: str) -> int:
+        """Dropped buffers of a queue since the last update"""
+        dropped = self._dropped[name]
+        new = dropped - self._reported[name]
+        self._reported[name] = dropped
+        return new
+
+    @property
+    def dropped(self) -> int:
+        """Buffers dropped by all the queues"""
+        return sum(self._dropped.values())
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: {"overruns": self._overruns[name], "dropped": self._dropped[name]}
+                for name in self._overruns}
+
+
+class FrameRateEstimator():
+    """Frame rate of every source from the arrival of its buffers.
+
+    Args:
+        window (float): Seconds a rate is measured over
+        clock (Callable[[], float]): Monotonic clock
+    """
+
+    def __init__(self, window: float = 2.0, clock=time.monotonic) -> None:
+        self.window = window
+        self._clock = clock
+        self._counts = {}
+        self._rates = {}
+
+    def tick(self, source_id: int) -> None:
+        """Count a buffer, called from the streaming threads"""
+        now = self._clock()
+        start, count = self._counts.get(source_id, (now, 0))
+        count += 1
+        if now - start >= self.window:
+            self._rates[source_id] = (count - 1) / (now - start)
+            start, count = now, 1
+        self._counts[source_id] = (start, count)
+
+    def remove(self, source_id: int) -> None:
+        self._counts.pop(source_id, None)
+        self._rates.pop(source_id, None)
+
+    def rates(self) -> Dict[int, float]:
+        return dict(self._rates)
+
+
+class MuxerSettings():
+    """Properties derived for nvstreammux"""
+    __slots__ = ("width", "height", "batched_push_timeout")
+
+    def __init__(self, width: int, height: int, batched_push_timeout: int) -> None:
+        self.width = width
+        self.height = height
+        # Microseconds
+        self.batched_push_timeout = batched_push_timeout
+
+    def __repr__(self) -> str:
+        return (f"MuxerSettings({self.width}x{self.height}, "
+                f"push timeout {self.batched_push_timeout} us)")
+
+
+def push_timeout(frame_rates: Iterable[Optional[float]], default_fps: float = 30.0,
+                 slack: float = 1.2) -> int:
+    """Muxer push timeout in microseconds, one frame interval of the fastest source
+
+    A batch is pushed once all the sources delivered a frame or the timeout
+    expired, so a late source delays the others by at most the timeout.
+    The slack keeps the jitter of the fastest source from splitting batches.
+    """
+    rates = [rate for rate in frame_rates if rate]
+    fps = max(rates) if rates else default_fps
+    return int(1e6 * slack / fps)
+
+
+def output_resolution(resolutions: Sequence[Optional[Tuple[int, int]]],
+                      maximum: Tuple[int, int] = (1920, 1080),
+                      default: Tuple[int, int] = (1920, 1080), align: int = 4) -> Tuple[int, int]:
+    """Muxer output resolution, the largest source resolution within maximum
+
+    Sources smaller than the output are scaled up by the muxer, larger ones
+    down, so the largest source is kept as is unless it exceeds maximum, in
+    which case it is scaled down with its aspect ratio.
+    """
+    known = [resolution for resolution in resolutions if resolution]
+    if not known:
+        return default
+    width, height = max(known, key=lambda resolution: resolution[0] * resolution[1])
+    scale = min(maximum[0] / width, maximum[1] / height, 1.0)
+    width = max(int(width * scale) // align * align, align)
+    height = max(int(height * scale) // align * align, align)
+    return width, height
+
+
+def muxer_settings(sources: Sequence, resolution: Optional[Tuple[int, int]] = None,
+                   push_timeout_us: Optional[int] = None,
+                   observed_rates: Optional[Dict[int, float]] = None,
+                   default_fps: float = 30.0,
+                   max_resolution: Tuple[int, int] = (1920, 1080)) -> MuxerSettings:
+    """Muxer properties for a set of sources
+
+    Args:
+        sources (Sequence): Active SourceConfig, their optional fps, width and height
+        resolution (Optional[Tuple[int, int]]): Fixed output resolution,
+            derived from the source resolutions if None
+        push_timeout_us (Optional[int]): Fixed push timeout, derived from the
+            frame rates if None
+        observed_rates (Optional[Dict[int, float]]): Measured frame rates by
+            source id, preferred over the configured ones
+        default_fps (float): Frame rate of the sources without one
+        max_resolution (Tuple[int, int]): Bound of the derived resolution
+
+    Returns:
+        MuxerSettings: Output resolution and push timeout
+    """
+    observed_rates = observed_rates or {}
+    if resolution is None:
+        resolution = output_resolution(
+            [(source.width, source.height) if source.width and source.height else None
+             for source in sources], max_resolution)
+    if push_timeout_us is None:
+        push_timeout_us = push_timeout(
+            [observed_rates.get(source.source_id) or source.fps for source in sources],
+            default_fps)
+    return MuxerSettings(resolution[0], resolution[1], push_timeout_us)
+
+
+def parse_resolution(value: str) -> Optional[Tuple[int, int]]:
+    """Parse WIDTHxHEIGHT, None for auto"""
+    if value == "auto":
+        return None
+    try:
+        width, height = (int(part) for part in value.lower().split("x"))
+    except ValueError as e:
+        raise ValueError(f"Invalid resolution '{value}', expected WIDTHxHEIGHT or auto") from e
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid resolution '{value}'")
+    return width, height
+
@@ -0,0 +1,200 @@
+import gi
+gi.require_version("Gst", "1.0")
+import logging
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+from gi.repository import GLib, Gst
+
+from pipeline.metrics import JsonlSnapshotWriter, MetricsRegistry
+
+# Buffers in flight per element before the latency bookkeeping is reset
+MAX_INFLIGHT = 256
+
+
+def _is_sink(element: Gst.Element) -> bool:
+    """Whether an element has no source pad at all, static or requested"""
+    return not any(template.direction == Gst.PadDirection.SRC
+                   for template in element.get_factory().get_static_pad_templates())
+
+
+class Instrumentation():
+    """Timing probes and periodic sampling of the pipeline elements.
+
+    Pad probes are only installed while instrumentation is enabled and are
+    removed when it is disabled, so a disabled instrumentation costs one
+    attribute check per batch in the analytics probe.
+
+    Args:
+        registry (MetricsRegistry): Registry the metrics are created in
+        enabled (bool): Install the probes as soon as elements are attached
+        poll_interval (float): Seconds between rate and queue level samples
+        snapshot_writer (Optional[JsonlSnapshotWriter]): Written on every poll
+    """
+
+    def __init__(self, registry: MetricsRegistry, enabled: bool = False,
+                 poll_interval: float = 1.0,
+                 snapshot_writer: Optional[JsonlSnapshotWriter] = None) -> None:
+        self.registry = registry
+        self.enabled = False
+        self._requested = enabled
+        self._poll_interval = poll_interval
+        self._snapshot_writer = snapshot_writer
+        self._elements = {}
+        self._entry_element = None
+        self._probes = []
+        self._inflight = {}
+        self._watched = {}
+        self._last_poll = time.monotonic()
+        self._last_frames = {}
+        self._last_events = 0
+
+        self._element_latency = registry.histogram(
+            "pipeline_element_latency_seconds", "Time a buffer spends in an element", ("element",))
+        self._element_buffers = registry.counter(
+            "pipeline_element_buffers_total", "Buffers pushed by an element", ("element",))
+        self._e2e_latency = registry.histogram(
+            "pipeline_end_to_end_latency_seconds", "Time from muxer output to a sink", ("sink",))
+        self._probe_time = registry.histogram(
+            "pipeline_probe_seconds", "Execution time of the analytics probe")
+        self._frames = registry.counter(
+            "pipeline_source_frames_total", "Frames processed per source", ("source",))
+        self._events = registry.counter(
+            "pipeline_events_total", "Zone events emitted")
+        self._fps = registry.gauge(
+            "pipeline_source_fps", "Frame rate per source", ("source",))
+        self._events_rate = registry.gauge(
+            "pipeline_events_per_second", "Zone events emitted per second")
+        self._queue_level = registry.gauge(
+            "pipeline_queue_level", "Fill level of a queue", ("queue",))
+
+    def attach(self, elements: Dict[str, Gst.Element], entry_element: str) -> None:
+        """Register the elements to instrument and start the periodic sampling
+
+        Args:
+            elements (Dict[str, Gst.Element]): Elements by name
+            entry_element (str): Element whose output starts end to end latency
+        """
+        self._elements = elements
+        self._entry_element = entry_element
+        self._apply(self._requested)
+        GLib.timeout_add(int(self._poll_interval * 1000), self._poll)
+
+    def watch(self, name: str, level: Callable[[], float]) -> None:
+        """Sample a non GStreamer queue level on every poll"""
+        self._watched[name] = level
+
+    def set_enabled(self, enabled: bool) -> None:
+        """Enable or disable the instrumentation, safe from any thread"""
+        self._requested = enabled
+        GLib.idle_add(self._apply, enabled)
+
+    def toggle_on_signal(self, signum: int) -> None:
+        """Flip the instrumentation state whenever the process receives signum"""
+        def handler():
+            # Requested too, so a later attach keeps the toggled state
+            self._requested = not self.enabled
+            self._apply(self._requested)
+            return True
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, handler)
+
+    def record_batch(self, seconds: float, source_ids: Iterable[int], num_events: int) -> None:
+        """Record one execution of the analytics probe"""
+        self._probe_time.observe(seconds)
+        for source_id in source_ids:
+            self._frames.inc(1, (source_id,))
+        if num_events:
+            self._events.inc(num_events)
+
+    def _apply(self, enabled: bool) -> bool:
+        if enabled and not self.enabled:
+            self._add_probes()
+        elif not enabled and self.enabled:
+            self._remove_probes()
+        self.enabled = enabled
+        logging.info(f"Instrumentation {'enabled' if enabled else 'disabled'}")
+        return False
+
+    def _add_probe(self, pad: Gst.Pad, callback, data) -> None:
+        probe_id = pad.add_probe(Gst.PadProbeType.BUFFER, callback, data)
+        self._probes.append((pad, probe_id))
+
+    def _add_probes(self) -> None:
+        for name, element in self._elements.items():
+            sink_pad = element.get_static_pad("sink")
+            src_pad = element.get_static_pad("src")
+            self._inflight[name] = {}
+            if src_pad is not None:
+                self._add_probe(src_pad, self._src_probe, name)
+                if sink_pad is not None:
+                    self._add_probe(sink_pad, self._sink_probe, name)
+            elif sink_pad is not None and _is_sink(element):
+                # End to end latency at the sinks of the graph, elements with
+                # request source pads only, like tee, are not timed
+                self._add_probe(sink_pad, self._end_probe, name)
+
+    def _remove_probes(self) -> None:
+        for pad, probe_id in self._probes:
+            pad.remove_probe(probe_id)
+        self._probes = []
+        self._inflight = {}
+
+    def _sink_probe(self, pad, info, name):
+        inflight = self._inflight.get(name)
+        buffer = info.get_buffer()
+        if inflight is not None and buffer is not None:
+            if len(inflight) > MAX_INFLIGHT:
+                inflight.clear()
+            inflight[buffer.pts] = time.perf_counter()
+        return Gst.PadProbeReturn.OK
+
+    def _src_probe(self, pad, info, name):
+        now = time.perf_counter()
+        buffer = info.get_buffer()
+        inflight = self._inflight.get(name)
+        if buffer is None or inflight is None:
+            return Gst.PadProbeReturn.OK
+        self._element_buffers.inc(1, (name,))
+        if name == self._entry_element:
+            inflight[buffer.pts] = now
+            if len(inflight) > MAX_INFLIGHT:
+                inflight.clear()
+            return Gst.PadProbeReturn.OK
+        start = inflight.pop(buffer.pts, None)
+        if start is not None:
+            self._element_latency.observe(now - start, (name,))
+        return Gst.PadProbeReturn.OK
+
+    def _end_probe(self, pad, info, name):
+        buffer = info.get_buffer()
+        entry = self._inflight.get(self._entry_element)
+        if buffer is not None and entry:
+            start = entry.get(buffer.pts)
+            if start is not None:
+                self._e2e_latency.observe(time.perf_counter() - start, (name,))
+        return Gst.PadProbeReturn.OK
+
+    def _poll(self) -> bool:
+        now = time.monotonic()
+        elapsed = now - self._last_poll
+        self._last_poll = now
+        if elapsed > 0:
+            for (source,), frames in self._frames.items():
+                self._fps.set((frames - self._last_frames.get(source, 0)) / elapsed, (source,))
+                self._last_frames[source] = frames
+            events = self._events.get()
+            self._events_rate.set((events - self._last_events) / elapsed)
+            self._last_events = events
+
+        for name, element in self._elements.items():
+            if element.get_factory().get_name() == "queue":
+                self._queue_level.set(element.get_property("current-level-buffers"), (name,))
+        for name, level in self._watched.items():
+            self._queue_level.set(level(), (name,))
+
+        if self._snapshot_writer is not None and self.enabled:
+            try:
+                self._snapshot_writer.write()
+            except OSError as e:
+                logging.warning(f"Unable to write metrics snapshot: {e}")
+        return True
@@ -0,0 +1,92 @@
+"""Adaptive inference interval.
+
+nvinfer skips ``interval`` batches between two inferences and the tracker
+carries the objects over the skipped frames. The controller raises the
+interval when the batch latency or the queue depth stays above its targets,
+or a leaky queue drops buffers, and lowers it again once there is headroom, trading detection frequency
+for throughput under load. It only sees samples, so it can be driven
+without a pipeline.
+"""
+from typing import Optional
+
+
+class IntervalController():
+    """Feedback policy choosing the primary inference interval.
+
+    The latency is smoothed with an exponential moving average. The interval
+    is raised when the average exceeds the target, the queue depth exceeds
+    max_queue or a leaky queue dropped buffers, and lowered when the average
+    drops below low_ratio times the target with the queues drained. A leaky
+    queue never holds more than its limit, only the blocking queues give
+    the depth. After every change the controller waits
+    cooldown samples so the effect of the change is measured first.
+
+    Args:
+        target_latency (float): Batch latency to stay under, in seconds
+        min_interval (int): Lowest interval, 0 infers on every batch
+        max_interval (int): Highest interval
+        max_queue (int): Queue depth considered as overload
+        low_ratio (float): Fraction of the target under which the interval is lowered
+        smoothing (float): Weight of a new sample in the moving average
+        cooldown (int): Samples ignored after a change
+        interval (Optional[int]): Initial interval, min_interval by default
+    """
+
+    def __init__(self, target_latency: float, min_interval: int = 0, max_interval: int = 4,
+                 max_queue: int = 4, low_ratio: float = 0.6, smoothing: float = 0.2,
+                 cooldown: int = 30, interval: Optional[int] = None) -> None:
+        if target_latency <= 0:
+            raise ValueError("target_latency must be positive")
+        if not 0 <= min_interval <= max_interval:
+            raise ValueError("Expected 0 <= min_interval <= max_interval")
+        if not 0 < low_ratio < 1 or not 0 < smoothing <= 1:
+            raise ValueError("low_ratio and smoothing must be in (0, 1)")
+        self.target_latency = target_latency
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_queue = max_queue
+        self.low_ratio = low_ratio
+        self.smoothing = smoothing
+        self.cooldown = cooldown
+        self.interval = min_interval if interval is None else min(max(interval, min_interval),
+                                                                  max_interval)
+        self.latency = None
+        self.changes = 0
+        self._wait = 0
+
+    def observe(self, latency: float, queue_depth: int = 0, dropped: int = 0) -> Optional[int]:
+        """Feed one latency sample
+
+        Args:
+            latency (float): Latency of a batch in seconds
+            queue_depth (int): Deepest blocking queue level when the batch was measured
+            dropped (int): Buffers dropped by the leaky queues since the last sample
+
+        Returns:
+            Optional[int]: The new interval if it changed, None otherwise
+        """
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+
+        if self._wait > 0:
+            self._wait -= 1
+            return None
+
+        interval = self.interval
+        if (self.latency > self.target_latency or queue_depth > self.max_queue
+                or dropped > 0):
+            interval = min(interval + 1, self.max_interval)
+        elif (self.latency < self.low_ratio * self.target_latency and queue_depth == 0
+                and dropped == 0):
+            interval = max(interval - 1, self.min_interval)
+        if interval == self.interval:
+            return None
+
+        self.interval = interval
+        self.changes += 1
+        self._wait = self.cooldown
+        # The average reflects the old interval, start over from the next sample
+        self.latency = None
+        return interval
@@ -0,0 +1,423 @@
+"""Disk-backed spill journal between the event publisher and the broker.
+
+While the broker keeps up, messages go straight through. Once it fails or
+falls behind, messages are appended to a journal of memory-mapped segment
+files instead and a forwarder thread replays them in order when the broker
+recovers. New messages keep going to the journal until it is drained, so
+the order is preserved. Retention by size and age bounds the disk usage and
+the read position is persisted, so a restart resumes the replay.
+
+Segment layout: header (magic "DZJ1", creation time f64, first sequence
+number u64) followed by records (marker u8 = 1, value length u32, crc32 u32,
+key length u16 with 0xFFFF for no key, key, value). A zero marker ends the
+written part of the preallocated segment.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import List, Optional, Tuple
+
+from pipeline.publisher import Message, Transport
+from pipeline.backoff import Backoff
+
+_MAGIC = b"DZJ1"
+_HEADER = struct.Struct(">4sdQ")
+_RECORD = struct.Struct(">BIIH")
+_NO_KEY = 0xFFFF
+_SUFFIX = ".journal"
+_CURSOR_FILE = "cursor"
+
+
+class _Segment():
+    """One preallocated, memory-mapped segment file"""
+    __slots__ = ("path", "base", "created", "capacity", "file", "map", "end", "count")
+
+    def __init__(self, path: str, capacity: int, base: int = 0, clock=time.time) -> None:
+        self.path = path
+        exists = os.path.exists(path)
+        self.file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self.file.truncate(capacity)
+        self.capacity = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), self.capacity)
+        if exists:
+            magic, self.created, self.base = _HEADER.unpack_from(self.map, 0)
+            if magic != _MAGIC:
+                raise ValueError(f"{path} is not a journal segment")
+            self.end, self.count = self._scan()
+        else:
+            self.base, self.created = base, clock()
+            _HEADER.pack_into(self.map, 0, _MAGIC, self.created, self.base)
+            self.end, self.count = _HEADER.size, 0
+
+    def _scan(self) -> Tuple[int, int]:
+        """End of the valid records, a torn last write is ignored"""
+        offset, count = _HEADER.size, 0
+        while True:
+            record = self.read(offset)
+            if record is None:
+                return offset, count
+            offset = record[1]
+            count += 1
+
+    def read(self, offset: int) -> Optional[Tuple[Message, int]]:
+        """Record at offset and the offset of the next one"""
+        if offset + _RECORD.size > self.capacity:
+            return None
+        marker, value_len, crc, key_len = _RECORD.unpack_from(self.map, offset)
+        start = offset + _RECORD.size
+        key_size = 0 if key_len == _NO_KEY else key_len
+        end = start + key_size + value_len
+        if marker != 1 or end > self.capacity:
+            return None
+        data = self.map[start:end]
+        if zlib.crc32(data) != crc:
+            return None
+        key = None if key_len == _NO_KEY else data[:key_size]
+        return (key, data[key_size:]), end
+
+    def append(self, message: Message) -> bool:
+        """Write a record, False if the segment is full"""
+        key, value = message
+        key_bytes = key or b""
+        size = _RECORD.size + len(key_bytes) + len(value)
+        if self.end + size > self.capacity:
+            return False
+        start = self.end + _RECORD.size
+        self.map[start:start + len(key_bytes)] = key_bytes
+        self.map[start + len(key_bytes):self.end + size] = value
+        _RECORD.pack_into(self.map, self.end, 1, len(value),
+                          zlib.crc32(key_bytes + value), _NO_KEY if key is None else len(key_bytes))
+        self.end += size
+        self.count += 1
+        return True
+
+    def flush(self) -> None:
+        self.map.flush()
+
+    def close(self) -> None:
+        self.map.close()
+        self.file.close()
+
+
+class JournalStats():
+    """Counters of the spill journal"""
+    __slots__ = ("appended", "replayed", "expired", "segments")
+
+    def __init__(self) -> None:
+        self.appended = 0
+        self.replayed = 0
+        self.expired = 0
+        self.segments = 0
+
+    def __str__(self) -> str:
+        return ", ".join(f"{name}={getattr(self, name)}" for name in self.__slots__)
+
+
+class SegmentJournal():
+    """Append-only journal of messages split in memory-mapped segments.
+
+    Not thread safe, SpillingTransport serializes the calls.
+
+    Args:
+        directory (str): Directory of the segment files, created if missing
+        segment_size (int): Size of a segment file in bytes
+        max_bytes (int): Segments beyond this total size are deleted, oldest first
+        max_age (float): Segments older than this many seconds are deleted
+        clock (Callable[[], float]): Wall clock of the segment creation times
+    """
+
+    def __init__(self, directory: str, segment_size: int = 64 << 20,
+                 max_bytes: int = 1 << 30, max_age: float = 86400.0, clock=time.time) -> None:
+        if segment_size <= _HEADER.size + _RECORD.size:
+            raise ValueError("The journal segment size is too small")
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.stats = JournalStats()
+        self._clock = clock
+        os.makedirs(directory, exist_ok=True)
+        self._segments = [
+            _Segment(os.path.join(directory, name), segment_size)
+            for name in sorted(os.listdir(directory)) if name.endswith(_SUFFIX)
+        ]
+        self._cursor_path = os.path.join(directory, _CURSOR_FILE)
+        self._read_seq = self._load_cursor()
+        self._read_offset = None
+        self._seek()
+        # Replayed before a crash, but not deleted yet
+        while len(self._segments) > 1 and self._read_offset >= self._segments[0].end:
+            self._read_seq = self._segments[1].base
+            self._delete_first()
+        self.stats.segments = len(self._segments)
+
+    def __len__(self) -> int:
+        """Messages not replayed yet"""
+        if not self._segments:
+            return 0
+        last = self._segments[-1]
+        return last.base + last.count - self._read_seq
+
+    @property
+    def size(self) -> int:
+        return sum(segment.capacity for segment in self._segments)
+
+    def _load_cursor(self) -> int:
+        try:
+            with open(self._cursor_path, "r") as file:
+                seq = int(file.read().strip() or 0)
+        except (OSError, ValueError):
+            seq = 0
+        if self._segments:
+            seq = max(seq, self._segments[0].base)
+        return seq
+
+    def _save_cursor(self) -> None:
+        temporary = self._cursor_path + ".tmp"
+        with open(temporary, "w") as file:
+            file.write(str(self._read_seq))
+        os.replace(temporary, self._cursor_path)
+
+    def _seek(self) -> None:
+        """Offset of the record _read_seq in the first segment"""
+        if not self._segments:
+            self._read_offset = None
+            return
+        segment = self._segments[0]
+        offset = _HEADER.size
+        for _ in range(self._read_seq - segment.base):
+            if offset >= segment.end:
+                break
+            offset = segment.read(offset)[1]
+        self._read_offset = offset
+
+    def append(self, messages: List[Message]) -> None:
+        for message in messages:
+            if not self._segments or not self._segments[-1].append(message):
+                self._roll()
+                if not self._segments[-1].append(message):
+                    raise ValueError(f"Message of {len(message[1])} bytes does not fit "
+                                     f"in a journal segment")
+            self.stats.appended += 1
+        self._enforce_retention()
+
+    def _roll(self) -> None:
+        base = 0
+        if self._segments:
+            last = self._segments[-1]
+            last.flush()
+            base = last.base + last.count
+        else:
+            base = self._read_seq
+        path = os.path.join(self.directory, f"{base:020d}{_SUFFIX}")
+        self._segments.append(_Segment(path, self.segment_size, base, self._clock))
+        self.stats.segments = len(self._segments)
+        if len(self._segments) == 1:
+            self._seek()
+
+    def read(self, max_messages: int) -> Tuple[int, List[Message]]:
+        """Oldest messages not replayed yet, without consuming them
+
+        Returns:
+            Tuple[int, List[Message]]: Sequence number of the first message
+                and the messages, pass the sequence number after the last
+                one sent to commit
+        """
+        messages = []
+        segment_index, offset = 0, self._read_offset
+        while len(messages) < max_messages and segment_index < len(self._segments):
+            segment = self._segments[segment_index]
+            if offset >= segment.end:
+                segment_index += 1
+                offset = _HEADER.size
+                continue
+            message, offset = segment.read(offset)
+            messages.append(message)
+        return self._read_seq, messages
+
+    def commit(self, end_seq: int) -> None:
+        """Consume the messages before end_seq, deleting the replayed segments
+
+        Messages deleted by the retention in the meantime are skipped.
+        """
+        if end_seq <= self._read_seq:
+            return
+        while self._read_seq < end_seq and self._segments:
+            segment = self._segments[0]
+            self._read_offset = segment.read(self._read_offset)[1]
+            self._read_seq += 1
+            self.stats.replayed += 1
+            if self._read_offset >= segment.end:
+                # The next append starts a new segment if this was the last one
+                self._delete_first()
+        self._save_cursor()
+
+    def _delete_first(self) -> None:
+        segment = self._segments.pop(0)
+        segment.close()
+        os.remove(segment.path)
+        self.stats.segments = len(self._segments)
+        self._seek()
+
+    def _enforce_retention(self) -> None:
+        now = self._clock()
+        # The segment being written is kept, whatever its age
+        while len(self._segments) > 1 and (self.size > self.max_bytes
+                                           or now - self._segments[0].created > self.max_age):
+            first = self._segments[0]
+            lost = first.base + first.count - self._read_seq
+            logging.warning(f"Journal retention: deleting {first.path} with {lost} "
+                            f"messages not published")
+            self.stats.expired += lost
+            self._read_seq = self._segments[1].base
+            self._delete_first()
+            self._save_cursor()
+
+    def flush(self) -> None:
+        for segment in self._segments:
+            segment.flush()
+
+    def close(self) -> None:
+        for segment in self._segments:
+            segment.flush()
+            segment.close()
+        self._segments = []
+
+
+class SpillStats():
+    """Counters of the spilling transport"""
+    __slots__ = ("direct", "spilled", "replayed", "failures", "slow_sends")
+
+    def __init__(self) -> None:
+        self.direct = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.failures = 0
+        self.slow_sends = 0
+
+    def __str__(self) -> str:
+        return ", ".join(f"{name}={getattr(self, name)}" for name in self.__slots__)
+
+
+class SpillingTransport(Transport):
+    """Transport passing messages through while the broker keeps up and
+    spilling them to a journal otherwise.
+
+    send is called by the publisher worker only. With an empty journal the
+    messages go straight to the wrapped transport. A failed send, or one
+    slower than slow_send, switches to spilling: the messages are appended
+    to the journal and a forwarder thread replays it in order, retrying with
+    an exponential backoff, until it is drained and direct sends resume. The
+    wrapped transport is never used by both threads at once since direct
+    sends only happen with an empty journal.
+
+    Args:
+        transport (Transport): Transport to the broker
+        journal (SegmentJournal): Journal of the spilled messages, what it
+            holds from a previous run is replayed first
+        slow_send (float): Seconds above which a direct send counts as
+            falling behind
+        max_batch (int): Messages per replayed batch
+        initial_backoff (float): First delay before retrying a failed replay
+        max_backoff (float): Upper bound of the retry delay
+    """
+
+    def __init__(self, transport: Transport, journal: SegmentJournal, slow_send: float = 0.5,
+                 max_batch: int = 500, initial_backoff: float = 0.5,
+                 max_backoff: float = 30.0) -> None:
+        self.stats = SpillStats()
+        self.journal = journal
+        self._transport = transport
+        self._slow_send = slow_send
+        self._max_batch = max_batch
+        self._backoff = Backoff(initial_backoff, max_backoff)
+        self._condition = threading.Condition()
+        self._spilling = len(journal) > 0
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="journal-forwarder", daemon=True)
+        self._thread.start()
+
+    def __len__(self) -> int:
+        """Messages waiting in the journal"""
+        with self._condition:
+            return len(self.journal)
+
+    @property
+    def spilling(self) -> bool:
+        return self._spilling
+
+    def send(self, messages: List[Message]) -> None:
+        if not self._spilling:
+            start = time.monotonic()
+            try:
+                self._transport.send(messages)
+            except Exception as e:
+                logging.warning(f"Broker unavailable ({e}), spilling events to "
+                                f"{self.journal.directory}")
+                self.stats.failures += 1
+                self._spill(messages)
+                return
+            self.stats.direct += len(messages)
+            if time.monotonic() - start > self._slow_send:
+                logging.warning(f"Broker falling behind, spilling events to "
+                                f"{self.journal.directory}")
+                self.stats.slow_sends += 1
+                self._spilling = True
+            return
+        self._spill(messages)
+
+    def _spill(self, messages: List[Message]) -> None:
+        with self._condition:
+            self._spilling = True
+            self.journal.append(messages)
+            self.stats.spilled += len(messages)
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while self._running and not len(self.journal):
+                    if self._spilling:
+                        logging.info("Journal drained, publishing directly again")
+                        self._spilling = False
+                    self._condition.wait()
+                if not self._running:
+                    return
+                start_seq, batch = self.journal.read(self._max_batch)
+
+            start = time.monotonic()
+            try:
+                self._transport.send(batch)
+            except Exception as e:
+                self.stats.failures += 1
+                delay = self._backoff.next_delay(0.0)
+                logging.debug(f"Journal replay failed ({e}), retrying in {delay:.1f}s")
+                with self._condition:
+                    self._condition.wait_for(lambda: not self._running, delay)
+                continue
+
+            self._backoff.failures = 0
+            with self._condition:
+                self.journal.commit(start_seq + len(batch))
+                self.stats.replayed += len(batch)
+                if time.monotonic() - start > self._slow_send and not len(self.journal):
+                    # Still slow, keep the publisher off the broker
+                    self._spilling = True
+                    self._condition.wait(self._slow_send)
+
+    def close(self) -> None:
+        """Stop the forwarder, the messages left in the journal are replayed on the next start"""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        with self._condition:
+            pending = len(self.journal)
+            self.journal.close()
+        self._transport.close()
+        logging.info(f"Spill journal: {self.stats}, {pending} messages pending")
@@ -1,7 +1,127 @@
+import configparser
+import ctypes
+import re
+import time
+from typing import Dict, List, Optional
+
 import pyds
-import sys
+
+from pipeline.config import SourceConfig, active_sources
+from pipeline.events import Event, EventType
 
 MAX_TIME_STAMP_LEN = 32
+DEEPSTREAM_VERSION_FILE = "/opt/nvidia/deepstream/deepstream/version"
+# DeepStream releases whose NvDsEventMsgMeta is laid out as _NvDsEventMsgMeta,
+# the layout must be checked against nvdsmeta_schema.h before adding one
+EVENT_MSG_META_VERSIONS = ("6.1",)
+
+# Zone event types as reported in the DeepStream message schema
+EVENT_TYPES = {
+    EventType.ENTRY: pyds.NvDsEventType.NVDS_EVENT_ENTRY,
+    EventType.EXIT: pyds.NvDsEventType.NVDS_EVENT_EXIT,
+    EventType.DWELL: pyds.NvDsEventType.NVDS_EVENT_STOPPED,
+}
+
+
+class _NvDsRect(ctypes.Structure):
+    _fields_ = [("top", ctypes.c_float), ("left", ctypes.c_float),
+                ("width", ctypes.c_float), ("height", ctypes.c_float)]
+
+
+class _NvDsTriple(ctypes.Structure):
+    # NvDsGeoLocation (lat, lon, alt) and NvDsCoordinate (x, y, z)
+    _fields_ = [("a", ctypes.c_double), ("b", ctypes.c_double), ("c", ctypes.c_double)]
+
+
+class _NvDsObjectSignature(ctypes.Structure):
+    _fields_ = [("signature", ctypes.c_void_p), ("size", ctypes.c_uint)]
+
+
+class _NvDsEventMsgMeta(ctypes.Structure):
+    """Layout of NvDsEventMsgMeta from nvdsmeta_schema.h of DeepStream 6.1"""
+    _fields_ = [
+        ("type", ctypes.c_int),
+        ("objType", ctypes.c_int),
+        ("bbox", _NvDsRect),
+        ("location", _NvDsTriple),
+        ("coordinate", _NvDsTriple),
+        ("objSignature", _NvDsObjectSignature),
+        ("objClassId", ctypes.c_int),
+        ("sensorId", ctypes.c_int),
+        ("moduleId", ctypes.c_int),
+        ("placeId", ctypes.c_int),
+        ("componentId", ctypes.c_int),
+        ("frameId", ctypes.c_int),
+        ("confidence", ctypes.c_double),
+        ("trackingId", ctypes.c_int),
+        ("ts", ctypes.c_char_p),
+        ("objectId", ctypes.c_char_p),
+        ("sensorStr", ctypes.c_char_p),
+        ("otherAttrs", ctypes.c_char_p),
+        ("videoPath", ctypes.c_char_p),
+        ("extMsg", ctypes.c_void_p),
+        ("extMsgSize", ctypes.c_uint),
+    ]
+
+
+# Size of the C struct, sys.getsizeof(pyds.NvDsEventMsgMeta) is the size of
+# the Python type object and copies the wrong number of bytes
+EVENT_MSG_META_SIZE = ctypes.sizeof(_NvDsEventMsgMeta)
+
+
+def deepstream_version(path: str = DEEPSTREAM_VERSION_FILE) -> Optional[str]:
+    """Major and minor version of the installed DeepStream, None if unknown
+
+    Args:
+        path (str): Version file of the DeepStream installation, holding a
+            line like "Version: 6.1.1"
+    """
+    try:
+        with open(path, "r") as file:
+            match = re.search(r"Version:\s*(\d+)\.(\d+)", file.read())
+    except OSError:
+        return None
+    return f"{match.group(1)}.{match.group(2)}" if match else None
+
+
+def check_event_meta_layout(path: str = DEEPSTREAM_VERSION_FILE) -> None:
+    """Make sure EVENT_MSG_META_SIZE matches the installed DeepStream
+
+    meta_copy_func duplicates EVENT_MSG_META_SIZE bytes, the bindings do
+    not expose the size of the struct, so another layout would under or
+    over copy it.
+
+    Raises:
+        RuntimeError: If the DeepStream version is unknown or its layout of
+            NvDsEventMsgMeta is not the one mirrored here
+    """
+    version = deepstream_version(path)
+    if version is None:
+        raise RuntimeError(f"Unable to read the DeepStream version from {path}")
+    if version not in EVENT_MSG_META_VERSIONS:
+        raise RuntimeError(f"The NvDsEventMsgMeta layout of DeepStream {version} is not supported, "
+                           f"expected one of {', '.join(EVENT_MSG_META_VERSIONS)}")
+
+
+class EventMetaStats():
+    """Allocations made for the event metadata since startup"""
+    __slots__ = ("metas", "buffers", "strings", "timestamps", "copies", "frees")
+
+    def __init__(self) -> None:
+        self.metas = 0
+        self.buffers = 0
+        self.strings = 0
+        self.timestamps = 0
+        self.copies = 0
+        self.frees = 0
+
+    def __repr__(self) -> str:
+        return ", ".join(f"{name}={getattr(self, name)}" for name in self.__slots__)
+
+
+# Shared with the copy and free callbacks, which DeepStream calls without context
+STATS = EventMetaStats()
+
 
 # Callback function for deep-copying an NvDsEventMsgMeta struct
 def meta_copy_func(data, user_data):
@@ -14,8 +134,7 @@ def meta_copy_func(data, user_data):
     # First use pyds.get_ptr() to get the C address of srcmeta, then
     # use pyds.memdup() to allocate dstmeta and copy srcmeta into it.
     # pyds.memdup returns C address of the allocated duplicate.
-    dstmeta_ptr = pyds.memdup(pyds.get_ptr(srcmeta),
-                              sys.getsizeof(pyds.NvDsEventMsgMeta))
+    dstmeta_ptr = pyds.memdup(pyds.get_ptr(srcmeta), EVENT_MSG_META_SIZE)
     # Cast the duplicated memory to pyds.NvDsEventMsgMeta
     dstmeta = pyds.NvDsEventMsgMeta.cast(dstmeta_ptr)
 
@@ -35,7 +154,8 @@ def meta_copy_func(data, user_data):
         dstmeta.objSignature.signature = pyds.memdup(
             srcmeta.objSignature.signature, srcmeta.objSignature.size)
         dstmeta.objSignature.size = srcmeta.objSignature.size
-        
+
+    STATS.copies += 1
     return dstmeta
 
 
@@ -52,32 +172,146 @@ def meta_free_func(data, user_data):
     if srcmeta.objSignature.size > 0:
         pyds.free_buffer(srcmeta.objSignature.signature)
         srcmeta.objSignature.size = 0
-        
-
-def generate_event_msg_meta(obj_meta, frame_meta):
-    msg_meta = pyds.alloc_nvds_event_msg_meta()
-    msg_meta.bbox.top = obj_meta.rect_params.top
-    msg_meta.bbox.left = obj_meta.rect_params.left
-    msg_meta.bbox.width = obj_meta.rect_params.width
-    msg_meta.bbox.height = obj_meta.rect_params.height
-    msg_meta.frameId = frame_meta.frame_num
-    msg_meta.trackingId = obj_meta.object_id
-    msg_meta.confidence = obj_meta.confidence
-    
-    msg_meta.sensorId = 0
-    msg_meta.placeId = 0
-    msg_meta.moduleId = 0
-    msg_meta.sensorStr = "sensor-0"
-    
-    msg_meta.ts = pyds.alloc_buffer(MAX_TIME_STAMP_LEN + 1)
-    pyds.generate_ts_rfc3339(msg_meta.ts, MAX_TIME_STAMP_LEN)
-
-    msg_meta.type = pyds.NvDsEventType.NVDS_EVENT_ENTRY
-    msg_meta.objType = pyds.NvDsObjectType.NVDS_OBJECT_TYPE_PERSON
-    msg_meta.objClassId = obj_meta.class_id
-    if obj_meta.class_id == 0:
-        msg_meta.objType = pyds.NvDsObjectType.NVDS_OBJECT_TYPE_VEHICLE
-    elif obj_meta.class_id == 2:
+    STATS.frees += 1
+
+
+def format_timestamp(seconds: float) -> bytes:
+    """RFC 3339 UTC timestamp with milliseconds, NUL terminated"""
+    millis = int(seconds * 1000) % 1000
+    stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+    return f"{stamp}.{millis:03d}Z".encode() + b"\0"
+
+
+class EventMetaFactory():
+    """Builds the NvDsEventMsgMeta of the events attached to the frames.
+
+    The timestamp is formatted once per frame from the frame NTP time, or
+    from its PTS relative to the first frame when no NTP time is attached,
+    and copied into the buffer every meta must own. The sensor identity
+    comes from the compiled source config, whose strings are interned once.
+    Every event still allocates its meta, its timestamp buffer and its
+    sensor string, DeepStream frees them with the user meta so they cannot
+    be pooled, only the timestamp formatting is shared by a frame.
+
+    Args:
+        clock (Callable): Wall clock anchoring PTS based timestamps
+    """
+
+    def __init__(self, clock=time.time) -> None:
+        self._clock = clock
+        self._pts_origin = None
+        # source_id -> (frame_num, formatted timestamp)
+        self._timestamps = {}
+
+    @property
+    def stats(self) -> EventMetaStats:
+        return STATS
+
+    def frame_time(self, frame_meta) -> float:
+        """Capture time of a frame in seconds since the epoch"""
+        if frame_meta.ntp_timestamp:
+            return frame_meta.ntp_timestamp / 1e9
+        if self._pts_origin is None:
+            self._pts_origin = self._clock() - frame_meta.buf_pts / 1e9
+        return self._pts_origin + frame_meta.buf_pts / 1e9
+
+    def _timestamp(self, frame_meta) -> bytes:
+        cached = self._timestamps.get(frame_meta.source_id)
+        if cached is not None and cached[0] == frame_meta.frame_num:
+            return cached[1]
+        stamp = format_timestamp(self.frame_time(frame_meta))
+        self._timestamps[frame_meta.source_id] = (frame_meta.frame_num, stamp)
+        STATS.timestamps += 1
+        return stamp
+
+    def create(self, event: Event, frame_meta, source: Optional[SourceConfig]):
+        """Allocate and fill the meta of an event
+
+        Args:
+            event (Event): Event to describe
+            frame_meta (pyds.NvDsFrameMeta): Frame the meta is attached to
+            source (Optional[SourceConfig]): Config of the event source, None
+                if it was removed, the source id is reported then
+
+        Returns:
+            pyds.NvDsEventMsgMeta: Meta owning its timestamp and sensor string
+        """
+        msg_meta = pyds.alloc_nvds_event_msg_meta()
+        msg_meta.bbox.top = event.top
+        msg_meta.bbox.left = event.left
+        msg_meta.bbox.width = event.width
+        msg_meta.bbox.height = event.height
+        msg_meta.frameId = event.frame_num
+        msg_meta.trackingId = event.tracking_id
+        msg_meta.confidence = event.confidence
+
+        if source is not None:
+            msg_meta.sensorId = source.sensor_id
+            msg_meta.placeId = source.place_id
+            msg_meta.sensorStr = source.sensor_str
+        else:
+            msg_meta.sensorId = event.source_id
+            msg_meta.placeId = 0
+            msg_meta.sensorStr = f"sensor-{event.source_id}"
+        msg_meta.moduleId = 0
+
+        stamp = self._timestamp(frame_meta)
+        msg_meta.ts = pyds.alloc_buffer(MAX_TIME_STAMP_LEN + 1)
+        ctypes.memmove(msg_meta.ts, stamp, len(stamp))
+
+        msg_meta.type = EVENT_TYPES[event.type]
         msg_meta.objType = pyds.NvDsObjectType.NVDS_OBJECT_TYPE_PERSON
-        
-    return msg_meta
\ No newline at end of file
+        msg_meta.objClassId = event.class_id
+        if event.class_id == 0:
+            msg_meta.objType = pyds.NvDsObjectType.NVDS_OBJECT_TYPE_VEHICLE
+        elif event.class_id == 2:
+            msg_meta.objType = pyds.NvDsObjectType.NVDS_OBJECT_TYPE_PERSON
+
+        STATS.metas += 1
+        STATS.buffers += 1
+        STATS.strings += 1
+        return msg_meta
+
+
+def msgconv_sections(template_path: str,
+                     sources: List[Optional[SourceConfig]]) -> Dict[str, Dict[str, str]]:
+    """Sections of the nvmsgconv config with a sensor and place section per source
+
+    nvmsgconv describes an event with the [sensorN] and [placeN] sections
+    matching its sensorId and placeId. Sections missing from the template
+    are copied from sensor0 and place0, the sensor id being the sensor
+    string of the source, so every source gets its own partition key.
+
+    Args:
+        template_path (str): Path to msgconv_config.txt
+        sources (List[Optional[SourceConfig]]): Compiled sources
+
+    Returns:
+        Dict[str, Dict[str, str]]: Section name to its key/values, in file order
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str
+    parser.read(template_path)
+    sections = {section: dict(parser[section]) for section in parser.sections()}
+    for source in active_sources(sources):
+        sensor = f"sensor{source.sensor_id}"
+        if sensor not in sections and "sensor0" in sections:
+            sections[sensor] = dict(sections["sensor0"], id=source.sensor_str)
+        place = f"place{source.place_id}"
+        if place not in sections and "place0" in sections:
+            sections[place] = dict(sections["place0"])
+    return sections
+
+
+def write_msgconv_config(sections: Dict[str, Dict[str, str]], output_path: str) -> None:
+    """Write the sections of an nvmsgconv config, see msgconv_sections
+
+    Args:
+        sections (Dict[str, Dict[str, str]]): Section name to its key/values
+        output_path (str): Path of the generated config
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str
+    parser.read_dict(sections)
+    with open(output_path, "w") as file:
+        parser.write(file, space_around_delimiters=False)
@@ -0,0 +1,235 @@
+"""Metrics registry with Prometheus text and JSONL exports.
+
+Metrics are plain Python objects updated from the streaming threads and
+the publisher thread. An increment reads and writes back the value, so
+every metric guards its values with a lock.
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Seconds, from 10us up to 1s
+DEFAULT_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric():
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in self.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+    def snapshot(self) -> Dict:
+        return {",".join(map(str, labels)): value for labels, value in self.items()}
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, labels: Tuple = ()) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, labels: Tuple = ()) -> float:
+        return self._values.get(labels, 0)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, labels: Tuple = ()) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: Tuple = ()) -> None:
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Per bucket counts, the last one is +Inf, then sum
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bucket] += 1
+            state[1] += value
+
+    def items(self):
+        # Copies, observe updates the states in place
+        with self._lock:
+            return [(labels, (list(counts), total))
+                    for labels, (counts, total) in self._values.items()]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for labels, (counts, total) in self.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labels, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            plain = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{plain} {total}")
+            lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+    def snapshot(self) -> Dict:
+        result = {}
+        for labels, (counts, total) in self.items():
+            count = sum(counts)
+            result[",".join(map(str, labels))] = {
+                "count": count, "mean": total / count if count else 0.0,
+                "p50": self._quantile(counts, 0.5), "p99": self._quantile(counts, 0.99),
+            }
+        return result
+
+    def _quantile(self, counts: List[int], q: float) -> float:
+        """Upper bound of the bucket holding the q quantile"""
+        target = q * sum(counts)
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry():
+    """Owns the metrics and renders them"""
+
+    def __init__(self) -> None:
+        self._metrics = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict:
+        return {"time": time.time(),
+                **{name: metric.snapshot() for name, metric in list(self._metrics.items())}}
+
+
+class JsonlSnapshotWriter():
+    """Appends one registry snapshot per line to a file
+
+    Args:
+        registry (MetricsRegistry): Registry to snapshot
+        path (str): Output file
+    """
+
+    def __init__(self, registry: MetricsRegistry, path: str) -> None:
+        self._registry = registry
+        self._path = path
+
+    def write(self) -> None:
+        with open(self._path, "a") as file:
+            file.write(json.dumps(self._registry.snapshot()) + "\n")
+
+
+class MetricsServer():
+    """HTTP endpoint serving GET /metrics in Prometheus text format.
+
+    POST /instrumentation/enable and /instrumentation/disable call the
+    given toggle callback, so instrumentation can be switched at runtime.
+    Nothing is authenticated, the server only listens on the loopback
+    interface unless another host is given.
+
+    Args:
+        registry (MetricsRegistry): Registry to serve
+        port (int): Port to listen on
+        toggle (Optional[Callable[[bool], None]]): Called with the requested state
+        host (str): Address to listen on, "" or 0.0.0.0 for every interface
+    """
+
+    def __init__(self, registry: MetricsRegistry, port: int,
+                 toggle: Optional[Callable[[bool], None]] = None,
+                 host: str = "127.0.0.1") -> None:
+        registry_ref, toggle_ref = registry, toggle
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry_ref.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                states = {"/instrumentation/enable": True, "/instrumentation/disable": False}
+                if toggle_ref is None or self.path not in states:
+                    self.send_error(404)
+                    return
+                toggle_ref(states[self.path])
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logging.debug(format % args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="metrics-server", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,128 @@
+"""Zone occupancy state machine.
+
+Turns the per-frame zone hits into ENTRY, DWELL and EXIT events keyed by
+(source_id, tracking id, zone). The state is kept in an ordered dict sorted
+by last sighting, so absent objects are found by looking at its head only
+and memory stays bounded by the objects seen in the last exit timeout.
+Without a tracker every object carries the same untracked object id, so the
+objects of a zone are one occupant; the pipeline warns at startup.
+"""
+from collections import OrderedDict
+from typing import Collection, List, Optional, Tuple
+
+from pipeline.events import Event, EventType
+
+OccupancyKey = Tuple[int, int, int]
+
+
+class _Occupancy():
+    __slots__ = ("entered", "last_seen", "last_dwell", "frame_num",
+                 "class_id", "confidence", "bbox")
+
+    def __init__(self, now: float) -> None:
+        self.entered = now
+        self.last_seen = now
+        self.last_dwell = now
+
+
+class OccupancyTracker():
+    """Tracks which objects are inside which zones.
+
+    Args:
+        exit_timeout (float): Seconds an object must be absent from a zone
+            before its EXIT event is emitted and its state evicted
+        dwell_interval (float): Seconds between DWELL events of an object
+            staying in a zone, 0 disables them
+        max_entries (int): Upper bound of tracked occupancies, the least
+            recently seen ones are exited first when it is reached
+    """
+
+    def __init__(self, exit_timeout: float = 2.0, dwell_interval: float = 0.0,
+                 max_entries: int = 100000) -> None:
+        if exit_timeout <= 0:
+            raise ValueError("exit_timeout must be positive")
+        self.exit_timeout = exit_timeout
+        self.dwell_interval = dwell_interval
+        self.max_entries = max_entries
+        self._state = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+    def observe(self, now: float, source_id: int, tracking_id: int, zone: int,
+                frame_num: int, class_id: int, confidence: float,
+                bbox: Tuple[float, float, float, float], events: List[Event]) -> None:
+        """Record the sighting of an object inside a zone
+
+        Args:
+            now (float): Time of the sighting in seconds
+            source_id (int): Source of the frame
+            tracking_id (int): Tracking id of the object
+            zone (int): Index of the zone containing the object
+            frame_num (int): Frame number
+            class_id (int): Detector class id
+            confidence (float): Detector confidence
+            bbox (Tuple[float, float, float, float]): (left, top, width, height)
+            events (List[Event]): Output list the new events are appended to
+        """
+        key = (source_id, tracking_id, zone)
+        state = self._state.get(key)
+        if state is None:
+            if len(self._state) >= self.max_entries:
+                self._exit(self._state.popitem(last=False), now, events)
+            state = self._state[key] = _Occupancy(now)
+            event_type = EventType.ENTRY
+        else:
+            self._state.move_to_end(key)
+            state.last_seen = now
+            event_type = None
+            if self.dwell_interval > 0 and now - state.last_dwell >= self.dwell_interval:
+                state.last_dwell = now
+                event_type = EventType.DWELL
+
+        state.frame_num = frame_num
+        state.class_id = class_id
+        state.confidence = confidence
+        state.bbox = bbox
+        if event_type is not None:
+            events.append(Event(event_type, source_id, frame_num, tracking_id, zone,
+                                class_id, confidence, bbox, now, now - state.entered))
+
+    def expire(self, now: float, events: List[Event]) -> None:
+        """Emit EXIT events for the objects absent longer than the exit timeout
+
+        Args:
+            now (float): Current time in seconds
+            events (List[Event]): Output list the EXIT events are appended to
+        """
+        deadline = now - self.exit_timeout
+        state = self._state
+        while state:
+            key, occupancy = next(iter(state.items()))
+            if occupancy.last_seen > deadline:
+                break
+            del state[key]
+            self._exit((key, occupancy), now, events)
+
+    def flush(self, now: float, events: List[Event],
+              source_ids: Optional[Collection[int]] = None) -> None:
+        """Exit the tracked occupancies, used on shutdown or config change
+
+        Args:
+            now (float): Current time in seconds
+            events (List[Event]): Output list the EXIT events are appended to
+            source_ids (Optional[Collection[int]]): Only flush these sources
+        """
+        if source_ids is None:
+            while self._state:
+                self._exit(self._state.popitem(last=False), now, events)
+            return
+        for key in [key for key in self._state if key[0] in source_ids]:
+            self._exit((key, self._state.pop(key)), now, events)
+
+    @staticmethod
+    def _exit(item: Tuple[OccupancyKey, _Occupancy], now: float, events: List[Event]) -> None:
+        (source_id, tracking_id, zone), state = item
+        events.append(Event(EventType.EXIT, source_id, state.frame_num, tracking_id, zone,
+                            state.class_id, state.confidence, state.bbox, now,
+                            state.last_seen - state.entered))
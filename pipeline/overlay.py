@@ -0,0 +1,116 @@
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import pyds
+
+from pipeline.config import SourceConfig
+
+# Number of lines a single NvDsDisplayMeta can hold
+MAX_ELEMENTS_IN_DISPLAY_META = 16
+
+LineParams = Tuple[int, int, int, int]
+
+
+def chunk_lines(source: SourceConfig,
+                chunk_size: int = MAX_ELEMENTS_IN_DISPLAY_META) -> Tuple[Tuple[LineParams, ...], ...]:
+    """Flatten the lines of all the zones of a source into chunks
+    that fit in a display meta each
+
+    Args:
+        source (SourceConfig): Compiled source
+        chunk_size (int): Maximum number of lines per chunk
+
+    Returns:
+        Tuple[Tuple[LineParams, ...], ...]: Chunks of (x1, y1, x2, y2) tuples
+    """
+    lines = [
+        (int(p1[0]), int(p1[1]), int(p2[0]), int(p2[1]))
+        for zone in source.zones
+        for p1, p2 in zone.lines
+    ]
+    return tuple(tuple(lines[i:i + chunk_size]) for i in range(0, len(lines), chunk_size))
+
+
+class OverlayStats():
+    """Cost counters of the zone overlay"""
+    __slots__ = ("frames", "skipped_frames", "display_metas", "lines", "seconds")
+
+    def __init__(self) -> None:
+        self.frames = 0
+        self.skipped_frames = 0
+        self.display_metas = 0
+        self.lines = 0
+        self.seconds = 0.0
+
+    @property
+    def us_per_frame(self) -> float:
+        return 1e6 * self.seconds / self.frames if self.frames else 0.0
+
+    def __str__(self) -> str:
+        return (f"frames={self.frames} skipped={self.skipped_frames} "
+                f"display_metas={self.display_metas} lines={self.lines} "
+                f"cost={self.us_per_frame:.1f}us/frame")
+
+
+class ZoneOverlay():
+    """Draws the restricted zones of every source on its frames.
+
+    The line parameters are computed once per source, every frame only
+    copies them into display metas acquired from the pool, one meta per
+    MAX_ELEMENTS_IN_DISPLAY_META lines.
+
+    Args:
+        sources (List[Optional[SourceConfig]]): Compiled sources indexed by source id
+        interval (int): Draw every interval-th frame, 0 disables the overlay
+        line_width (int): Width of the zone lines
+        color (Sequence[float]): RGBA color of the zone lines
+    """
+
+    def __init__(self, sources: List[Optional[SourceConfig]], interval: int = 1,
+                 line_width: int = 3, color: Sequence[float] = (1.0, 0, 0, 1.0)) -> None:
+        self.interval = interval
+        self.stats = OverlayStats()
+        self._line_width = line_width
+        self._color = tuple(color)
+        self._chunks = [chunk_lines(source) if source is not None else () for source in sources]
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def draw(self, batch_meta, frame_meta) -> None:
+        """Attach the zone lines of the frame source to the frame
+
+        Args:
+            batch_meta (pyds.NvDsBatchMeta): Batch owning the display meta pool
+            frame_meta (pyds.NvDsFrameMeta): Frame to draw on
+        """
+        if not self.enabled:
+            return
+        if frame_meta.frame_num % self.interval:
+            self.stats.skipped_frames += 1
+            return
+
+        start = time.perf_counter()
+        line_width = self._line_width
+        red, green, blue, alpha = self._color
+        source_id = frame_meta.source_id
+        chunks = self._chunks[source_id] if source_id < len(self._chunks) else ()
+        for chunk in chunks:
+            display_meta = pyds.nvds_acquire_display_meta_from_pool(batch_meta)
+            display_meta.num_lines = len(chunk)
+            lines_params = display_meta.line_params
+            for line_idx, (x1, y1, x2, y2) in enumerate(chunk):
+                params = lines_params[line_idx]
+                params.x1 = x1
+                params.y1 = y1
+                params.x2 = x2
+                params.y2 = y2
+                params.line_width = line_width
+                params.line_color.set(red, green, blue, alpha)
+            pyds.nvds_add_display_meta_to_frame(frame_meta, display_meta)
+            self.stats.lines += len(chunk)
+
+        self.stats.display_metas += len(chunks)
+        self.stats.frames += 1
+        self.stats.seconds += time.perf_counter() - start
@@ -0,0 +1,215 @@
+"""Compact, versioned event payloads.
+
+All the events of one frame of one source are packed into a single message
+that references its sensor by the sensor_id of the source. The static
+sensor and place description of every source is published once, in a
+separate ``sensors`` message, instead of being repeated in every event like
+the full DeepStream schema does, and again whenever the config changes.
+
+Two encodings of the same schema are provided, minimal JSON and a struct
+packed binary form:
+
+    header: magic "DZ", version u8, kind u8, sensor u16, frame u32,
+            timestamp f64, alarm count u16
+    alarm:  type u8, class u8, zone u16, tracking id u64,
+            confidence u16 (x 1e4), left/top/width/height u16, dwell ms u32
+"""
+import configparser
+import json
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from pipeline.config import SourceConfig, active_sources
+from pipeline.events import Event
+from pipeline.publisher import Message
+
+SCHEMA_VERSION = 1
+MAGIC = b"DZ"
+KIND_FRAME = 0
+KIND_SENSORS = 1
+SENSORS_KEY = b"sensors"
+
+_HEADER = struct.Struct(">2sBBHIdH")
+_ALARM = struct.Struct(">BBHQHHHHHI")
+_CONFIDENCE_SCALE = 10000
+_MAX_U16 = 0xFFFF
+_MAX_U64 = 0xFFFFFFFFFFFFFFFF
+
+
+def load_static_metadata(msg_config_path: str) -> Dict[str, Dict]:
+    """Read the sensor, place and analytics sections of the nvmsgconv config
+
+    Args:
+        msg_config_path (str): Path to msgconv_config.txt
+
+    Returns:
+        Dict[str, Dict]: Section name to its key/values, disabled sections skipped
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read(msg_config_path)
+    return {
+        section: {key: value.strip('"') for key, value in parser.items(section) if key != "enable"}
+        for section in parser.sections()
+        if parser.get(section, "enable", fallback="1") == "1"
+    }
+
+
+def describe_sources(static_metadata: Dict[str, Dict],
+                     sources: List[Optional[SourceConfig]]) -> Dict[str, Dict]:
+    """Static metadata with a sensor and place section for every source
+
+    Sections missing from the msgconv template are copied from sensor0 and
+    place0 like the generated nvmsgconv config does, the sensor id being the
+    sensor string of the source, see pipeline/metadata.py.
+
+    Args:
+        static_metadata (Dict[str, Dict]): Sections of the template
+        sources (List[Optional[SourceConfig]]): Compiled sources
+
+    Returns:
+        Dict[str, Dict]: Section name to its key/values
+    """
+    described = dict(static_metadata)
+    for source in active_sources(sources):
+        sensor = f"sensor{source.sensor_id}"
+        if sensor not in described and "sensor0" in static_metadata:
+            described[sensor] = dict(static_metadata["sensor0"], id=source.sensor_str)
+        place = f"place{source.place_id}"
+        if place not in described and "place0" in static_metadata:
+            described[place] = dict(static_metadata["place0"])
+    return described
+
+
+def _group_by_frame(events: List[Event]) -> Dict[Tuple[int, int], List[Event]]:
+    groups = {}
+    for event in events:
+        groups.setdefault((event.source_id, event.frame_num), []).append(event)
+    return groups
+
+
+def _u16(value: float) -> int:
+    return min(max(int(value), 0), _MAX_U16)
+
+
+class CompactEncoder():
+    """Encodes events into one compact message per frame.
+
+    The first call also emits the static metadata message, keyed with
+    SENSORS_KEY so a compacted topic keeps only its latest version. The
+    frame messages are keyed by source id and reference the sensor_id of
+    their source, which has a section in the static metadata.
+
+    Args:
+        static_metadata (Dict[str, Dict]): Sensor and place description of
+            the msgconv template
+        binary (bool): Use the struct packed encoding instead of JSON
+        sources (Optional[List[Optional[SourceConfig]]]): Compiled sources,
+            without them the sensor id is the source id
+    """
+
+    def __init__(self, static_metadata: Dict[str, Dict], binary: bool = False,
+                 sources: Optional[List[Optional[SourceConfig]]] = None) -> None:
+        self.binary = binary
+        self._template = static_metadata
+        self._static_metadata = static_metadata
+        self._sensor_ids = {}
+        self._sent_static = False
+        if sources is not None:
+            self.configure(sources)
+
+    def configure(self, sources: List[Optional[SourceConfig]]) -> None:
+        """Describe the sensors of a new config, the static message is sent again"""
+        self._static_metadata = describe_sources(self._template, sources)
+        self._sensor_ids = {source.source_id: source.sensor_id
+                            for source in active_sources(sources)}
+        self._sent_static = False
+
+    def static_message(self) -> Message:
+        payload = {"v": SCHEMA_VERSION, "kind": "sensors", "sensors": self._static_metadata}
+        value = json.dumps(payload, separators=(",", ":")).encode()
+        if self.binary:
+            header = _HEADER.pack(MAGIC, SCHEMA_VERSION, KIND_SENSORS, 0, 0, 0.0, 0)
+            value = header + value
+        return SENSORS_KEY, value
+
+    def __call__(self, events: List[Event]) -> List[Message]:
+        messages = []
+        if not self._sent_static:
+            messages.append(self.static_message())
+            self._sent_static = True
+
+        encode = self._encode_binary if self.binary else self._encode_json
+        sensor_ids = self._sensor_ids
+        for (source_id, frame_num), frame_events in _group_by_frame(events).items():
+            messages.append((str(source_id).encode(),
+                             encode(sensor_ids.get(source_id, source_id), frame_num,
+                                    frame_events)))
+        return messages
+
+    @staticmethod
+    def _encode_json(sensor_id: int, frame_num: int, events: List[Event]) -> bytes:
+        payload = {
+            "v": SCHEMA_VERSION,
+            "s": sensor_id,
+            "f": frame_num,
+            "t": round(events[0].timestamp, 3),
+            "a": [
+                [int(e.type), e.class_id, e.zone, e.tracking_id, round(e.confidence, 3),
+                 int(e.left), int(e.top), int(e.width), int(e.height), int(e.dwell * 1000)]
+                for e in events
+            ],
+        }
+        if any(e.snapshot is not None for e in events):
+            # Snapshot references of the alarms, not carried by the binary form
+            payload["p"] = [e.snapshot for e in events]
+        if any(e.attributes is not None for e in events):
+            # Secondary classifier labels of the alarms, not carried by the binary form
+            payload["c"] = [e.attributes for e in events]
+        return json.dumps(payload, separators=(",", ":")).encode()
+
+    @staticmethod
+    def _encode_binary(sensor_id: int, frame_num: int, events: List[Event]) -> bytes:
+        parts = [_HEADER.pack(MAGIC, SCHEMA_VERSION, KIND_FRAME, sensor_id,
+                              frame_num & 0xFFFFFFFF, events[0].timestamp, len(events))]
+        for e in events:
+            parts.append(_ALARM.pack(
+                int(e.type), e.class_id, e.zone, e.tracking_id & _MAX_U64,
+                _u16(e.confidence * _CONFIDENCE_SCALE),
+                _u16(e.left), _u16(e.top), _u16(e.width), _u16(e.height),
+                min(int(e.dwell * 1000), 0xFFFFFFFF)
+            ))
+        return b"".join(parts)
+
+
+def decode(value: bytes) -> Dict:
+    """Decode a compact message of either encoding into the JSON form
+
+    Args:
+        value (bytes): Message value
+
+    Raises:
+        ValueError: If the schema version is not supported
+
+    Returns:
+        Dict: Decoded message
+    """
+    if not value.startswith(MAGIC):
+        payload = json.loads(value)
+        if payload.get("v") != SCHEMA_VERSION:
+            raise ValueError(f"Unsupported payload version {payload.get('v')}")
+        return payload
+
+    _, version, kind, sensor_id, frame_num, timestamp, count = _HEADER.unpack_from(value)
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported payload version {version}")
+    if kind == KIND_SENSORS:
+        return json.loads(value[_HEADER.size:])
+
+    alarms = []
+    for i in range(count):
+        (event_type, class_id, zone, tracking_id, confidence,
+         left, top, width, height, dwell) = _ALARM.unpack_from(value, _HEADER.size + i * _ALARM.size)
+        alarms.append([event_type, class_id, zone, tracking_id, confidence / _CONFIDENCE_SCALE,
+                       left, top, width, height, dwell])
+    return {"v": version, "s": sensor_id, "f": frame_num, "t": timestamp, "a": alarms}
+
@@ -1,31 +1,157 @@
 import gi
 gi.require_version("Gst", "1.0")
-import math
+import configparser
+import os
+import tempfile
+import time
 import logging
-from typing import Dict
+from typing import Dict, FrozenSet, List, Optional, Tuple
 import pyds
-from gi.repository import GObject, Gst
-from shapely.geometry import MultiLineString, Point
+from gi.repository import GLib, GObject, Gst
 
 from pipeline import utils
+from pipeline.aggregates import ZoneAggregator
+from pipeline.analytics import BatchAnalytics
+from pipeline.config import SourceConfig, active_sources, compile_config
+from pipeline.engines import EngineCache, select_engine
+from pipeline.flow import FrameRateEstimator, QueueAccounting, QueuePolicy, muxer_settings
+from pipeline.control import AnalyticsState, ConfigWatcher, diff_sources
 from pipeline.utils import  bus_call
-from pipeline.metadata import generate_event_msg_meta, meta_copy_func, meta_free_func
+from pipeline.instrumentation import Instrumentation
+from pipeline.interval import IntervalController
+from pipeline.metrics import MetricsRegistry
+from pipeline.metadata import check_event_meta_layout, msgconv_sections, write_msgconv_config
+from pipeline.occupancy import OccupancyTracker
+from pipeline.overlay import ZoneOverlay
+from pipeline.publisher import EventPublisher
+from pipeline.recording import DetectionRecorder
+from pipeline.roi import source_rois, write_preprocess_config
+from pipeline.secondary import GATE_COMPONENT_ID, SecondaryGate
+from pipeline.snapshots import SnapshotPool
+from pipeline.topology import build_graph, load_profiles
+from pipeline.watchdog import SourceWatchdog
+from pipeline.zones import ZoneEngine
 
 
 class Pipeline():
-    def __init__(self, config: Dict, protolib_path: str, connection_string: str) -> None:
-        self.config = config
+    def __init__(self, sources: List[Optional[SourceConfig]], protolib_path: Optional[str] = None,
+                 connection_string: Optional[str] = None, overlay_interval: int = 1,
+                 exit_timeout: float = 2.0, dwell_interval: float = 0.0,
+                 publisher: Optional[EventPublisher] = None,
+                 instrumentation: Optional[Instrumentation] = None,
+                 profile: str = "display", output_path: Optional[str] = None,
+                 rtsp_port: int = 0,
+                 gpu_id: int = 0, batch_size: Optional[int] = None,
+                 tracker_config_path: Optional[str] = None,
+                 interval_controller: Optional[IntervalController] = None,
+                 engine_cache: Optional[EngineCache] = None,
+                 roi: bool = False, roi_padding: int = 16, roi_object_height: int = 200,
+                 source_timeout: float = 0.0, max_reconnect_backoff: float = 60.0,
+                 max_reconnect_failures: int = 0,
+                 snapshots: Optional[SnapshotPool] = None,
+                 recorder: Optional[DetectionRecorder] = None,
+                 branch_policies: Optional[Dict[str, QueuePolicy]] = None,
+                 muxer_resolution: Optional[Tuple[int, int]] = (1920, 1080),
+                 muxer_push_timeout: Optional[int] = None,
+                 aggregator: Optional[ZoneAggregator] = None,
+                 publish_events: bool = True,
+                 secondary: Optional[SecondaryGate] = None) -> None:
         self._tiled_output_height = 1080
         self._tiled_output_width = 1920
+        # Derived from the source frame rates and resolutions when None
+        self._muxer_settings = muxer_settings(active_sources(sources), muxer_resolution,
+                                              muxer_push_timeout)
+        self._muxer_output_height = self._muxer_settings.height
+        self._muxer_output_width = self._muxer_settings.width
+        # Tracks the observed frame rates if the push timeout is derived
+        self._frame_rates = FrameRateEstimator() if muxer_push_timeout is None else None
+        if recorder is not None:
+            recorder.set_frame_size(self._muxer_output_width, self._muxer_output_height)
+        # Backpressure of the queues heading the branches after the tee
+        self._branch_policies = branch_policies or {}
+        self._queue_accounting = QueueAccounting()
+        self._branch_queues = {}
+        registry = instrumentation.registry if instrumentation is not None else MetricsRegistry()
+        self._queue_dropped = registry.counter(
+            "pipeline_queue_dropped_buffers_total", "Buffers dropped by a leaky branch queue",
+            ("queue", "branch"))
+        self._queue_overruns = registry.counter(
+            "pipeline_queue_overruns_total", "Times a branch queue was full", ("queue", "branch"))
+        self._topology_path = "configs/topology.json"
+        profiles = load_profiles(self._topology_path)
+        if profile not in profiles:
+            raise ValueError(f"Unknown profile '{profile}', available: {', '.join(profiles)}")
+        self._profile_name = profile
+        self._profile = profiles[profile]
+        self._output_path = output_path
+        # Served by an RTSP server restreaming the udpsink of the profile, 0 disables it
+        self._rtsp_port = rtsp_port
+        self._rtsp_server = None
+        if rtsp_port and not any(spec["name"] == "rtsp-sink" for spec in self._profile["elements"]):
+            raise ValueError(f"The {profile} profile has no RTSP output")
+        # Nothing is drawn without a renderer, the overlay is skipped entirely
+        self._overlay_interval = overlay_interval if self._profile.get("render", True) else 0
+        self._source_bins = {}
         self._model_config_path = "configs/model_config.txt"
         self._msg_config_path = "configs/msgconv_config.txt"
+        # Sections nvmsgconv loaded at startup, None without nvmsgconv
+        self._msgconv_sections = None
         self._protolib_path = protolib_path
         self._payload_type = 0
         self._connection_string = connection_string
+        self._publisher = publisher
+        self._instrumentation = instrumentation
+        occupancy = OccupancyTracker(exit_timeout=exit_timeout, dwell_interval=dwell_interval)
+        self._analytics = BatchAnalytics(self._compile_state(sources), occupancy, publisher,
+                                         snapshots=snapshots, recorder=recorder,
+                                         aggregator=aggregator,
+                                         publish_events=publish_events,
+                                         secondary=secondary)
+        self._snapshots = snapshots
+        self._gpu_id = gpu_id
+        # Inference batch size, defaults to the number of sources. A larger
+        # value leaves room for sources added at runtime
+        self._batch_size = batch_size
+        self._tracker_config_path = tracker_config_path
+        if tracker_config_path is None:
+            # Untracked objects all share one object id, see pipeline/occupancy.py
+            logging.warning("WARNING: Running without the tracker, every object of a zone is "
+                            "counted as one and the same occupant, so the ENTRY, DWELL and EXIT "
+                            "events and the entry and exit counts are meaningless")
+        # Skipped inferences are only filled in by the tracker
+        if interval_controller is not None and tracker_config_path is None:
+            raise ValueError("The adaptive inference interval requires the tracker")
+        self._interval_controller = interval_controller
+        # Dropped buffers already seen by the interval controller
+        self._interval_dropped = 0
+        # Classifies the objects inside the zones, by track
+        if secondary is not None and tracker_config_path is None:
+            raise ValueError("The secondary classifiers require the tracker")
+        self._secondary = secondary
+        self._engine_cache = engine_cache
+        self._engine_selection = None
+        self._preprocess_config_path = "configs/preprocess_config.txt"
+        # Infer only on the zone bounding boxes, see pipeline/roi.py
+        self._roi = roi
+        self._roi_padding = roi_padding
+        self._roi_object_height = roi_object_height
+        # Live sources silent for source_timeout seconds are reconnected
+        self._watchdog = None
+        if source_timeout > 0:
+            self._watchdog = SourceWatchdog(
+                self._teardown_source, self._restart_source,
+                stale_timeout=source_timeout, max_backoff=max_reconnect_backoff,
+                max_failures=max_reconnect_failures,
+                registry=instrumentation.registry if instrumentation is not None else None)
         self._build()
         
     def _build(self) -> None:
-        num_sources = len(self.config)
+        sources = active_sources(self._analytics.state.sources)
+        num_sources = len(sources)
+        # The muxer pads and the tiles are indexed by source id, a shard of a
+        # larger config keeps the global ids, so the tiles are laid out for the
+        # highest. The muxer batch only counts the source bins running
+        num_slots = len(self._analytics.state.sources)
         
         # Initializing libraries
         GObject.threads_init()
@@ -34,180 +160,119 @@ class Pipeline():
         # creating deepstream elements
         logging.info("Creating pipeline")
         self._pipeline = Gst.Pipeline()
-        is_live = False
+        is_live = any(source.is_live for source in sources)
         
         if not self._pipeline:
             raise RuntimeError("Unable to create pipeline")
         
-        logging.info("Creating streammux module")
-        streammux = Gst.ElementFactory.make("nvstreammux", "stream-muxer")
-        if not streammux:
-            raise RuntimeError("Unable to create streammux module")
-
-        self._pipeline.add(streammux)
-        
-        for i in range(num_sources):
-            logging.info(f"Creating source number {i}")
-            uri = self.config[str(i)]["uri"]
-            
-            if "rtsp://" in uri or "http://" in uri:
-                is_live = True
-            
-            source_bin = utils.create_source_bin(i, uri)
-            self._pipeline.add(source_bin)
-            sink_pad = streammux.get_request_pad(f"sink_{i}")
-            if not sink_pad:
-                raise RuntimeError("Unable to create streammux sink pad")
-            source_pad = source_bin.get_static_pad("src")
-            if not source_pad:
-                raise RuntimeError("Unable to create source bin source pad")
-            
-            source_pad.link(sink_pad)
-            
-        logging.info("Creating inference module")
-        pgie = Gst.ElementFactory.make("nvinfer", "primary-inference")
-        if not pgie:
-            raise RuntimeError("Unable to create inference module")
-        
-        logging.info("Creating video converter 1")
-        nvvidconv1 = Gst.ElementFactory.make("nvvideoconvert", "convertor1")
-        if not nvvidconv1:
-            raise RuntimeError("Unable to create video converter module 1")
-        
-        logging.info("Creating filter 1")
-        caps1 = Gst.Caps.from_string("video/x-raw(memory:NVMM), format=RGBA")
-        filter = Gst.ElementFactory.make("capsfilter", "filter1")
-        if not filter:
-            raise RuntimeError("Unable to create the caps filter")
-        
-        filter.set_property("caps", caps1)
-        
-        logging.info("Creating tiler")
-        tiler = Gst.ElementFactory.make("nvmultistreamtiler", "nvtiler")
-        if not tiler:
-            raise RuntimeError("Unable to create the tiler")
-
-        logging.info("Creating video converter 2")
-        nvvidconv2 = Gst.ElementFactory.make("nvvideoconvert", "convertor2")
-        if not nvvidconv2:
-            raise RuntimeError("Unable to create video converter module 2")
-        
-        logging.info("Creating nvosd")
-        nvosd = Gst.ElementFactory.make("nvdsosd", "onscreendisplay")
-        if not nvosd:
-            raise RuntimeError("Unable to create nvosd")
-        
-        logging.info("Creating tee")
-        tee = Gst.ElementFactory.make("tee", "tee")
-        if not tee:
-            raise RuntimeError("Unable to create tee")
-        
-        logging.info("Creating queue")
-        queue1 = Gst.ElementFactory.make("queue", "queue1")
-        if not queue1:
-            raise RuntimeError("Unable to create queue")
-        
-        logging.info("Creating queue")
-        queue2 = Gst.ElementFactory.make("queue", "queue2")
-        if not queue2:
-            raise RuntimeError("Unable to create queue")
-        
-        logging.info("Creating nvmsgconv")
-        nvmsgconv = Gst.ElementFactory.make("nvmsgconv", "msgconv")
-        if not nvmsgconv:
-            raise RuntimeError("Unable to create msgconv")
-        
-        logging.info("Creating nvmsgbroker")
-        nvmsgbroker = Gst.ElementFactory.make("nvmsgbroker", "broker")
-        if not nvmsgbroker:
-            raise RuntimeError("Unable to create nvmsgbroker")
-        
+        # With an asynchronous publisher the events never travel in the buffers
+        flags = {"msgbroker" if self._publisher is None else "async"}
         if utils.is_aarch64():
-            logging.info("Creating transform")
-            transform = Gst.ElementFactory.make("nvegltransform", "nvegl-transform")
-            if not transform:
-                raise RuntimeError("Unable to create transform")
+            flags.add("aarch64")
+        if self._tracker_config_path is not None:
+            flags.add("tracker")
+        if self._roi:
+            flags.add("roi")
+        if self._snapshots is not None:
+            flags.add("snapshot")
+        if self._secondary is not None:
+            flags.add("secondary")
+        if self._rtsp_port:
+            flags.add("rtsp")
         
-        logging.info("Creating output sink")
-        sink = Gst.ElementFactory.make("nveglglessink", "nvvideo-renderer")
-        if not sink:
-            raise RuntimeError("Unable to create output sink")
+        logging.info(f"Building the {self._profile_name} topology")
+        graph = build_graph(self._profile, utils.GstElementFactory(), self._pipeline, flags)
+        elements = graph.elements
+        self._elements = elements
+        for element in elements.values():
+            if element.find_property("gpu-id") is not None:
+                element.set_property("gpu-id", self._gpu_id)
+            # The snapshots map the frames on the CPU, dGPU memory has to be unified
+            if (self._snapshots is not None and not utils.is_aarch64()
+                    and element.find_property("nvbuf-memory-type") is not None):
+                element.set_property("nvbuf-memory-type", utils.NVBUF_MEM_CUDA_UNIFIED)
+        
+        streammux = elements["stream-muxer"]
+        self._streammux = streammux
+        for source in sources:
+            self._add_source_bin(source)
         
         if is_live:
             streammux.set_property("live-source", 1)
             
-        streammux.set_property("width", 1920)
-        streammux.set_property("height", 1080)
-        streammux.set_property("batch_size", num_sources)
-        streammux.set_property("batched-push-timeout", 40000)
+        streammux.set_property("width", self._muxer_output_width)
+        streammux.set_property("height", self._muxer_output_height)
+        streammux.set_property("batched-push-timeout", self._muxer_settings.batched_push_timeout)
+        logging.info(f"Muxer: {self._muxer_settings}")
+        streammux.set_property("batch_size", max(num_sources, 1))
         
-        pgie.set_property("config-file-path", self._model_config_path)
+        pgie = elements["primary-inference"]
+        batch_size = self._batch_size or num_sources
+        if "preprocess" in elements:
+            # Every region is one input of the inference batch, nvinfer maps
+            # the detections back to frame coordinates
+            num_rois = self._configure_preprocess(elements["preprocess"], sources)
+            pgie.set_property("input-tensor-meta", True)
+            batch_size = self._batch_size or num_rois
+        if self._engine_cache is not None:
+            # Use the smallest engine already built for at least batch_size
+            self._engine_selection = select_engine(self._model_config_path, self._engine_cache,
+                                                   batch_size, self._gpu_id)
+            pgie.set_property("config-file-path", self._engine_selection.config_path)
+            batch_size = self._engine_selection.batch_size
+        else:
+            pgie.set_property("config-file-path", self._model_config_path)
         pgie_batch_size = pgie.get_property("batch_size")
-        if pgie_batch_size != num_sources:
+        if pgie_batch_size != batch_size:
             logging.info(
                 f"WARNING: Overriding infer-config batch size {pgie_batch_size} with "
-                f"number of sources {num_sources}"
+                f"{batch_size}"
             )
-            pgie.set_property("batch_size", num_sources)
-            
-        tiler_rows = int(math.sqrt(num_sources))
-        tiler_columns = int(math.ceil(1.0 * num_sources / tiler_rows))
-        tiler.set_property("rows", tiler_rows)
-        tiler.set_property("columns", tiler_columns)
-        tiler.set_property("width", self._tiled_output_width)
-        tiler.set_property("height", self._tiled_output_height)
-        
-        sink.set_property("sync", 0)
-        sink.set_property("qos", 0)
-        
-        nvmsgconv.set_property("config", self._msg_config_path)
-        nvmsgconv.set_property("payload-type", self._payload_type)
-        nvmsgbroker.set_property("proto-lib", self._protolib_path)
-        nvmsgbroker.set_property("conn-str", self._connection_string)
-        nvmsgbroker.set_property("sync", False)
-        
-        logging.info("Adding elements to Pipeline")
-        self._pipeline.add(pgie)
-        self._pipeline.add(nvvidconv1)
-        self._pipeline.add(nvvidconv2)
-        self._pipeline.add(filter)
-        self._pipeline.add(tee)
-        self._pipeline.add(nvmsgconv)
-        self._pipeline.add(nvmsgbroker)
-        self._pipeline.add(nvosd)
-        self._pipeline.add(tiler)
-        self._pipeline.add(queue1)
-        self._pipeline.add(queue2)
-        if utils.is_aarch64():
-            self._pipeline.add(transform)
-        self._pipeline.add(sink)
+            pgie.set_property("batch_size", batch_size)
+        if self._interval_controller is not None:
+            pgie.set_property("interval", self._interval_controller.interval)
+        self._pgie = pgie
         
-        logging.info("Linkink elements in the pipeline")
-        streammux.link(pgie)
-        pgie.link(nvvidconv1)
-        nvvidconv1.link(filter)
-        filter.link(tiler)
-        tiler.link(nvvidconv2)
-        nvvidconv2.link(nvosd)
-        nvosd.link(tee)
+        if "tracker" in elements:
+            self._configure_tracker(elements["tracker"])
+        if self._secondary is not None:
+            self._add_secondary_chain(elements)
+        self._queues = [element for element in elements.values()
+                        if element.get_factory().get_name() == "queue"]
+        for name, branch in graph.branches.items():
+            policy = self._branch_policies.get(branch)
+            if policy is not None:
+                self._configure_branch_queue(elements[name], branch, policy)
         
-        queue1.link(nvmsgconv)
-        nvmsgconv.link(nvmsgbroker)
+        self._tiler = elements.get("nvtiler")
+        if self._tiler is not None:
+            tiler_rows, tiler_columns = utils.tiler_layout(num_slots)
+            self._tiler.set_property("rows", tiler_rows)
+            self._tiler.set_property("columns", tiler_columns)
+            self._tiler.set_property("width", self._tiled_output_width)
+            self._tiler.set_property("height", self._tiled_output_height)
         
-        if utils.is_aarch64():
-            queue2.link(transform)
-            transform.link(sink)
-        else:
-            queue2.link(sink)
-            
-        queue1_sink_pad = queue1.get_static_pad("sink")
-        queue2_sink_pad = queue2.get_static_pad("sink")
-        tee_msg_pad = tee.get_request_pad('src_%u')
-        tee_render_pad = tee.get_request_pad('src_%u')
-        if not tee_msg_pad or not tee_render_pad:
-            raise RuntimeError("Unable to get request pads\n")
-        tee_msg_pad.link(queue1_sink_pad)
-        tee_render_pad.link(queue2_sink_pad)
+        if "msgconv" in elements:
+            # The probe attaches event metas, copied with the DeepStream 6.1 layout
+            check_event_meta_layout()
+            nvmsgconv = elements["msgconv"]
+            # One sensor section per source so the events spread over the partitions
+            msg_config_path = os.path.join(tempfile.mkdtemp(prefix="msgconv_"),
+                                           os.path.basename(self._msg_config_path))
+            self._msgconv_sections = msgconv_sections(self._msg_config_path, sources)
+            write_msgconv_config(self._msgconv_sections, msg_config_path)
+            nvmsgconv.set_property("config", msg_config_path)
+            nvmsgconv.set_property("payload-type", self._payload_type)
+        if "broker" in elements:
+            nvmsgbroker = elements["broker"]
+            nvmsgbroker.set_property("proto-lib", self._protolib_path)
+            nvmsgbroker.set_property("conn-str", self._connection_string)
+        if "file-sink" in elements and self._output_path:
+            elements["file-sink"].set_property("location", self._output_path)
+        if "rtsp-sink" in elements:
+            # Clients joining the stream need the parameter sets on every key frame
+            elements["encoder"].set_property("insert-sps-pps", 1)
+            self._start_rtsp_server(elements["rtsp-sink"].get_property("port"))
         
         # Create an event management loop
         self._loop = GObject.MainLoop()
@@ -217,26 +282,357 @@ class Pipeline():
         bus.add_signal_watch()
         # Call the bus_call function whenever a message signal is received
         bus.connect("message", bus_call, self._loop)
+        if self._watchdog is not None:
+            bus.connect("message::error", self._on_source_error)
+            GLib.timeout_add(500, self._check_sources)
+        if self._branch_queues or self._frame_rates is not None:
+            GLib.timeout_add(1000, self._check_flow)
         
-        tiler_sink_pad = tiler.get_static_pad("sink")
-        if not tiler_sink_pad:
-            raise RuntimeError("Unable to get tiler sink")
+        probe_pad = elements[graph.probe_element].get_static_pad(graph.probe_pad)
+        if not probe_pad:
+            raise RuntimeError(f"Unable to get {graph.probe_element} {graph.probe_pad} pad")
 
-        tiler_sink_pad.add_probe(
+        probe_pad.add_probe(
             Gst.PadProbeType.BUFFER,
             self._tiler_sink_buffer_probe,
             0
         )
+        
+        if self._instrumentation is not None:
+            self._instrumentation.attach(elements, entry_element=streammux.get_name())
+            if self._publisher is not None:
+                self._instrumentation.watch("event-publisher", lambda: len(self._publisher))
+            if self._snapshots is not None:
+                self._instrumentation.watch("snapshot-pool", lambda: len(self._snapshots))
+    
+    
+    def _configure_preprocess(self, preprocess: Gst.Element, sources: List[SourceConfig]) -> int:
+        rois = source_rois(sources, self._muxer_output_width, self._muxer_output_height,
+                           padding=self._roi_padding, object_height=self._roi_object_height)
+        for source_id, regions in rois:
+            logging.info(f"Source {source_id} regions of interest: {regions}")
+        config_path = os.path.join(tempfile.mkdtemp(prefix="preprocess_"),
+                                   os.path.basename(self._preprocess_config_path))
+        num_rois = write_preprocess_config(self._preprocess_config_path, rois, config_path,
+                                           gpu_id=self._gpu_id)
+        preprocess.set_property("config-file", config_path)
+        return num_rois
+    
+    def _configure_branch_queue(self, queue: Gst.Element, branch: str,
+                                policy: QueuePolicy) -> None:
+        name = queue.get_name()
+        logging.info(f"Branch {branch} ({name}): {policy}")
+        for key, value in policy.properties().items():
+            queue.set_property(key, value)
+        self._branch_queues[name] = (queue, branch)
+        self._queue_accounting.add(name, policy.leaky)
+        queue.connect("overrun", self._on_queue_overrun, branch)
+    
+    def _on_queue_overrun(self, queue: Gst.Element, branch: str) -> None:
+        name = queue.get_name()
+        dropped = self._queue_accounting.overrun(name)
+        self._queue_overruns.inc(1, (name, branch))
+        if dropped:
+            self._queue_dropped.inc(dropped, (name, branch))
+    
+    def _check_flow(self) -> bool:
+        for name, (queue, branch) in self._branch_queues.items():
+            dropped = self._queue_accounting.update(name)
+            if dropped:
+                logging.warning(f"Branch {branch} ({name}) dropped {dropped} buffers")
+        if self._frame_rates is not None:
+            rates = self._frame_rates.rates()
+            if rates:
+                sources = [source for source in active_sources(self._analytics.state.sources)
+                           if source.source_id in self._source_bins]
+                timeout = muxer_settings(sources, (self._muxer_output_width,
+                                                   self._muxer_output_height),
+                                         observed_rates=rates).batched_push_timeout
+                current = self._muxer_settings.batched_push_timeout
+                # Small fluctuations of the measured rates are ignored
+                if abs(timeout - current) > 0.1 * current:
+                    logging.info(f"Observed frame rates {rates}: muxer push timeout "
+                                 f"{current} -> {timeout} us")
+                    self._muxer_settings.batched_push_timeout = timeout
+                    self._streammux.set_property("batched-push-timeout", timeout)
+        return True
+    
+    def _add_secondary_chain(self, elements: Dict[str, Gst.Element]) -> None:
+        """Link the classifiers between the secondary-entry and -exit elements
+        of the topology and gate the objects in front of them"""
+        factory = utils.GstElementFactory()
+        previous = elements["secondary-entry"]
+        for classifier in self._secondary.classifiers:
+            logging.info(f"Secondary classifier: {classifier}")
+            name = f"secondary-{classifier.name}"
+            sgie = factory.make("nvinfer", name)
+            if not sgie:
+                raise RuntimeError(f"Unable to create {name} (nvinfer)")
+            sgie.set_property("config-file-path", classifier.config_path)
+            sgie.set_property("unique-id", classifier.unique_id)
+            sgie.set_property("process-mode", 2)
+            # Only the objects the gate handed over are classified
+            sgie.set_property("infer-on-gie-id", GATE_COMPONENT_ID)
+            sgie.set_property("gpu-id", self._gpu_id)
+            self._pipeline.add(sgie)
+            if not factory.link(previous, sgie, False):
+                raise RuntimeError(f"Unable to link {previous.get_name()} to {name}")
+            elements[name] = sgie
+            previous = sgie
+        if not factory.link(previous, elements["secondary-exit"], False):
+            raise RuntimeError(f"Unable to link {previous.get_name()} to secondary-exit")
+        elements["secondary-entry"].get_static_pad("sink").add_probe(
+            Gst.PadProbeType.BUFFER, self._secondary_gate_probe, 0)
+    
+    def _secondary_gate_probe(self, pad, info, u_data):
+        gst_buffer = info.get_buffer()
+        if not gst_buffer:
+            return Gst.PadProbeReturn.OK
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
+        self._secondary.gate(batch_meta, self._analytics.state.zone_engine)
+        return Gst.PadProbeReturn.OK
+    
+    def _configure_tracker(self, tracker: Gst.Element) -> None:
+        config = configparser.ConfigParser()
+        config.read(self._tracker_config_path)
+        if not config.has_section("tracker"):
+            raise ValueError(f"{self._tracker_config_path}: missing [tracker] section")
+        for key, value in config.items("tracker"):
+            if key in ("tracker-width", "tracker-height", "enable-batch-process",
+                       "enable-past-frame"):
+                tracker.set_property(key, int(value))
+            else:
+                tracker.set_property(key, value)
+    
+    def _start_rtsp_server(self, udp_port: int) -> None:
+        # Only needed with RTSP output, the bindings are not always installed
+        gi.require_version("GstRtspServer", "1.0")
+        from gi.repository import GstRtspServer
+        server = GstRtspServer.RTSPServer.new()
+        server.props.service = str(self._rtsp_port)
+        factory = GstRtspServer.RTSPMediaFactory.new()
+        factory.set_launch(
+            f'( udpsrc name=pay0 port={udp_port} buffer-size=524288 caps="application/x-rtp, '
+            f'media=video, clock-rate=90000, encoding-name=(string)H264, payload=96" )')
+        factory.set_shared(True)
+        server.get_mount_points().add_factory("/zones", factory)
+        if not server.attach(None):
+            raise RuntimeError(f"Unable to start the RTSP server on port {self._rtsp_port}")
+        self._rtsp_server = server
+        logging.info(f"RTSP output at rtsp://localhost:{self._rtsp_port}/zones")
+    
+    def _compile_state(self, sources: List[Optional[SourceConfig]],
+                       reset_sources: FrozenSet[int] = frozenset()) -> AnalyticsState:
+        zone_engine = ZoneEngine(sources,
+                                 frame_width=self._muxer_output_width,
+                                 frame_height=self._muxer_output_height)
+        zone_overlay = ZoneOverlay(sources, interval=self._overlay_interval)
+        return AnalyticsState(sources, zone_engine, zone_overlay, reset_sources)
+    
+    def _add_source_bin(self, source: SourceConfig) -> Gst.Bin:
+        logging.info(f"Creating source number {source.source_id}")
+        source_bin = utils.create_source_bin(source.source_id, source.uri)
+        self._pipeline.add(source_bin)
+        sink_pad = self._streammux.get_request_pad(f"sink_{source.source_id}")
+        if not sink_pad:
+            raise RuntimeError("Unable to create streammux sink pad")
+        source_pad = source_bin.get_static_pad("src")
+        if not source_pad:
+            raise RuntimeError("Unable to create source bin source pad")
+        
+        source_pad.link(sink_pad)
+        self._source_bins[source.source_id] = source_bin
+        watched = self._watchdog is not None and source.is_live
+        if watched or self._frame_rates is not None:
+            source_pad.add_probe(Gst.PadProbeType.BUFFER, self._source_buffer_probe,
+                                 source.source_id)
+        if watched:
+            self._watchdog.add(source.source_id)
+        return source_bin
+    
+    def _source_buffer_probe(self, pad, info, source_id: int):
+        if self._watchdog is not None:
+            self._watchdog.buffer(source_id)
+        if self._frame_rates is not None:
+            self._frame_rates.tick(source_id)
+        return Gst.PadProbeReturn.OK
+    
+    def _on_source_error(self, bus, message) -> None:
+        # Errors of a source bin only take that source down
+        element = message.src
+        while element is not None:
+            name = element.get_name()
+            if name.startswith("source-bin-"):
+                self._watchdog.error(int(name[len("source-bin-"):]))
+                return
+            element = element.get_parent()
+    
+    def _check_sources(self) -> bool:
+        self._watchdog.check()
+        return True
     
+    def _teardown_source(self, source_id: int) -> None:
+        if source_id not in self._source_bins:
+            return
+        # The muxer batch shrinks to the remaining sources so it does not wait
+        # batched-push-timeout for the missing one, the tiler layout is kept
+        # so the other tiles do not move
+        if self._remove_source_bin(source_id):
+            self._update_batch_layout()
+    
+    def _restart_source(self, source_id: int) -> None:
+        sources = self._analytics.state.sources
+        if source_id >= len(sources) or sources[source_id] is None:
+            self._watchdog.remove(source_id)
+            return
+        # A bin that failed to stop is still in the pipeline under its name
+        if source_id in self._source_bins and not self._remove_source_bin(source_id):
+            return
+        try:
+            source_bin = self._add_source_bin(sources[source_id])
+        except RuntimeError as e:
+            # Retried with backoff once the startup timeout expires
+            logging.error(f"Unable to recreate source {source_id}: {e}")
+            return
+        source_bin.sync_state_with_parent()
+        self._update_batch_layout()
+    
+    def _remove_source_bin(self, source_id: int) -> bool:
+        """Stop a source bin and take it out of the pipeline, False if it
+        failed to stop, it then stays tracked so the removal can be retried"""
+        logging.info(f"Removing source number {source_id}")
+        source_bin = self._source_bins[source_id]
+        state_return = source_bin.set_state(Gst.State.NULL)
+        if state_return == Gst.StateChangeReturn.FAILURE:
+            logging.error(f"Unable to stop source {source_id}")
+            return False
+        if state_return == Gst.StateChangeReturn.ASYNC:
+            source_bin.get_state(Gst.CLOCK_TIME_NONE)
+        
+        del self._source_bins[source_id]
+        if self._frame_rates is not None:
+            self._frame_rates.remove(source_id)
+        sink_pad = self._streammux.get_static_pad(f"sink_{source_id}")
+        if sink_pad is not None:
+            sink_pad.send_event(Gst.Event.new_flush_stop(False))
+            self._streammux.release_request_pad(sink_pad)
+        self._pipeline.remove(source_bin)
+        return True
+    
+    def _update_batch_layout(self) -> None:
+        num_sources = max(len(self._source_bins), 1)
+        num_slots = max(len(self._analytics.state.sources), 1)
+        # A batch waits for at most one frame of every running source bin
+        self._streammux.set_property("batch_size", num_sources)
+        # nvinfer keeps the batch size of its engine, a larger engine is needed
+        # before more sources than the configured batch size can be added
+        if self._pgie.get_property("batch_size") < num_sources:
+            logging.warning(
+                f"Inference batch size {self._pgie.get_property('batch_size')} is lower "
+                f"than the number of sources {num_sources}"
+            )
+        if self._tiler is not None:
+            tiler_rows, tiler_columns = utils.tiler_layout(num_slots)
+            self._tiler.set_property("rows", tiler_rows)
+            self._tiler.set_property("columns", tiler_columns)
+    
+    def reload_config(self, config: Dict) -> bool:
+        """Apply a new application config without rebuilding the pipeline.
+        
+        Removed sources are stopped and their muxer pads released, added ones
+        get a new source bin, then zones and thresholds are swapped between
+        two batches. Must be called from the main loop thread.
+
+        Args:
+            config (Dict): Content of app_config.json
+
+        Returns:
+            bool: False if the config is invalid, or changes what nvmsgconv
+                only reads at startup, and was not applied
+        """
+        try:
+            sources = compile_config(config)
+        except ValueError as e:
+            logging.error(f"Invalid config, keeping the current one: {e}")
+            return False
+        if self._msgconv_sections is not None:
+            # nvmsgconv reads its sensor and place sections when it starts
+            needed = msgconv_sections(self._msg_config_path, sources)
+            stale = sorted(section for section, values in needed.items()
+                           if self._msgconv_sections.get(section) != values)
+            if stale:
+                logging.error(f"The config changes the nvmsgconv sections {stale}, which are "
+                              f"only read at startup, keeping the current config until a "
+                              f"restart")
+                return False
+        
+        added, removed, changed = diff_sources(self._analytics.state.sources, sources)
+        logging.info(f"Reloading config: added={added} removed={removed} changed={changed}")
+        if self._roi and (added or changed):
+            # nvdspreprocess reads its regions once, see pipeline/roi.py
+            logging.warning(f"Regions of interest are computed at startup, the new zones of "
+                            f"sources {sorted(added + changed)} are only inferred on after "
+                            f"a restart")
+        for source_id in removed:
+            if self._watchdog is not None:
+                self._watchdog.remove(source_id)
+            # A source down is already torn down
+            if source_id in self._source_bins:
+                self._remove_source_bin(source_id)
+        
+        # Occupancies of sources whose zones changed or went away are exited
+        self._analytics.state = self._compile_state(sources, frozenset(removed + changed))
+        if self._publisher is not None:
+            self._publisher.configure(sources)
+        
+        for source_id in added:
+            # A removed bin that failed to stop still holds the name and muxer pad
+            if source_id in self._source_bins and not self._remove_source_bin(source_id):
+                logging.error(f"Source {source_id} not added, its previous bin is still running")
+                continue
+            source_bin = self._add_source_bin(sources[source_id])
+            source_bin.sync_state_with_parent()
+        if added or removed:
+            self._update_batch_layout()
+        return True
+    
+    def watch_config(self, path: str, interval: float = 1.0) -> None:
+        """Reload the config whenever the file at path changes"""
+        watcher = ConfigWatcher(path)
+        
+        def check() -> bool:
+            config = watcher.check()
+            if config is not None:
+                self.reload_config(config)
+            return True
+        
+        GLib.timeout_add(int(interval * 1000), check)
+    
+    def close_analytics(self) -> None:
+        """Publish the EXIT events of the objects still inside a zone and the
+        last zone summaries, called once the pipeline stopped"""
+        events = self._analytics.close()
+        logging.info(f"Flushed {len(events)} occupancies on shutdown")
     
     def _clean(self) -> None:
         logging.info("Cleaning up pipeline")
+        logging.info(f"Zone overlay: {self._analytics.state.zone_overlay.stats}")
+        logging.info(f"Event metas: {self._analytics.event_meta.stats}")
+        if self._watchdog is not None:
+            logging.info(f"Sources: {self._watchdog.stats()}")
+        if self._branch_queues:
+            logging.info(f"Branch queues: {self._queue_accounting.stats()}")
+        if self._secondary is not None:
+            logging.info(f"Secondary classifiers: {self._secondary}")
         pyds.unset_callback_funcs()
         self._pipeline.set_state(Gst.State.NULL)
     
     def run(self) -> None:
         logging.info("Running pipeline")
         self._pipeline.set_state(Gst.State.PLAYING)
+        # nvinfer has built its engine, if it had to, by the time the state changed
+        if self._engine_selection is not None:
+            self._engine_selection.adopt()
         try:
             self._loop.run()
         except Exception as e:
@@ -248,91 +644,48 @@ class Pipeline():
         
         if not gst_buffer:
             logging.warning("Unable to get GstBuffer")
+            return Gst.PadProbeReturn.OK
             
         batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
-        l_frame = batch_meta.frame_meta_list
         
-        while l_frame is not None:
-            try:
-                frame_meta = pyds.NvDsFrameMeta.cast(l_frame.data)
-            except StopIteration:
-                break
-            
-            # Extracting the configuration for the current frame
-            source_id = frame_meta.source_id
-            stream_config = self.config[str(source_id)]
-            restricted_zones = stream_config["restricted_zones"]
-            
-            # Display the restricted zones
-            for zone in restricted_zones:
-                display_meta = pyds.nvds_acquire_display_meta_from_pool(batch_meta)
-                display_meta.num_lines = len(zone)
-                lines_params = display_meta.line_params
-                for line_idx in range(display_meta.num_lines):
-                    params = lines_params[line_idx]
-                    line = zone[line_idx]
-                                        
-                    params.x1 = line[0][0]
-                    params.y1 = line[0][1]
-                    params.x2 = line[1][0]
-                    params.y2 = line[1][1]
-                    
-                    params.line_width = 3
-                    params.line_color.set(1.0, 0, 0, 1.0)
-                    
-                pyds.nvds_add_display_meta_to_frame(frame_meta, display_meta)
-            
-            l_obj = frame_meta.obj_meta_list
-            
-            while l_obj is not None:
-                try:
-                    obj_meta = pyds.NvDsObjectMeta.cast(l_obj.data)
-                except StopIteration:
-                    break
-                
-                # Making all the boxes green
-                obj_meta.rect_params.border_color.set(0, 1.0, 0, 1.0)
-                
-                # Only high confidence detections are evaluated
-                if (obj_meta.class_id == 0 and obj_meta.confidence >= stream_config["car_confidence"]) or \
-                   (obj_meta.class_id == 2 and obj_meta.confidence >= stream_config["person_confidence"]):
-                       
-                    feet_point_x = obj_meta.rect_params.left + obj_meta.rect_params.width / 2
-                    feet_point_y = obj_meta.rect_params.top + obj_meta.rect_params.height
-                    person_position = Point(feet_point_x, feet_point_y)
-                    
-                    for zone in restricted_zones:
-                        # Create polygons from lines, used to evaliated persons positions
-                        zone = MultiLineString(zone).convex_hull
-                        alarm = zone.contains(person_position)
-                        if alarm:
-                            obj_meta.rect_params.border_color.set(1.0, 0, 0, 1.0)
-                            msg_meta = generate_event_msg_meta(obj_meta, frame_meta)
-                            user_event_meta = pyds.nvds_acquire_user_meta_from_pool(batch_meta)
-                            if user_event_meta:
-                                user_event_meta.user_meta_data = msg_meta
-                                user_event_meta.base_meta.meta_type = pyds.NvDsMetaType.NVDS_EVENT_MSG_META
-                                pyds.user_copyfunc(user_event_meta, meta_copy_func)
-                                pyds.user_releasefunc(user_event_meta, meta_free_func)
-                                pyds.nvds_add_user_meta_to_frame(frame_meta, user_event_meta)
-                            else:
-                                logging.warning("Error in attaching event meta to buffer")
-                            break
-
-                else:
-                    obj_meta.rect_params.border_width = 0
-                    obj_meta.text_params.display_text = ""
-                    obj_meta.text_params.set_bg_clr = 0
-                
-                try:
-                    l_obj = l_obj.next
-                except StopIteration:
-                    break
-                
-            try:
-                l_frame = l_frame.next
-            except StopIteration:
-                break
-            
+        frame_image = None
+        if self._snapshots is not None:
+            buffer_hash = hash(gst_buffer)
+            frame_image = lambda frame_meta: pyds.get_nvds_buf_surface(buffer_hash,
+                                                                       frame_meta.batch_id)
+        
+        instrumentation = self._instrumentation
+        if instrumentation is None or not instrumentation.enabled:
+            frames, _ = self._analytics.process_batch(batch_meta, frame_image)
+        else:
+            start = time.perf_counter()
+            frames, events = self._analytics.process_batch(batch_meta, frame_image)
+            instrumentation.record_batch(time.perf_counter() - start, frames, len(events))
+        
+        if self._interval_controller is not None:
+            self._control_interval(frames)
         return Gst.PadProbeReturn.OK
-    
\ No newline at end of file
+    
+    def _control_interval(self, frames: Dict) -> None:
+        # The muxer stamps the frames with the system time by default
+        stamps = [frame_meta.ntp_timestamp for frame_meta in frames.values()
+                  if frame_meta.ntp_timestamp]
+        if not stamps:
+            return
+        latency = time.time() - min(stamps) / 1e9
+        # A leaky queue never fills past its limit, its drops are the overload
+        queue_depth = max((queue.get_property("current-level-buffers")
+                           for queue in self._queues
+                           if queue.get_property("leaky") == 0), default=0)
+        dropped = self._queue_accounting.dropped
+        new_drops = dropped - self._interval_dropped
+        self._interval_dropped = dropped
+        interval = self._interval_controller.observe(latency, queue_depth, new_drops)
+        if interval is not None:
+            logging.info(f"Batch latency {1000 * latency:.1f} ms, queue depth {queue_depth}, "
+                         f"{new_drops} dropped buffers: inference interval set to {interval}")
+            GLib.idle_add(self._set_interval, interval)
+    
+    def _set_interval(self, interval: int) -> bool:
+        self._pgie.set_property("interval", interval)
+        return False
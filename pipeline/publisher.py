@@ -0,0 +1,357 @@
+"""Asynchronous event publishing off the GStreamer streaming thread.
+
+The buffer probe only appends compact :class:`Event` records to a bounded
+deque, under a condition held for the append alone, which wakes the worker
+thread when a batch can start or is full. The worker drains the deque,
+batches the records until the batch is full or the linger time expires,
+encodes and optionally compresses them and hands the messages to a
+pluggable transport. Encoding and sending happen outside the condition.
+"""
+import gzip
+import json
+import logging
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Callable, List, Optional, Tuple, Union
+
+from pipeline.events import Event
+
+# (key, value) pairs as sent to the transport
+Message = Tuple[Optional[bytes], bytes]
+Encoder = Callable[[List[Event]], List[Message]]
+
+BACKPRESSURE_POLICIES = ("drop_oldest", "block", "drop_new")
+COMPRESSIONS = {
+    "gzip": gzip.compress,
+    "zlib": zlib.compress,
+}
+
+
+def event_to_dict(event: Event) -> dict:
+    payload = {
+        "type": event.type.name,
+        "source_id": event.source_id,
+        "frame": event.frame_num,
+        "tracking_id": event.tracking_id,
+        "zone": event.zone,
+        "class_id": event.class_id,
+        "confidence": round(event.confidence, 4),
+        "bbox": [event.left, event.top, event.width, event.height],
+        "timestamp": event.timestamp,
+        "dwell": round(event.dwell, 3),
+    }
+    if event.snapshot is not None:
+        payload["snapshot"] = event.snapshot
+    if event.attributes is not None:
+        payload["attributes"] = event.attributes
+    return payload
+
+
+def encode_json(events: List[Event]) -> List[Message]:
+    """Encode one JSON message per event, keyed by source for partitioning"""
+    return [
+        (str(event.source_id).encode(), json.dumps(event_to_dict(event)).encode())
+        for event in events
+    ]
+
+
+class Transport():
+    """Destination of the encoded messages"""
+
+    def send(self, messages: List[Message]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryTransport(Transport):
+    """Keeps the messages in memory, stand-in broker for tests"""
+
+    def __init__(self) -> None:
+        self.messages = []
+
+    def send(self, messages: List[Message]) -> None:
+        self.messages.extend(messages)
+
+
+class FileTransport(Transport):
+    """Appends length prefixed messages to a local file
+
+    Args:
+        path (str): Output file
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "ab")
+
+    def send(self, messages: List[Message]) -> None:
+        for _, value in messages:
+            self._file.write(struct.pack(">I", len(value)))
+            self._file.write(value)
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    @staticmethod
+    def read(path: str) -> List[bytes]:
+        """Read back the messages written by a FileTransport"""
+        messages = []
+        with open(path, "rb") as file:
+            while True:
+                header = file.read(4)
+                if len(header) < 4:
+                    break
+                messages.append(file.read(struct.unpack(">I", header)[0]))
+        return messages
+
+
+class KafkaTransport(Transport):
+    """Publishes the messages to a Kafka topic, requires confluent-kafka
+
+    Args:
+        connection_string (str): <host>;<port>;<topic>, as for nvmsgbroker
+    """
+
+    def __init__(self, connection_string: str) -> None:
+        try:
+            from confluent_kafka import Producer
+        except ImportError as e:
+            raise RuntimeError("The kafka transport requires confluent-kafka") from e
+
+        host, port, topic = connection_string.split(";")
+        self._topic = topic
+        self._producer = Producer({"bootstrap.servers": f"{host}:{port}"})
+
+    def send(self, messages: List[Message]) -> None:
+        for key, value in messages:
+            while True:
+                try:
+                    self._producer.produce(self._topic, value=value, key=key)
+                    break
+                except BufferError:
+                    # Local producer queue is full, wait for deliveries
+                    self._producer.poll(0.1)
+        self._producer.poll(0)
+
+    def close(self) -> None:
+        self._producer.flush(10)
+
+
+def create_transport(name: str, connection_string: str) -> Transport:
+    """Create a transport by name
+
+    Args:
+        name (str): One of kafka, file or memory
+        connection_string (str): Kafka connection string or output file path
+
+    Raises:
+        ValueError: If the transport is unknown
+
+    Returns:
+        Transport: The transport
+    """
+    if name == "kafka":
+        return KafkaTransport(connection_string)
+    if name == "file":
+        return FileTransport(connection_string)
+    if name == "memory":
+        return MemoryTransport()
+    raise ValueError(f"Unknown transport '{name}'")
+
+
+class PublisherStats():
+    """Throughput and backpressure counters of the publisher"""
+    __slots__ = ("started", "submitted", "dropped", "blocked_seconds", "published_events",
+                 "published_messages", "published_bytes", "failed_batches", "lost_events")
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.submitted = 0
+        self.dropped = 0
+        self.blocked_seconds = 0.0
+        self.published_events = 0
+        self.published_messages = 0
+        self.published_bytes = 0
+        self.failed_batches = 0
+        # Events of the failed batches, see SpillingTransport to keep them
+        self.lost_events = 0
+
+    @property
+    def events_per_second(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.published_events / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f"submitted={self.submitted} dropped={self.dropped} "
+                f"blocked={self.blocked_seconds:.2f}s published={self.published_events} "
+                f"messages={self.published_messages} bytes={self.published_bytes} "
+                f"failed_batches={self.failed_batches} lost={self.lost_events} rate={self.events_per_second:.1f}/s")
+
+
+class EventPublisher():
+    """Batches events on a worker thread and publishes them through a transport.
+
+    Args:
+        transport (Transport): Destination of the messages
+        encoder (Encoder): Turns a batch of events into messages
+        max_queue (int): Maximum number of pending events
+        backpressure (str): What submit does when the queue is full: drop_oldest
+            discards the oldest pending event, block waits for room and
+            drop_new discards the submitted event, all of them are counted
+        max_batch (int): Maximum number of events per batch
+        linger (float): Seconds to wait for a batch to fill up
+        compression (Optional[str]): Compress every message with gzip or zlib
+    """
+
+    def __init__(self, transport: Transport, encoder: Encoder = encode_json,
+                 max_queue: int = 10000, backpressure: str = "drop_oldest",
+                 max_batch: int = 500, linger: float = 0.05,
+                 compression: Optional[str] = None) -> None:
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{backpressure}'")
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compression}'")
+
+        self.stats = PublisherStats()
+        self._transport = transport
+        self._encoder = encoder
+        self._max_queue = max_queue
+        self._backpressure = backpressure
+        self._max_batch = max_batch
+        self._linger = linger
+        self._compress = COMPRESSIONS.get(compression)
+        maxlen = max_queue if backpressure == "drop_oldest" else None
+        self._queue = deque(maxlen=maxlen)
+        # Wakes the worker when a batch can start or is full, and the
+        # blocked submitters when the worker made room
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def configure(self, sources) -> None:
+        """Hand a new config to the encoder, if it describes the sources,
+        see CompactEncoder.configure"""
+        configure = getattr(self._encoder, "configure", None)
+        if configure is not None:
+            configure(sources)
+
+    def start(self) -> None:
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="event-publisher", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stop the worker after publishing the pending events. The transport
+        is only closed once the worker exited, a worker still sending after
+        the timeout keeps it open and close can be called again"""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logging.error(f"Event publisher still sending after {timeout}s, "
+                              f"{len(self._queue)} events pending, the transport is left open")
+                return
+            self._thread = None
+        self._transport.close()
+        logging.info(f"Event publisher: {self.stats}")
+
+    def submit(self, event: Event) -> bool:
+        """Queue an event for publishing, called from the streaming thread
+
+        Args:
+            event (Event): Event to publish
+
+        Returns:
+            bool: False if the event or an older one had to be dropped
+        """
+        return self._enqueue(event)
+
+    def submit_message(self, message: Message) -> bool:
+        """Queue an already encoded message, published as is after the
+        events of its batch, with the same backpressure
+
+        Args:
+            message (Message): (key, value) to send
+
+        Returns:
+            bool: False if the message or an older item had to be dropped
+        """
+        return self._enqueue(message)
+
+    def _enqueue(self, item: Union[Event, Message]) -> bool:
+        queue = self._queue
+        with self._condition:
+            self.stats.submitted += 1
+            accepted = True
+            if len(queue) >= self._max_queue:
+                if self._backpressure == "drop_new":
+                    self.stats.dropped += 1
+                    return False
+                if self._backpressure == "drop_oldest":
+                    # The deque discards its oldest item on append
+                    self.stats.dropped += 1
+                    accepted = False
+                else:
+                    start = time.monotonic()
+                    self._condition.wait_for(
+                        lambda: len(queue) < self._max_queue or not self._running)
+                    self.stats.blocked_seconds += time.monotonic() - start
+            queue.append(item)
+            if len(queue) == 1 or len(queue) == self._max_batch:
+                self._condition.notify_all()
+            return accepted
+
+    def _next_batch(self) -> List[Union[Event, Message]]:
+        queue = self._queue
+        with self._condition:
+            while not queue and self._running:
+                self._condition.wait()
+            # The batch lingers from its first event until it is full
+            deadline = time.monotonic() + self._linger
+            while len(queue) < self._max_batch and self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch = []
+            while queue and len(batch) < self._max_batch:
+                batch.append(queue.popleft())
+            if batch and self._backpressure == "block":
+                self._condition.notify_all()
+            return batch
+
+    def _run(self) -> None:
+        while self._running or self._queue:
+            batch = self._next_batch()
+            if batch:
+                self._publish(batch)
+
+    def _publish(self, batch: List[Union[Event, Message]]) -> None:
+        events = [item for item in batch if isinstance(item, Event)]
+        try:
+            messages = self._encoder(events) if events else []
+            if len(events) < len(batch):
+                messages.extend(item for item in batch if not isinstance(item, Event))
+            if self._compress is not None:
+                messages = [(key, self._compress(value)) for key, value in messages]
+            self._transport.send(messages)
+        except Exception:
+            logging.exception(f"Unable to publish a batch, {len(events)} events and "
+                              f"{len(batch) - len(events)} messages lost")
+            self.stats.failed_batches += 1
+            self.stats.lost_events += len(events)
+            return
+        self.stats.published_events += len(events)
+        self.stats.published_messages += len(messages)
+        self.stats.published_bytes += sum(len(value) for _, value in messages)
@@ -0,0 +1,262 @@
+"""Columnar recording of the detections seen by the probe.
+
+A recording is a directory of chunks, every chunk a directory holding one
+``.npy`` file per column so it can be memory-mapped and sliced without
+parsing:
+
+    <recording>/meta.json
+    <recording>/chunk-000000/frames.<column>.npy
+    <recording>/chunk-000000/detections.<column>.npy
+
+The frame table has one row per frame, empty frames included, and points to
+its detections through ``first`` and ``count``. ``timestamp`` is the analytics
+clock of the batch, the time the occupancy state machine saw. Chunks only
+end between batches. The probe fills preallocated column buffers and full
+chunks are written by a background thread, to a hidden directory renamed
+once complete. Chunks left unreadable or inconsistent by a crash or a full
+disk are skipped with a warning when the recording is read.
+"""
+import json
+import logging
+import os
+import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+FRAME_COLUMNS = {
+    "batch": np.int64,
+    "source_id": np.int32,
+    "frame_num": np.int64,
+    "timestamp": np.float64,
+    "first": np.int64,
+    "count": np.int32,
+}
+DETECTION_COLUMNS = {
+    "source_id": np.int32,
+    "frame_num": np.int64,
+    "timestamp": np.float64,
+    "class_id": np.int32,
+    "confidence": np.float32,
+    "left": np.float32,
+    "top": np.float32,
+    "width": np.float32,
+    "height": np.float32,
+    "object_id": np.uint64,
+}
+_META_FILE = "meta.json"
+_CHUNK_PREFIX = "chunk-"
+
+
+class _Chunk():
+    """Preallocated column buffers of one chunk"""
+    __slots__ = ("frames", "detections", "num_frames", "num_detections")
+
+    def __init__(self, frame_capacity: int, detection_capacity: int) -> None:
+        self.frames = {name: np.empty(frame_capacity, dtype) for name, dtype in FRAME_COLUMNS.items()}
+        self.detections = {name: np.empty(detection_capacity, dtype)
+                           for name, dtype in DETECTION_COLUMNS.items()}
+        self.num_frames = 0
+        self.num_detections = 0
+
+    def room(self, num_frames: int, num_detections: int) -> bool:
+        return (self.num_frames + num_frames <= len(self.frames["batch"])
+                and self.num_detections + num_detections <= len(self.detections["object_id"]))
+
+
+def _write_chunk(path: str, name: str, chunk: _Chunk) -> None:
+    # Readers only list the chunks once they are complete
+    partial = os.path.join(path, f".{name}")
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    for table, columns, size in (("frames", chunk.frames, chunk.num_frames),
+                                 ("detections", chunk.detections, chunk.num_detections)):
+        for column_name, column in columns.items():
+            np.save(os.path.join(partial, f"{table}.{column_name}.npy"), column[:size])
+    os.rename(partial, os.path.join(path, name))
+
+
+class DetectionRecorder():
+    """Records the detections of every batch into a columnar recording.
+
+    Args:
+        path (str): Directory of the recording, created if missing, the
+            chunks of a previous recording in it are kept
+        frame_width (int): Muxer output width, stored in the metadata
+        frame_height (int): Muxer output height
+        chunk_size (int): Detections per chunk, the frame table holds as many rows
+    """
+
+    def __init__(self, path: str, frame_width: int = 1920, frame_height: int = 1080,
+                 chunk_size: int = 1 << 16) -> None:
+        if chunk_size < 1:
+            raise ValueError("The recording chunk size must be positive")
+        self.path = path
+        self.chunk_size = chunk_size
+        os.makedirs(path, exist_ok=True)
+        chunks = list_chunks(path)
+        self._next_chunk = int(chunks[-1][len(_CHUNK_PREFIX):]) + 1 if chunks else 0
+        self._batch = 0
+        # Appending to a previous recording, the batch numbers go on from
+        # its last readable chunk
+        for name in reversed(chunks):
+            try:
+                frames, _ = load_chunk(os.path.join(path, name))
+            except (OSError, ValueError):
+                continue
+            if len(frames["batch"]):
+                self._batch = int(frames["batch"][-1]) + 1
+                break
+        self.set_frame_size(frame_width, frame_height)
+        self._chunk = _Chunk(chunk_size, chunk_size)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recorder")
+        self.frames = 0
+        self.detections = 0
+
+    def set_frame_size(self, frame_width: int, frame_height: int) -> None:
+        """Store the muxer output resolution the coordinates are relative to"""
+        with open(os.path.join(self.path, _META_FILE), "w") as file:
+            json.dump({"version": FORMAT_VERSION, "frame_width": frame_width,
+                       "frame_height": frame_height}, file, indent=4)
+
+    def record(self, now: float, frames: Dict, objects: List, class_ids: List[int],
+               confidences: List[float]) -> None:
+        """Append the detections of a batch, called from the probe
+
+        Args:
+            now (float): Analytics time of the batch
+            frames (Dict): Frame metas of the batch by source id, in batch order
+            objects (List): (object meta, frame meta) of every detection,
+                grouped by frame in batch order
+            class_ids (List[int]): Class id of every detection
+            confidences (List[float]): Confidence of every detection
+        """
+        num_objects = len(objects)
+        chunk = self._chunk
+        if not chunk.room(len(frames), num_objects):
+            self.flush()
+            chunk = self._chunk = _Chunk(max(self.chunk_size, len(frames)),
+                                         max(self.chunk_size, num_objects))
+
+        columns = chunk.frames
+        first = chunk.num_detections
+        start = chunk.num_frames
+        row = start
+        for source_id, frame_meta in frames.items():
+            columns["batch"][row] = self._batch
+            columns["source_id"][row] = source_id
+            columns["frame_num"][row] = frame_meta.frame_num
+            columns["count"][row] = 0
+            row += 1
+        columns["timestamp"][start:row] = now
+        chunk.num_frames = row
+        self._batch += 1
+        self.frames += len(frames)
+        if not num_objects:
+            columns["first"][start:row] = first
+            return
+
+        end = first + num_objects
+        columns = chunk.detections
+        columns["class_id"][first:end] = class_ids
+        columns["confidence"][first:end] = confidences
+        columns["timestamp"][first:end] = now
+        rows = {source_id: start + i for i, source_id in enumerate(frames)}
+        counts = chunk.frames["count"]
+        source_ids, frame_nums, object_ids = [], [], []
+        lefts, tops, widths, heights = [], [], [], []
+        for obj_meta, frame_meta in objects:
+            rect_params = obj_meta.rect_params
+            source_ids.append(frame_meta.source_id)
+            frame_nums.append(frame_meta.frame_num)
+            object_ids.append(obj_meta.object_id)
+            lefts.append(rect_params.left)
+            tops.append(rect_params.top)
+            widths.append(rect_params.width)
+            heights.append(rect_params.height)
+        for source_id, count in Counter(source_ids).items():
+            counts[rows[source_id]] = count
+        columns["source_id"][first:end] = source_ids
+        columns["frame_num"][first:end] = frame_nums
+        columns["object_id"][first:end] = object_ids
+        columns["left"][first:end] = lefts
+        columns["top"][first:end] = tops
+        columns["width"][first:end] = widths
+        columns["height"][first:end] = heights
+        # Detections are grouped by frame, the offsets follow the counts
+        offsets = first + np.cumsum(counts[start:row]) - counts[start:row]
+        chunk.frames["first"][start:row] = offsets
+        chunk.num_detections = end
+        self.detections += num_objects
+
+    def flush(self) -> None:
+        """Write the current chunk in the background and start a new one"""
+        chunk = self._chunk
+        if chunk.num_frames == 0:
+            return
+        name = f"{_CHUNK_PREFIX}{self._next_chunk:06d}"
+        self._next_chunk += 1
+        self._writer.submit(_write_chunk, self.path, name, chunk)
+        self._chunk = _Chunk(self.chunk_size, self.chunk_size)
+
+    def close(self) -> None:
+        self.flush()
+        self._writer.shutdown(wait=True)
+        logging.info(f"Recorded {self.frames} frames and {self.detections} detections "
+                     f"in {self._next_chunk} chunks to {self.path}")
+
+
+def list_chunks(path: str) -> List[str]:
+    """Chunk directories of a recording in recording order"""
+    return sorted(name for name in os.listdir(path) if name.startswith(_CHUNK_PREFIX))
+
+
+def load_chunk(directory: str, mmap: bool = True) -> Tuple[Dict[str, np.ndarray],
+                                                          Dict[str, np.ndarray]]:
+    """Frame and detection columns of a chunk, memory-mapped by default
+
+    Raises:
+        OSError: If a column file is missing
+        ValueError: If a column file is truncated or the columns disagree
+    """
+    mode = "r" if mmap else None
+    tables = []
+    for table, columns in (("frames", FRAME_COLUMNS), ("detections", DETECTION_COLUMNS)):
+        tables.append({name: np.load(os.path.join(directory, f"{table}.{name}.npy"),
+                                     mmap_mode=mode)
+                       for name in columns})
+    frames, detections = tables
+    for table in tables:
+        if len({len(column) for column in table.values()}) > 1:
+            raise ValueError(f"{directory}: columns of different lengths")
+    if int(np.sum(frames["count"], dtype=np.int64)) != len(detections["object_id"]):
+        raise ValueError(f"{directory}: the frames do not account for the detections")
+    return frames, detections
+
+
+def read_metadata(path: str) -> Dict:
+    """Metadata of a recording
+
+    Raises:
+        ValueError: If the recording format is not supported
+    """
+    with open(os.path.join(path, _META_FILE), "r") as file:
+        metadata = json.load(file)
+    if metadata.get("version") != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported recording version {metadata.get('version')}")
+    return metadata
+
+
+def iter_chunks(path: str) -> Iterator[Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]]:
+    """Frame and detection columns of every readable chunk of a recording"""
+    read_metadata(path)
+    for name in list_chunks(path):
+        try:
+            chunk = load_chunk(os.path.join(path, name))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Skipping chunk {name} of {path}: {e}")
+            continue
+        yield chunk
@@ -0,0 +1,120 @@
+"""Offline replay of recorded detections through the zone and event logic.
+
+The zone engine is stateless, so the detections of a whole chunk are
+evaluated in one vectorized pass. Only the (object, zone) hits then go
+through the occupancy state machine, batch by batch with the recorded
+analytics time, which reproduces the events the probe emitted. Changed
+zones and thresholds can so be backtested on hours of recordings at CPU
+speed.
+"""
+import time
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from pipeline.config import SourceConfig
+from pipeline.events import Event
+from pipeline.occupancy import OccupancyTracker
+from pipeline.recording import iter_chunks, read_metadata
+from pipeline.zones import ZoneEngine
+
+
+class ReplayStats():
+    """Counters of a replay"""
+    __slots__ = ("batches", "frames", "detections", "events", "recorded_seconds", "elapsed")
+
+    def __init__(self) -> None:
+        self.batches = 0
+        self.frames = 0
+        self.detections = 0
+        self.events = 0
+        # Summed over the replayed recordings
+        self.recorded_seconds = 0.0
+        self.elapsed = 0.0
+
+    @property
+    def speedup(self) -> float:
+        """Recorded time over replay time"""
+        return self.recorded_seconds / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self) -> Dict:
+        return {"batches": self.batches, "frames": self.frames, "detections": self.detections,
+                "events": self.events, "recorded_seconds": round(self.recorded_seconds, 3),
+                "elapsed": round(self.elapsed, 3), "speedup": round(self.speedup, 1)}
+
+
+def replay(path: str, sources: List[Optional[SourceConfig]], exit_timeout: float = 2.0,
+           dwell_interval: float = 0.0, flush: bool = True,
+           stats: Optional[ReplayStats] = None) -> Iterator[Event]:
+    """Replay a recording with a config
+
+    Args:
+        path (str): Directory of the recording
+        sources (List[Optional[SourceConfig]]): Compiled config to evaluate,
+            sources missing from it are ignored like removed sources
+        exit_timeout (float): See OccupancyTracker
+        dwell_interval (float): See OccupancyTracker
+        flush (bool): Exit the objects still in a zone at the end
+        stats (Optional[ReplayStats]): Filled in while replaying
+
+    Yields:
+        Event: Events in emission order
+    """
+    metadata = read_metadata(path)
+    engine = ZoneEngine(sources, metadata["frame_width"], metadata["frame_height"])
+    occupancy = OccupancyTracker(exit_timeout=exit_timeout, dwell_interval=dwell_interval)
+    stats = stats if stats is not None else ReplayStats()
+    start = time.perf_counter()
+    elapsed = stats.elapsed
+    first = now = None
+
+    for frames, detections in iter_chunks(path):
+        if not len(frames["batch"]):
+            continue
+        left, top = detections["left"], detections["top"]
+        hits = engine.evaluate(detections["source_id"], detections["class_id"],
+                               detections["confidence"],
+                               left + detections["width"] / 2, top + detections["height"])
+
+        # Batch boundaries in the frame and detection tables
+        batches = frames["batch"]
+        frame_starts = np.flatnonzero(np.diff(batches, prepend=batches[0] - 1))
+        detection_starts = frames["first"][frame_starts]
+        timestamps = frames["timestamp"][frame_starts].tolist()
+        hit_starts = np.searchsorted(hits.hit_objects, detection_starts).tolist()
+        hit_starts.append(len(hits.hit_objects))
+
+        # Only the hit rows are converted to Python values
+        hit_objects = hits.hit_objects
+        rows = {name: detections[name][hit_objects].tolist()
+                for name in ("source_id", "frame_num", "class_id", "confidence",
+                             "left", "top", "width", "height", "object_id")}
+        hit_zones = hits.hit_zones.tolist()
+
+        for batch, now in enumerate(timestamps):
+            events = []
+            for i in range(hit_starts[batch], hit_starts[batch + 1]):
+                occupancy.observe(now, rows["source_id"][i], rows["object_id"][i], hit_zones[i],
+                                  rows["frame_num"][i], rows["class_id"][i],
+                                  rows["confidence"][i],
+                                  (rows["left"][i], rows["top"][i], rows["width"][i],
+                                   rows["height"][i]),
+                                  events)
+            occupancy.expire(now, events)
+            stats.events += len(events)
+            yield from events
+
+        stats.batches += len(timestamps)
+        stats.frames += len(batches)
+        stats.detections += len(left)
+        if first is None:
+            first = timestamps[0]
+
+    if flush and now is not None:
+        events = []
+        occupancy.flush(now, events)
+        stats.events += len(events)
+        yield from events
+    if first is not None:
+        stats.recorded_seconds += now - first
+    stats.elapsed = elapsed + time.perf_counter() - start
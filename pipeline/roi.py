@@ -0,0 +1,186 @@
+"""Regions of interest derived from the restricted zones.
+
+Only objects whose feet point lies in a zone can raise an alarm, so the
+inference can be restricted to the zone bounding boxes, extended upwards by
+the height of the tallest expected object whose feet are at the top of the
+zone. nvdspreprocess scales every region to the network input and nvinfer
+maps the detections back to frame coordinates, so nothing downstream sees
+the regions.
+
+Sources without zones get no region and are not inferred on at all. The
+regions are computed once when the pipeline is built: zones added or moved
+by a config reload are only inferred on after a restart.
+"""
+import configparser
+from typing import List, Optional, Sequence, Tuple
+
+from pipeline.config import SourceConfig, active_sources
+
+
+class Roi():
+    """Axis aligned region in muxer frame coordinates"""
+    __slots__ = ("left", "top", "width", "height")
+
+    def __init__(self, left: int, top: int, width: int, height: int) -> None:
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+
+    @property
+    def right(self) -> int:
+        return self.left + self.width
+
+    @property
+    def bottom(self) -> int:
+        return self.top + self.height
+
+    def intersects(self, other: "Roi") -> bool:
+        return (self.left < other.right and other.left < self.right
+                and self.top < other.bottom and other.top < self.bottom)
+
+    def union(self, other: "Roi") -> "Roi":
+        left, top = min(self.left, other.left), min(self.top, other.top)
+        return Roi(left, top, max(self.right, other.right) - left,
+                   max(self.bottom, other.bottom) - top)
+
+    def contains(self, x: float, y: float) -> bool:
+        return self.left <= x <= self.right and self.top <= y <= self.bottom
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Roi) and self.params() == other.params()
+
+    def __hash__(self) -> int:
+        return hash(self.params())
+
+    def params(self) -> Tuple[int, int, int, int]:
+        return (self.left, self.top, self.width, self.height)
+
+    def __repr__(self) -> str:
+        return f"Roi{self.params()}"
+
+
+def _clip(left: float, top: float, right: float, bottom: float,
+          frame_width: int, frame_height: int, align: int) -> Optional[Roi]:
+    # Aligned outwards so the region still covers the requested area
+    left = max(int(left) // align * align, 0)
+    top = max(int(top) // align * align, 0)
+    right = min(-(-int(right + 0.999) // align) * align, frame_width)
+    bottom = min(-(-int(bottom + 0.999) // align) * align, frame_height)
+    if right <= left or bottom <= top:
+        return None
+    return Roi(left, top, right - left, bottom - top)
+
+
+def merge_rois(rois: Sequence[Roi]) -> List[Roi]:
+    """Replace overlapping regions by their union until none overlap
+
+    Args:
+        rois (Sequence[Roi]): Regions, possibly overlapping
+
+    Returns:
+        List[Roi]: Disjoint regions sorted top to bottom, left to right
+    """
+    merged = list(rois)
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        for roi in merged:
+            for i, other in enumerate(result):
+                if roi.intersects(other):
+                    result[i] = other.union(roi)
+                    changed = True
+                    break
+            else:
+                result.append(roi)
+        merged = result
+    return sorted(merged, key=lambda roi: (roi.top, roi.left))
+
+
+def zone_rois(source: SourceConfig, frame_width: int, frame_height: int,
+              padding: int = 16, object_height: int = 200, align: int = 2,
+              max_rois: int = 4) -> List[Roi]:
+    """Regions to run the inference on for the zones of a source
+
+    Args:
+        source (SourceConfig): Compiled source
+        frame_width (int): Muxer output width
+        frame_height (int): Muxer output height
+        padding (int): Margin added around every zone, in pixels
+        object_height (int): Upward extension so an object whose feet are at
+            the top of a zone is fully inside the region
+        align (int): Region coordinates are multiples of it
+        max_rois (int): Above this count the regions are merged into their
+            bounding box, every region costs one inference
+
+    Returns:
+        List[Roi]: Disjoint regions, empty if the source has no zone
+    """
+    rois = []
+    for zone in source.zones:
+        roi = _clip(zone.min_x - padding, zone.min_y - padding - object_height,
+                    zone.max_x + padding, zone.max_y + padding,
+                    frame_width, frame_height, align)
+        if roi is not None:
+            rois.append(roi)
+    rois = merge_rois(rois)
+    if len(rois) > max_rois:
+        bounds = rois[0]
+        for roi in rois[1:]:
+            bounds = bounds.union(roi)
+        rois = [bounds]
+    return rois
+
+
+def write_preprocess_config(template_path: str, rois: Sequence[Tuple[int, List[Roi]]],
+                            output_path: str, gpu_id: int = 0) -> int:
+    """Write an nvdspreprocess config processing only the given regions
+
+    Args:
+        template_path (str): Config with the [property] and [user-configs]
+            sections, the network input shape gets its batch size replaced
+        rois (Sequence[Tuple[int, List[Roi]]]): (source id, regions) pairs,
+            sources without regions are not processed
+        output_path (str): Path of the generated config
+        gpu_id (int): GPU the preprocessing runs on
+
+    Raises:
+        ValueError: If no source has a region
+
+    Returns:
+        int: Number of regions, the batch size of the inference
+    """
+    rois = [(source_id, source_rois) for source_id, source_rois in rois if source_rois]
+    if not rois:
+        raise ValueError("No region of interest, the sources have no zone")
+    num_rois = sum(len(source_rois) for _, source_rois in rois)
+
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str
+    config.read(template_path)
+    properties = config["property"]
+    shape = properties["network-input-shape"].split(";")
+    properties["network-input-shape"] = ";".join([str(num_rois)] + shape[1:])
+    properties["gpu-id"] = str(gpu_id)
+
+    group = {
+        "src-ids": ";".join(str(source_id) for source_id, _ in rois),
+        "custom-input-transformation-function": "CustomAsyncTransformation",
+        "process-on-roi": "1",
+    }
+    for source_id, source_rois in rois:
+        group[f"roi-params-src-{source_id}"] = ";".join(
+            str(value) for roi in source_rois for value in roi.params())
+    config["group-0"] = group
+    with open(output_path, "w") as file:
+        config.write(file, space_around_delimiters=False)
+    return num_rois
+
+
+def source_rois(sources: List[Optional[SourceConfig]], frame_width: int, frame_height: int,
+                padding: int = 16, object_height: int = 200) -> List[Tuple[int, List[Roi]]]:
+    """Regions of every active source, see zone_rois"""
+    return [(source.source_id, zone_rois(source, frame_width, frame_height,
+                                         padding=padding, object_height=object_height))
+            for source in active_sources(sources)]
@@ -0,0 +1,302 @@
+"""Zone-gated secondary classifiers with a per track attribute cache.
+
+The secondary nvinfer elements only classify objects whose
+``unique_component_id`` is their ``infer-on-gie-id``. A probe in front of
+the classifier chain evaluates the zones and hands over to the classifiers,
+by setting that id, only the confident objects inside a zone whose track
+has no cached attributes. Downstream, the analytics probe reads the labels
+of the handed over objects into a cache keyed by (source id, tracking id),
+restores their primary id and attaches the cached attributes to the events.
+A vehicle parked in a zone is so classified once per ``ttl`` instead of on
+every frame, and the classifier batches only hold objects that matter.
+
+Only pyds is needed, no GStreamer, so the gating and the cache can be
+driven with synthetic metadata, see benchmarks/fake_pyds.py.
+"""
+import configparser
+import heapq
+import threading
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+import pyds
+
+from pipeline.zones import ZoneEngine
+
+# gie-unique-id of the primary detector in model_config.txt
+PRIMARY_COMPONENT_ID = 1
+# Component id of the objects handed over to the classifiers, the
+# classifiers themselves get the ids following the primary one
+GATE_COMPONENT_ID = 100
+
+TrackKey = Tuple[int, int]
+
+
+def read_class_ids(config_path: str) -> Optional[FrozenSet[int]]:
+    """Classes a classifier config operates on, None for all
+
+    Args:
+        config_path (str): nvinfer config of the classifier
+
+    Raises:
+        ValueError: If the config has no [property] section
+    """
+    parser = configparser.ConfigParser()
+    if not parser.read(config_path) or not parser.has_section("property"):
+        raise ValueError(f"{config_path}: missing [property] section")
+    value = parser.get("property", "operate-on-class-ids", fallback="").strip()
+    if not value:
+        return None
+    return frozenset(int(class_id) for class_id in value.split(";") if class_id.strip())
+
+
+class SecondaryClassifier():
+    """A secondary nvinfer of the chain
+
+    Args:
+        name (str): Attribute the labels of the classifier are reported under
+        config_path (str): nvinfer config of the classifier
+        unique_id (int): gie-unique-id of the classifier
+        class_ids (Optional[FrozenSet[int]]): Detector classes it operates
+            on, read from the config when not given, None for all
+    """
+    __slots__ = ("name", "config_path", "unique_id", "class_ids")
+
+    def __init__(self, name: str, config_path: str, unique_id: int,
+                 class_ids: Optional[FrozenSet[int]] = None) -> None:
+        if unique_id in (PRIMARY_COMPONENT_ID, GATE_COMPONENT_ID):
+            raise ValueError(f"Classifier {name}: unique id {unique_id} is reserved")
+        self.name = name
+        self.config_path = config_path
+        self.unique_id = unique_id
+        self.class_ids = class_ids if class_ids is not None else read_class_ids(config_path)
+
+    @classmethod
+    def parse_all(cls, specs: Sequence[str]) -> List["SecondaryClassifier"]:
+        """Parse <name>=<config path> specs, the unique ids follow the primary one"""
+        classifiers = []
+        for i, spec in enumerate(specs):
+            name, _, config_path = spec.partition("=")
+            if not name or not config_path:
+                raise ValueError(f"Invalid classifier '{spec}', expected <name>=<config path>")
+            classifiers.append(cls(name, config_path, PRIMARY_COMPONENT_ID + 1 + i))
+        if len({classifier.name for classifier in classifiers}) != len(classifiers):
+            raise ValueError("The classifier names must be unique")
+        return classifiers
+
+    def __repr__(self) -> str:
+        classes = "all" if self.class_ids is None else sorted(self.class_ids)
+        return f"SecondaryClassifier({self.name}, id={self.unique_id}, classes={classes})"
+
+
+class AttributeCache():
+    """Attributes of the tracks, expiring after a time to live.
+
+    Labeled tracks expire after ttl, unlabeled ones after the shorter retry,
+    so the expiry times are kept in a heap rather than in insertion order.
+    Entries replaced by a later put leave a stale heap item behind, skipped
+    when it is popped. The gate and the analytics probe run on different
+    streaming threads when a queue separates them, every access is locked.
+
+    Args:
+        ttl (float): Seconds the attributes of a track are kept
+        retry (float): Seconds before a track the classifiers gave no label
+            to is handed over again
+        max_entries (int): Upper bound of cached tracks, the first to
+            expire are evicted first when it is reached
+    """
+
+    def __init__(self, ttl: float = 30.0, retry: float = 1.0, max_entries: int = 100000) -> None:
+        if ttl <= 0 or retry <= 0:
+            raise ValueError("The attribute time to live and retry must be positive")
+        self.ttl = ttl
+        self.retry = retry
+        self.max_entries = max_entries
+        # Track to (expiry time, attributes)
+        self._entries = {}
+        # (expiry time, track), possibly stale
+        self._expiries = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: TrackKey) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: TrackKey) -> Optional[Dict[str, str]]:
+        """Cached attributes of a track, None if unknown or not labeled"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return entry[1] or None
+
+    def put(self, key: TrackKey, attributes: Dict[str, str], now: float) -> None:
+        """Cache the attributes of a track, merged with the ones not expired yet
+
+        Args:
+            key (TrackKey): (source id, tracking id)
+            attributes (Dict[str, str]): Label by classifier name, empty if none
+            now (float): Current time in seconds
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                attributes = {**entry[1], **attributes}
+            elif len(self._entries) >= self.max_entries:
+                self._pop_first()
+            expires = now + (self.ttl if attributes else self.retry)
+            self._entries[key] = (expires, attributes)
+            heapq.heappush(self._expiries, (expires, key))
+
+    def expire(self, now: float) -> None:
+        """Forget the tracks whose attributes expired"""
+        with self._lock:
+            entries = self._entries
+            expiries = self._expiries
+            while expiries and expiries[0][0] <= now:
+                expires, key = heapq.heappop(expiries)
+                entry = entries.get(key)
+                if entry is not None and entry[0] == expires:
+                    del entries[key]
+
+    def _pop_first(self) -> None:
+        # Removes the entry expiring first, skipping the stale heap items
+        while self._expiries:
+            expires, key = heapq.heappop(self._expiries)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == expires:
+                del self._entries[key]
+                return
+
+
+def _labels(obj_meta) -> Dict[int, str]:
+    """Label of every classifier meta of an object, by classifier id"""
+    labels = {}
+    l_classifier = obj_meta.classifier_meta_list
+    while l_classifier is not None:
+        try:
+            classifier_meta = pyds.NvDsClassifierMeta.cast(l_classifier.data)
+        except StopIteration:
+            break
+        l_label = classifier_meta.label_info_list
+        if l_label is not None:
+            label_info = pyds.NvDsLabelInfo.cast(l_label.data)
+            labels[classifier_meta.unique_component_id] = label_info.result_label
+        try:
+            l_classifier = l_classifier.next
+        except StopIteration:
+            break
+    return labels
+
+
+class SecondaryGate():
+    """Hands the objects inside the zones over to the secondary classifiers.
+
+    Args:
+        classifiers (List[SecondaryClassifier]): Classifier chain
+        cache (AttributeCache): Attributes of the tracks
+        clock (Callable[[], float]): Clock of the cache
+    """
+
+    def __init__(self, classifiers: List[SecondaryClassifier], cache: AttributeCache,
+                 clock: Callable[[], float] = time.time) -> None:
+        if not classifiers:
+            raise ValueError("The secondary gate needs at least one classifier")
+        self.classifiers = classifiers
+        self.cache = cache
+        self._clock = clock
+        self._names = {classifier.unique_id: classifier.name for classifier in classifiers}
+        # Detector classes at least one classifier operates on, None for all
+        class_sets = [classifier.class_ids for classifier in classifiers]
+        self._class_ids = (None if any(class_ids is None for class_ids in class_sets)
+                           else frozenset().union(*class_sets))
+        self.gated = 0
+        self.collected = 0
+
+    def gate(self, batch_meta, zone_engine: ZoneEngine) -> int:
+        """Hand the uncached objects inside a zone over, called in front of the chain
+
+        Args:
+            batch_meta (pyds.NvDsBatchMeta): Metadata of the batch
+            zone_engine (ZoneEngine): Zones of the running config
+
+        Returns:
+            int: Objects handed over
+        """
+        cache = self.cache
+        cache.expire(self._clock())
+        class_filter = self._class_ids
+        objects = []
+        source_ids = []
+        class_ids = []
+        confidences = []
+        feet_xs = []
+        feet_ys = []
+
+        l_frame = batch_meta.frame_meta_list
+        while l_frame is not None:
+            try:
+                frame_meta = pyds.NvDsFrameMeta.cast(l_frame.data)
+            except StopIteration:
+                break
+            source_id = frame_meta.source_id
+            l_obj = frame_meta.obj_meta_list
+            while l_obj is not None:
+                try:
+                    obj_meta = pyds.NvDsObjectMeta.cast(l_obj.data)
+                except StopIteration:
+                    break
+                if ((class_filter is None or obj_meta.class_id in class_filter)
+                        and (source_id, obj_meta.object_id) not in cache):
+                    rect_params = obj_meta.rect_params
+                    objects.append(obj_meta)
+                    source_ids.append(source_id)
+                    class_ids.append(obj_meta.class_id)
+                    confidences.append(obj_meta.confidence)
+                    feet_xs.append(rect_params.left + rect_params.width / 2)
+                    feet_ys.append(rect_params.top + rect_params.height)
+                try:
+                    l_obj = l_obj.next
+                except StopIteration:
+                    break
+            try:
+                l_frame = l_frame.next
+            except StopIteration:
+                break
+
+        if not objects:
+            return 0
+        hits = zone_engine.evaluate(source_ids, class_ids, confidences, feet_xs, feet_ys)
+        inside = (hits.confident & (hits.zone >= 0)).nonzero()[0].tolist()
+        now = self._clock()
+        for i in inside:
+            objects[i].unique_component_id = GATE_COMPONENT_ID
+            # Pending until collected, the next frames are already in flight
+            cache.put((source_ids[i], objects[i].object_id), {}, now)
+        self.gated += len(inside)
+        return len(inside)
+
+    def collect(self, obj_meta, source_id: int) -> None:
+        """Cache the labels of a handed over object and give it back to the
+        primary detector, called by the analytics probe after the chain
+
+        Args:
+            obj_meta (pyds.NvDsObjectMeta): Object with unique_component_id
+                GATE_COMPONENT_ID
+            source_id (int): Source of its frame
+        """
+        labels = _labels(obj_meta)
+        attributes = {self._names[unique_id]: label for unique_id, label in labels.items()
+                      if unique_id in self._names}
+        self.cache.put((source_id, obj_meta.object_id), attributes, self._clock())
+        obj_meta.unique_component_id = PRIMARY_COMPONENT_ID
+        self.collected += 1
+
+    def attributes(self, source_id: int, tracking_id: int) -> Optional[Dict[str, str]]:
+        return self.cache.get((source_id, tracking_id))
+
+    def __str__(self) -> str:
+        return f"gated={self.gated} collected={self.collected} cached={len(self.cache)}"
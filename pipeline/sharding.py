@@ -0,0 +1,96 @@
+"""Partitioning of the sources of app_config.json into worker shards.
+
+Shards keep the original source ids, the pipeline accepts ids with holes,
+so events and metrics of every worker still refer to the global ids. The
+muxer pads and the tiles of a worker are indexed by source id, a worker
+sizes them by its highest source id while its inference batch only holds
+the frames of its own sources, see Shard.batch_size.
+"""
+from typing import Dict, List, Optional, Sequence
+
+from pipeline.config import validate_config
+
+STRATEGIES = ("count", "load", "gpu")
+
+
+class Shard():
+    """Sources handled by one pipeline worker process"""
+    __slots__ = ("index", "gpu_id", "config")
+
+    def __init__(self, index: int, gpu_id: int, config: Dict) -> None:
+        self.index = index
+        self.gpu_id = gpu_id
+        # Raw app config holding only the sources of the shard
+        self.config = config
+
+    @property
+    def batch_size(self) -> int:
+        return len(self.config)
+
+    @property
+    def load(self) -> float:
+        return sum(source_load(source) for source in self.config.values())
+
+    def __repr__(self) -> str:
+        return f"Shard({self.index}, gpu={self.gpu_id}, sources={sorted(self.config, key=int)})"
+
+
+def source_load(source: Dict) -> float:
+    """Expected load of a source, 1 unless the config gives expected_load"""
+    return float(source.get("expected_load", 1.0))
+
+
+def partition_sources(config: Dict, num_shards: int, strategy: str = "count",
+                      gpu_ids: Optional[Sequence[int]] = None) -> List[Shard]:
+    """Split the sources of an app config into shards
+
+    count deals the sources round robin, load packs them greedily on the
+    least loaded shard by expected_load, gpu makes one shard per gpu_id
+    given in the sources. Shards are assigned to gpu_ids round robin.
+
+    Args:
+        config (Dict): Content of app_config.json
+        num_shards (int): Number of shards, ignored by the gpu strategy
+        strategy (str): One of count, load or gpu
+        gpu_ids (Optional[Sequence[int]]): GPUs available, defaults to [0]
+
+    Raises:
+        ValueError: If the strategy or the number of shards is invalid
+
+    Returns:
+        List[Shard]: Non empty shards
+    """
+    validate_config(config)
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown sharding strategy '{strategy}'")
+    gpu_ids = list(gpu_ids) if gpu_ids else [0]
+    keys = sorted(config, key=int)
+
+    if strategy == "gpu":
+        groups = {}
+        for key in keys:
+            groups.setdefault(int(config[key].get("gpu_id", gpu_ids[0])), []).append(key)
+        return [
+            Shard(index, gpu_id, {key: config[key] for key in group})
+            for index, (gpu_id, group) in enumerate(sorted(groups.items()))
+        ]
+
+    if num_shards < 1:
+        raise ValueError("The number of shards must be positive")
+    num_shards = min(num_shards, len(keys))
+    groups = [[] for _ in range(num_shards)]
+    if strategy == "count":
+        for i, key in enumerate(keys):
+            groups[i % num_shards].append(key)
+    else:
+        loads = [0.0] * num_shards
+        for key in sorted(keys, key=lambda k: source_load(config[k]), reverse=True):
+            target = loads.index(min(loads))
+            groups[target].append(key)
+            loads[target] += source_load(config[key])
+
+    return [
+        Shard(index, gpu_ids[index % len(gpu_ids)],
+              {key: config[key] for key in sorted(group, key=int)})
+        for index, group in enumerate(groups)
+    ]
@@ -0,0 +1,266 @@
+"""JPEG snapshots of the objects raising alarms.
+
+The probe only copies the object region out of the mapped frame, for the
+alarms passing a per-track rate limit, and hands it to a bounded thread
+pool. The workers resize and encode the crop, OpenCV releases the GIL while
+doing so, store it under its content hash and publish the event with the
+snapshot reference. Events whose snapshot can't be taken are published
+without one, never dropped. The later events of a track whose snapshot is
+still being taken are held back and published after it, so an EXIT never
+overtakes its ENTRY.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from pipeline.events import Event, EventType
+
+# Events a snapshot is taken for, the object may be gone on exits
+SNAPSHOT_EVENTS = (EventType.ENTRY, EventType.DWELL)
+
+
+class SnapshotRateLimiter():
+    """At most one snapshot per track every min_interval seconds
+
+    Args:
+        min_interval (float): Seconds between two snapshots of a track
+    """
+
+    def __init__(self, min_interval: float = 10.0) -> None:
+        self.min_interval = min_interval
+        self._last = {}
+
+    def __len__(self) -> int:
+        return len(self._last)
+
+    def allow(self, source_id: int, tracking_id: int, now: float) -> bool:
+        key = (source_id, tracking_id)
+        last = self._last.get(key)
+        if last is not None and now - last < self.min_interval:
+            return False
+        self._last[key] = now
+        if len(self._last) > 4096:
+            self._last = {key: last for key, last in self._last.items()
+                          if now - last < self.min_interval}
+        return True
+
+
+def crop(frame: np.ndarray, bbox: Tuple[float, float, float, float],
+         margin: float = 0.1) -> Optional[np.ndarray]:
+    """Copy of the region of a box, extended by a fraction of its size
+
+    Args:
+        frame (np.ndarray): Height x width x channels frame
+        bbox (Tuple[float, float, float, float]): (left, top, width, height)
+        margin (float): Fraction of the box size added on every side
+
+    Returns:
+        Optional[np.ndarray]: Owned copy of the region, None if it is empty
+    """
+    left, top, width, height = bbox
+    frame_height, frame_width = frame.shape[:2]
+    x0 = max(int(left - margin * width), 0)
+    y0 = max(int(top - margin * height), 0)
+    x1 = min(int(left + width + margin * width + 0.5), frame_width)
+    y1 = min(int(top + height + margin * height + 0.5), frame_height)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    # The mapped surface is only valid during the probe
+    return np.array(frame[y0:y1, x0:x1], copy=True)
+
+
+def encode_snapshot(image: np.ndarray, max_size: int = 256, quality: int = 85) -> bytes:
+    """Downscale an RGB(A) image so its longest side is at most max_size and encode it as JPEG
+
+    Raises:
+        RuntimeError: If OpenCV can't encode the image
+    """
+    height, width = image.shape[:2]
+    scale = max_size / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (max(int(width * scale), 1), max(int(height * scale), 1)),
+                           interpolation=cv2.INTER_AREA)
+    if image.ndim == 3 and image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_RGBA2BGR)
+    elif image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    ok, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("Unable to encode the snapshot")
+    return data.tobytes()
+
+
+class SnapshotStore():
+    """Content addressed directory of snapshots, <root>/<2 hex>/<sha256>.jpg
+
+    Args:
+        root (str): Directory of the store, created if missing
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, ref: str) -> str:
+        return os.path.join(self.root, ref[:2], f"{ref}.jpg")
+
+    def put(self, data: bytes) -> str:
+        """Store an encoded snapshot
+
+        Returns:
+            str: Its reference, the SHA-256 of the data, identical snapshots
+                are stored once
+        """
+        ref = hashlib.sha256(data).hexdigest()
+        path = self.path(ref)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = f"{path}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as file:
+                file.write(data)
+            os.replace(temporary, path)
+        return ref
+
+    def read(self, ref: str) -> bytes:
+        with open(self.path(ref), "rb") as file:
+            return file.read()
+
+
+class SnapshotStats():
+    """Counters of the snapshot pool"""
+    __slots__ = ("submitted", "rate_limited", "dropped", "stored", "failed", "bytes", "deferred")
+
+    def __init__(self) -> None:
+        self.submitted = 0
+        self.rate_limited = 0
+        self.dropped = 0
+        self.stored = 0
+        self.failed = 0
+        self.bytes = 0
+        # Events held back behind the snapshot of their track
+        self.deferred = 0
+
+    def __str__(self) -> str:
+        return " ".join(f"{name}={getattr(self, name)}" for name in self.__slots__)
+
+
+class SnapshotPool():
+    """Bounded pool taking the snapshots of alarms and publishing the events.
+
+    Every event of the tracks with a snapshot pending goes through the pool,
+    it is published after the event of the snapshot, in submission order.
+
+    Args:
+        store (SnapshotStore): Where the snapshots are written
+        publish (Callable[[Event], object]): Called with every event taken,
+            once its snapshot is attached or could not be taken, and with
+            the events held back behind it, usually EventPublisher.submit
+        workers (int): Encoding threads
+        max_pending (int): Crops queued or being encoded, above it the
+            events are published without snapshot
+        min_interval (float): Seconds between two snapshots of a track
+        max_size (int): Longest side of the snapshots in pixels
+        quality (int): JPEG quality
+        margin (float): Fraction of the box size added around the object
+        clock (Callable[[], float]): Clock of the rate limit
+    """
+
+    def __init__(self, store: SnapshotStore, publish: Callable[[Event], object],
+                 workers: int = 2, max_pending: int = 32, min_interval: float = 10.0,
+                 max_size: int = 256, quality: int = 85, margin: float = 0.1,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        if workers < 1 or max_pending < 1:
+            raise ValueError("The snapshot pool needs at least one worker and one pending slot")
+        self.stats = SnapshotStats()
+        self.store = store
+        self._publish = publish
+        self._max_pending = max_pending
+        self._limiter = SnapshotRateLimiter(min_interval)
+        self._max_size = max_size
+        self._quality = quality
+        self._margin = margin
+        self._clock = clock
+        self._pending = 0
+        # Events held back by track, the track has a snapshot pending while listed
+        self._tracks: Dict[Tuple[int, int], List[Event]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snapshot")
+
+    def __len__(self) -> int:
+        return self._pending
+
+    def submit(self, event: Event, frame_image: Optional[Callable[[], np.ndarray]]) -> bool:
+        """Take the snapshot of an event, called from the streaming thread
+        with every event
+
+        Args:
+            event (Event): Event of an object
+            frame_image (Optional[Callable[[], np.ndarray]]): Maps the frame
+                of the event, only called if a snapshot is taken, None if
+                the frame is not in the batch
+
+        Returns:
+            bool: True if the pool publishes the event, False if the caller
+                has to, no snapshot is taken and none is pending for its track
+        """
+        key = (event.source_id, event.tracking_id)
+        with self._lock:
+            deferred = self._tracks.get(key)
+            if deferred is not None:
+                deferred.append(event)
+                self.stats.deferred += 1
+                return True
+        if event.type not in SNAPSHOT_EVENTS or frame_image is None:
+            return False
+        if self._pending >= self._max_pending:
+            self.stats.dropped += 1
+            return False
+        if not self._limiter.allow(event.source_id, event.tracking_id, self._clock()):
+            self.stats.rate_limited += 1
+            return False
+
+        try:
+            image = crop(frame_image(), (event.left, event.top, event.width, event.height),
+                         self._margin)
+        except Exception:
+            logging.exception("Unable to map the frame of a snapshot")
+            image = None
+        if image is None:
+            self.stats.failed += 1
+            return False
+
+        with self._lock:
+            self._pending += 1
+            self._tracks[key] = []
+        self.stats.submitted += 1
+        self._executor.submit(self._encode, event, image)
+        return True
+
+    def _encode(self, event: Event, image: np.ndarray) -> None:
+        try:
+            data = encode_snapshot(image, self._max_size, self._quality)
+            event.snapshot = self.store.put(data)
+            self.stats.stored += 1
+            self.stats.bytes += len(data)
+        except Exception:
+            logging.exception("Unable to take a snapshot")
+            self.stats.failed += 1
+        # Published under the lock, the next event of the track would
+        # otherwise be published directly ahead of the held back ones
+        with self._lock:
+            self._pending -= 1
+            self._publish(event)
+            for deferred in self._tracks.pop((event.source_id, event.tracking_id)):
+                self._publish(deferred)
+
+    def close(self) -> None:
+        """Wait for the pending snapshots, their events are published"""
+        self._executor.shutdown(wait=True)
+        logging.info(f"Snapshots: {self.stats}")
@@ -0,0 +1,235 @@
+"""Lifecycle of the pipeline worker processes.
+
+The supervisor starts one worker per shard, restarts crashed workers with
+exponential backoff, unless they failed too many times in a row, and merges the Prometheus metrics of all workers. The
+clock and the process launcher are injectable so the lifecycle can be
+driven with a stand-in worker and a fake clock.
+"""
+import json
+import logging
+import os
+import re
+import subprocess
+import time
+import urllib.request
+from typing import Callable, Dict, List, Optional
+
+from pipeline.backoff import Backoff
+from pipeline.metrics import MetricsRegistry
+from pipeline.sharding import Shard
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{([^}]*)\})?(\s.*)$")
+
+# Builds the command line of the worker of a shard
+CommandBuilder = Callable[[Shard, str, int], List[str]]
+
+
+def add_label(text: str, name: str, value: str) -> str:
+    """Add a label to every sample of a Prometheus text exposition"""
+    lines = []
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if line.startswith("#") or match is None:
+            lines.append(line)
+            continue
+        metric, _, labels, rest = match.groups()
+        labels = f'{name}="{value}"' + (f",{labels}" if labels else "")
+        lines.append(f"{metric}{{{labels}}}{rest}")
+    return "\n".join(lines) + "\n"
+
+
+def merge_expositions(texts: List[str]) -> str:
+    """Merge Prometheus text expositions, keeping every family in one group
+    with a single HELP and TYPE line as the format requires"""
+    families = {}
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if line.startswith("#"):
+                parts = line.split(maxsplit=3)
+                if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                    family = families.setdefault(parts[2], ({}, []))
+                    family[0].setdefault(parts[1], line)
+                continue
+            if family is None:
+                match = _SAMPLE.match(line)
+                family = families.setdefault(match.group(1) if match else line, ({}, []))
+            family[1].append(line)
+    lines = []
+    for comments, samples in families.values():
+        lines.extend(comments.values())
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+class Worker():
+    """State of the worker process of one shard"""
+
+    def __init__(self, shard: Shard, command: List[str], metrics_port: int,
+                 backoff: Backoff) -> None:
+        self.shard = shard
+        self.command = command
+        self.metrics_port = metrics_port
+        self.backoff = backoff
+        self.process = None
+        self.started_at = 0.0
+        self.restart_at = 0.0
+        self.restarts = 0
+        self.last_exit_code = None
+        # Given up after too many failures in a row
+        self.failed = False
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+
+class Supervisor():
+    """Starts, watches and restarts one worker process per shard.
+
+    Args:
+        shards (List[Shard]): Shards to run
+        command_builder (CommandBuilder): Command line of a shard worker,
+            given the shard, its config path and its metrics port
+        work_dir (str): Directory the shard configs are written to
+        metrics_base_port (int): Metrics port of the first worker, 0 disables
+            metrics collection from the workers
+        spawn (Callable): Starts a process from a command, subprocess.Popen
+        clock (Callable[[], float]): Monotonic clock
+        backoff_factory (Callable[[], Backoff]): Backoff policy per worker
+        max_failures (int): Failures in a row after which a worker is no
+            longer restarted, 0 restarts it forever
+    """
+
+    def __init__(self, shards: List[Shard], command_builder: CommandBuilder,
+                 work_dir: str, metrics_base_port: int = 0,
+                 spawn: Callable = subprocess.Popen,
+                 clock: Callable[[], float] = time.monotonic,
+                 backoff_factory: Callable[[], Backoff] = Backoff,
+                 max_failures: int = 0) -> None:
+        if max_failures < 0:
+            raise ValueError("The worker failure limit can not be negative")
+        self._spawn = spawn
+        self._max_failures = max_failures
+        self._clock = clock
+        self._stopping = False
+        self.registry = MetricsRegistry()
+        self._up = self.registry.gauge("supervisor_worker_up", "Worker process running", ("shard",))
+        self._restarts = self.registry.counter(
+            "supervisor_worker_restarts_total", "Worker restarts", ("shard",))
+        self._sources = self.registry.gauge(
+            "supervisor_worker_sources", "Sources handled by a worker", ("shard",))
+
+        os.makedirs(work_dir, exist_ok=True)
+        self.workers = []
+        for shard in shards:
+            config_path = os.path.join(work_dir, f"shard_{shard.index}.json")
+            with open(config_path, "w") as file:
+                json.dump(shard.config, file, indent=4)
+            port = metrics_base_port + shard.index if metrics_base_port else 0
+            self.workers.append(Worker(shard, command_builder(shard, config_path, port),
+                                       port, backoff_factory()))
+            self._sources.set(shard.batch_size, (shard.index,))
+
+    def start(self) -> None:
+        for worker in self.workers:
+            self._start_worker(worker)
+
+    def _start_worker(self, worker: Worker) -> None:
+        logging.info(f"Starting worker {worker.shard}")
+        worker.process = self._spawn(worker.command)
+        worker.started_at = self._clock()
+        self._up.set(1, (worker.shard.index,))
+
+    def poll(self) -> None:
+        """Detect exited workers and restart them once their backoff expired"""
+        now = self._clock()
+        for worker in self.workers:
+            index = worker.shard.index
+            if worker.process is not None:
+                code = worker.process.poll()
+                if code is None:
+                    continue
+                worker.last_exit_code = code
+                worker.process = None
+                self._up.set(0, (index,))
+                if self._stopping:
+                    continue
+                delay = worker.backoff.next_delay(now - worker.started_at)
+                worker.restart_at = now + delay
+                # The backoff counts the failures since the worker last ran long enough
+                if self._max_failures and worker.backoff.failures >= self._max_failures:
+                    worker.failed = True
+                    logging.error(f"Worker {index} exited with code {code}, giving up after "
+                                  f"{worker.backoff.failures} failures in a row")
+                    continue
+                logging.warning(f"Worker {index} exited with code {code}, "
+                                f"restarting in {delay:.1f}s")
+            elif not self._stopping and not worker.failed and now >= worker.restart_at:
+                worker.restarts += 1
+                self._restarts.inc(1, (index,))
+                self._start_worker(worker)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Terminate all the workers, killing the ones that do not exit in time"""
+        self._stopping = True
+        for worker in self.workers:
+            if worker.running:
+                worker.process.terminate()
+        deadline = self._clock() + timeout
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            try:
+                worker.process.wait(max(deadline - self._clock(), 0))
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+            self._up.set(0, (worker.shard.index,))
+
+    @property
+    def failed(self) -> bool:
+        """Every worker was given up"""
+        return all(worker.failed for worker in self.workers)
+
+    def health(self) -> Dict:
+        return {
+            str(worker.shard.index): {
+                "running": worker.running,
+                "failed": worker.failed,
+                "gpu_id": worker.shard.gpu_id,
+                "sources": sorted(worker.shard.config, key=int),
+                "restarts": worker.restarts,
+                "last_exit_code": worker.last_exit_code,
+            }
+            for worker in self.workers
+        }
+
+    def render(self, timeout: float = 1.0) -> str:
+        """Supervisor metrics followed by the metrics of every running worker,
+        labelled with their shard. Same interface as MetricsRegistry.render
+        so a MetricsServer can serve the supervisor directly"""
+        texts = [self.registry.render()]
+        for worker in self.workers:
+            if not worker.metrics_port or not worker.running:
+                continue
+            url = f"http://127.0.0.1:{worker.metrics_port}/metrics"
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    text = response.read().decode()
+            except OSError as e:
+                logging.debug(f"Unable to scrape worker {worker.shard.index}: {e}")
+                continue
+            texts.append(add_label(text, "shard", str(worker.shard.index)))
+        return merge_expositions(texts)
+
+    def run(self, poll_interval: float = 0.5,
+            should_stop: Optional[Callable[[], bool]] = None) -> None:
+        self.start()
+        try:
+            while not (should_stop and should_stop()) and not self.failed:
+                self.poll()
+                time.sleep(poll_interval)
+        finally:
+            self.stop()
@@ -0,0 +1,146 @@
+"""Declarative pipeline topologies.
+
+A profile in ``configs/topology.json`` lists the elements of the graph, the
+links between them and the element pad the analytics probe attaches to.
+Elements and links can be restricted to build flags with a ``when`` list,
+``"!flag"`` negates a flag. Queues heading a branch after a tee name it with
+``branch`` so a backpressure policy can be applied per branch. The builder
+only talks to an element factory and a container, so graphs can be checked
+with fakes, without GStreamer.
+"""
+import abc
+import json
+from typing import Any, Collection, Dict, Optional, Sequence
+
+# Elements every profile must define, the pipeline configures them by name
+REQUIRED_ELEMENTS = ("stream-muxer", "primary-inference")
+
+
+class ElementFactory(abc.ABC):
+    """Creates and links elements, see utils.GstElementFactory"""
+
+    @abc.abstractmethod
+    def make(self, factory_name: str, name: str) -> Any:
+        """Create an element, None if the factory is missing"""
+
+    @abc.abstractmethod
+    def caps(self, caps: str) -> Any:
+        """Parse a caps string for a caps property"""
+
+    @abc.abstractmethod
+    def link(self, src: Any, dst: Any, request_pad: bool) -> bool:
+        """Link two elements, through a requested source pad for a tee"""
+
+
+class PipelineGraph():
+    """Elements created for a profile and where the analytics probe goes"""
+    __slots__ = ("elements", "probe_element", "probe_pad", "render", "branches")
+
+    def __init__(self, elements: Dict[str, Any], probe_element: str,
+                 probe_pad: str, render: bool,
+                 branches: Optional[Dict[str, str]] = None) -> None:
+        self.elements = elements
+        self.probe_element = probe_element
+        self.probe_pad = probe_pad
+        self.render = render
+        # Element name to the name of the branch it heads
+        self.branches = branches or {}
+
+
+def _enabled(when: Sequence[str], flags: Collection[str]) -> bool:
+    return all(
+        flag[1:] not in flags if flag.startswith("!") else flag in flags
+        for flag in when
+    )
+
+
+def validate_profile(name: str, profile: Dict) -> None:
+    """Check the structure of a profile
+
+    Args:
+        name (str): Profile name, used in error messages
+        profile (Dict): Profile description
+
+    Raises:
+        ValueError: If the profile is malformed
+    """
+    names = [element["name"] for element in profile.get("elements", ())]
+    if len(names) != len(set(names)):
+        raise ValueError(f"Profile '{name}': element names must be unique")
+    for required in REQUIRED_ELEMENTS:
+        if required not in names:
+            raise ValueError(f"Profile '{name}': missing element '{required}'")
+    for link in profile.get("links", ()):
+        if len(link) not in (2, 3) or link[0] not in names or link[1] not in names:
+            raise ValueError(f"Profile '{name}': invalid link {link}")
+    probe = profile.get("probe", {})
+    if probe.get("element") not in names:
+        raise ValueError(f"Profile '{name}': the probe must reference an element")
+
+
+def load_profiles(path: str) -> Dict[str, Dict]:
+    """Load and validate the profiles of a topology file
+
+    Args:
+        path (str): Path to topology.json
+
+    Returns:
+        Dict[str, Dict]: Profiles by name
+    """
+    with open(path, "r") as file:
+        profiles = json.load(file)["profiles"]
+    for name, profile in profiles.items():
+        validate_profile(name, profile)
+    return profiles
+
+
+def build_graph(profile: Dict, factory: ElementFactory, container: Any,
+                flags: Collection[str]) -> PipelineGraph:
+    """Create, configure, add and link the elements of a profile
+
+    Args:
+        profile (Dict): Profile description
+        factory (ElementFactory): Creates and links the elements
+        container (Any): Object with an add method, usually the Gst.Pipeline
+        flags (Collection[str]): Build flags the when lists are checked against
+
+    Raises:
+        RuntimeError: If an element can't be created or linked
+
+    Returns:
+        PipelineGraph: The elements by name and the probe location
+    """
+    elements = {}
+    factories = {}
+    branches = {}
+    for spec in profile["elements"]:
+        if not _enabled(spec.get("when", ()), flags):
+            continue
+        name = spec["name"]
+        element = factory.make(spec["factory"], name)
+        if not element:
+            raise RuntimeError(f"Unable to create {name} ({spec['factory']})")
+        for key, value in spec.get("properties", {}).items():
+            if key == "caps":
+                value = factory.caps(value)
+            element.set_property(key, value)
+        container.add(element)
+        elements[name] = element
+        factories[name] = spec["factory"]
+        if "branch" in spec:
+            branches[name] = spec["branch"]
+
+    for link in profile["links"]:
+        src, dst = link[0], link[1]
+        if len(link) == 3 and not _enabled(link[2], flags):
+            continue
+        if src not in elements or dst not in elements:
+            raise RuntimeError(f"Link {src} -> {dst} references a disabled element")
+        if not factory.link(elements[src], elements[dst], factories[src] == "tee"):
+            raise RuntimeError(f"Unable to link {src} to {dst}")
+
+    probe = profile["probe"]
+    if probe["element"] not in elements:
+        raise RuntimeError(f"Probe element {probe['element']} is disabled")
+    return PipelineGraph(elements, probe["element"], probe.get("pad", "sink"),
+                         profile.get("render", True), branches)
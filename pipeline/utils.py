@@ -1,13 +1,19 @@
-from typing import Any
+from typing import Any, Tuple
 
 import gi
 gi.require_version("Gst", "1.0")
 import ctypes
+import math
 import platform
 
 from gi.repository import Gst
 import logging
 
+from pipeline.topology import ElementFactory
+
+# NvBufSurfaceMemType of the nvbuf-memory-type properties, mappable on the CPU
+NVBUF_MEM_CUDA_UNIFIED = 3
+
 def is_aarch64() -> bool:
     """
     Check if the current platform is aarch64
@@ -15,6 +21,39 @@ def is_aarch64() -> bool:
     """
     return platform.uname()[4] == "aarch64"
 
+def tiler_layout(num_sources: int) -> Tuple[int, int]:
+    """Rows and columns of the tiler grid for a number of sources
+
+    Args:
+        num_sources (int): Number of sources
+
+    Returns:
+        Tuple[int, int]: Rows and columns
+    """
+    rows = max(int(math.sqrt(num_sources)), 1)
+    columns = max(int(math.ceil(1.0 * num_sources / rows)), 1)
+    return rows, columns
+
+class GstElementFactory(ElementFactory):
+    """Element factory backed by GStreamer, used to build the topologies"""
+
+    def make(self, factory_name: str, name: str) -> Gst.Element:
+        logging.info(f"Creating {name}")
+        return Gst.ElementFactory.make(factory_name, name)
+
+    def caps(self, caps: str) -> Gst.Caps:
+        return Gst.Caps.from_string(caps)
+
+    def link(self, src: Gst.Element, dst: Gst.Element, request_pad: bool) -> bool:
+        if not request_pad:
+            return src.link(dst)
+        # Elements like tee only expose request source pads
+        src_pad = src.get_request_pad("src_%u")
+        sink_pad = dst.get_static_pad("sink")
+        if not src_pad or not sink_pad:
+            return False
+        return src_pad.link(sink_pad) == Gst.PadLinkReturn.OK
+
 def bus_call(bus, message: Any, loop: Any) -> bool:
     """Callback function to handle the event messages
     from the pipeline bus.
@@ -0,0 +1,167 @@
+"""Reconnection of live sources that stopped sending frames.
+
+The streaming threads only record the time of the last buffer of every
+source, the watchdog state machine runs from the main loop. A stale source
+is torn down, which releases its muxer pad so the batches stop waiting for
+it, and recreated after an exponential backoff, unless it failed too many
+times in a row. The clock and the teardown/restart callbacks are injected
+so the state machine runs without GStreamer.
+"""
+import logging
+import time
+from enum import Enum
+from typing import Callable, Dict, Optional
+
+from pipeline.backoff import Backoff
+from pipeline.metrics import MetricsRegistry
+
+
+class SourceState(Enum):
+    STARTING = "starting"
+    UP = "up"
+    DOWN = "down"
+    RECONNECTING = "reconnecting"
+    FAILED = "failed"
+
+
+class _Source():
+    __slots__ = ("state", "last_buffer", "since", "next_retry", "backoff",
+                 "reconnects", "failures")
+
+    def __init__(self, now: float, backoff: Backoff) -> None:
+        self.state = SourceState.STARTING
+        self.last_buffer = None
+        # Start of the current state
+        self.since = now
+        self.next_retry = 0.0
+        self.backoff = backoff
+        self.reconnects = 0
+        self.failures = 0
+
+
+class SourceWatchdog():
+    """Per-source liveness state machine.
+
+    STARTING and RECONNECTING sources become UP on their first buffer, or
+    DOWN if none arrives within the startup timeout. UP sources become DOWN
+    when no buffer arrived for stale_timeout or an error is reported. DOWN
+    sources are restarted once their backoff delay expired. A source that
+    went down max_failures times without staying up in between is FAILED and
+    no longer restarted.
+
+    Args:
+        teardown (Callable[[int], None]): Removes the source bin of a source
+        restart (Callable[[int], None]): Creates the source bin of a source again
+        stale_timeout (float): Seconds without buffer before an UP source is down
+        startup_timeout (float): Seconds a (re)started source has to send a buffer
+        initial_backoff (float): First delay before a restart, doubled on
+            every failed attempt
+        max_backoff (float): Upper bound of the delay
+        max_failures (int): Consecutive failures before a source is given up,
+            0 restarts it forever
+        clock (Callable[[], float]): Monotonic clock
+        registry (Optional[MetricsRegistry]): Registry of the per-source metrics
+    """
+
+    def __init__(self, teardown: Callable[[int], None], restart: Callable[[int], None],
+                 stale_timeout: float = 5.0, startup_timeout: float = 20.0,
+                 initial_backoff: float = 1.0, max_backoff: float = 60.0,
+                 max_failures: int = 0,
+                 clock: Callable[[], float] = time.monotonic,
+                 registry: Optional[MetricsRegistry] = None) -> None:
+        if stale_timeout <= 0 or startup_timeout <= 0:
+            raise ValueError("The watchdog timeouts must be positive")
+        if max_failures < 0:
+            raise ValueError("The watchdog failure limit can not be negative")
+        self._teardown = teardown
+        self._restart = restart
+        self.stale_timeout = stale_timeout
+        self.startup_timeout = startup_timeout
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+        self._max_failures = max_failures
+        self._clock = clock
+        self._sources = {}
+
+        registry = registry or MetricsRegistry()
+        self._up = registry.gauge("pipeline_source_up", "Source sending frames", ("source",))
+        self._downs = registry.counter(
+            "pipeline_source_down_total", "Times a source went down", ("source",))
+        self._reconnects = registry.counter(
+            "pipeline_source_reconnects_total", "Source bin restarts", ("source",))
+
+    def add(self, source_id: int) -> None:
+        """Start watching a source whose bin was just created"""
+        # A source is up for good after one stale timeout without failure
+        backoff = Backoff(self._initial_backoff, self._max_backoff,
+                          reset_after=self.stale_timeout)
+        self._sources[source_id] = _Source(self._clock(), backoff)
+        self._up.set(0, (source_id,))
+
+    def remove(self, source_id: int) -> None:
+        self._sources.pop(source_id, None)
+
+    def buffer(self, source_id: int) -> None:
+        """Record a buffer of a source, called from the streaming threads"""
+        source = self._sources.get(source_id)
+        if source is not None:
+            source.last_buffer = self._clock()
+
+    def error(self, source_id: int) -> None:
+        """Take a source down right away, for errors posted by its bin"""
+        source = self._sources.get(source_id)
+        if source is not None and source.state not in (SourceState.DOWN, SourceState.FAILED):
+            self._down(source_id, source, self._clock(), "error")
+
+    def state(self, source_id: int) -> Optional[SourceState]:
+        source = self._sources.get(source_id)
+        return source.state if source is not None else None
+
+    def stats(self) -> Dict[int, Dict]:
+        return {
+            source_id: {"state": source.state.value, "reconnects": source.reconnects,
+                        "failures": source.failures}
+            for source_id, source in self._sources.items()
+        }
+
+    def check(self) -> None:
+        """Advance the state machine, called periodically from the main loop"""
+        now = self._clock()
+        for source_id, source in list(self._sources.items()):
+            state = source.state
+            if state in (SourceState.STARTING, SourceState.RECONNECTING):
+                if source.last_buffer is not None and source.last_buffer >= source.since:
+                    logging.info(f"Source {source_id} is up")
+                    source.state = SourceState.UP
+                    source.since = now
+                    self._up.set(1, (source_id,))
+                elif now - source.since > self.startup_timeout:
+                    self._down(source_id, source, now, "no frame after start")
+            elif state is SourceState.UP:
+                if now - source.last_buffer > self.stale_timeout:
+                    self._down(source_id, source, now, "stale")
+            elif state is SourceState.DOWN and now >= source.next_retry:
+                logging.info(f"Restarting source {source_id}")
+                source.state = SourceState.RECONNECTING
+                source.since = now
+                source.reconnects += 1
+                self._reconnects.inc(1, (source_id,))
+                self._restart(source_id)
+
+    def _down(self, source_id: int, source: _Source, now: float, reason: str) -> None:
+        uptime = now - source.since if source.state is SourceState.UP else 0.0
+        delay = source.backoff.next_delay(uptime)
+        source.since = now
+        source.next_retry = now + delay
+        source.failures += 1
+        # The backoff counts the failures since the source last stayed up
+        if self._max_failures and source.backoff.failures >= self._max_failures:
+            logging.error(f"Source {source_id} is down ({reason}), giving up after "
+                          f"{source.backoff.failures} failures in a row")
+            source.state = SourceState.FAILED
+        else:
+            logging.warning(f"Source {source_id} is down ({reason}), restarting in {delay:.1f}s")
+            source.state = SourceState.DOWN
+        self._up.set(0, (source_id,))
+        self._downs.inc(1, (source_id,))
+        self._teardown(source_id)
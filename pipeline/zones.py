@@ -0,0 +1,199 @@
+"""Batch-wide restricted zone evaluation.
+
+The engine is independent of ``pyds``: the probe collects the detections of
+a whole ``NvDsBatchMeta`` into flat arrays and evaluates them in one
+vectorized pass. Every source gets a uniform grid over the muxer frame, each
+cell lists the zones whose bounding box overlaps it, so a point is only
+tested against the zones of its own cell. Containment uses the even-odd
+crossing rule on the exact zone polygon, concave zones included, and points
+on the boundary are outside as with shapely's contains.
+"""
+import math
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from pipeline.config import NUM_CLASSES, SourceConfig, active_sources
+
+
+class ZoneHits():
+    """Result of evaluating one batch of detections."""
+    __slots__ = ("confident", "zone", "hit_objects", "hit_zones")
+
+    def __init__(self, confident: np.ndarray, zone: np.ndarray,
+                 hit_objects: np.ndarray, hit_zones: np.ndarray) -> None:
+        # Per object: passes the class threshold of its source
+        self.confident = confident
+        # Per object: index of the first zone containing it, -1 if none
+        self.zone = zone
+        # Every (object, zone) containment pair, ordered by object then zone
+        self.hit_objects = hit_objects
+        self.hit_zones = hit_zones
+
+
+def _expand(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Expand CSR ranges [start, start + count) into one flat index array"""
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return offsets + np.arange(total, dtype=np.int64)
+
+
+class ZoneEngine():
+    """Vectorized zone and threshold evaluation for all sources.
+
+    Args:
+        sources (List[Optional[SourceConfig]]): Compiled sources indexed by source id
+        frame_width (int): Width of the muxer output
+        frame_height (int): Height of the muxer output
+        cell_size (int): Side in pixels of a grid cell
+    """
+
+    def __init__(self, sources: List[Optional[SourceConfig]], frame_width: int = 1920,
+                 frame_height: int = 1080, cell_size: int = 64) -> None:
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.cell_size = cell_size
+        num_sources = len(sources)
+        self._num_sources = num_sources
+        sources = active_sources(sources)
+
+        self._thresholds = np.full((num_sources, NUM_CLASSES), np.inf)
+        for source in sources:
+            self._thresholds[source.source_id] = source.thresholds
+
+        # Edges of every zone of every source, concatenated
+        x1, y1, x2, y2, edge_start, edge_count = [], [], [], [], [], []
+        local_index, bounds = [], []
+        # Grid layout, one block of cells per source
+        self._cols = math.ceil(frame_width / cell_size)
+        self._rows = math.ceil(frame_height / cell_size)
+        cells_per_source = self._cols * self._rows
+        cell_zones = [[] for _ in range(num_sources * cells_per_source)]
+
+        for source in sources:
+            base = source.source_id * cells_per_source
+            for index, zone in enumerate(source.zones):
+                zone_id = len(local_index)
+                local_index.append(index)
+                bounds.append((zone.min_x, zone.min_y, zone.max_x, zone.max_y))
+                edge_start.append(len(x1))
+                edge_count.append(len(zone.vertices))
+                vertices = zone.vertices
+                for i, (ax, ay) in enumerate(vertices):
+                    bx, by = vertices[(i + 1) % len(vertices)]
+                    x1.append(ax)
+                    y1.append(ay)
+                    x2.append(bx)
+                    y2.append(by)
+
+                col_min, row_min = self._cell(zone.min_x, zone.min_y)
+                col_max, row_max = self._cell(zone.max_x, zone.max_y)
+                for row in range(row_min, row_max + 1):
+                    for col in range(col_min, col_max + 1):
+                        cell_zones[base + row * self._cols + col].append(zone_id)
+
+        self._edge_x1 = np.asarray(x1, dtype=np.float64)
+        self._edge_y1 = np.asarray(y1, dtype=np.float64)
+        self._edge_x2 = np.asarray(x2, dtype=np.float64)
+        self._edge_y2 = np.asarray(y2, dtype=np.float64)
+        dx = self._edge_dx = self._edge_x2 - self._edge_x1
+        dy = self._edge_dy = self._edge_y2 - self._edge_y1
+        # Inverse slope of every edge, horizontal edges never cross the ray
+        self._edge_slope = np.divide(dx, dy, out=np.zeros_like(dx), where=dy != 0)
+        self._edge_start = np.asarray(edge_start, dtype=np.int64)
+        self._edge_count = np.asarray(edge_count, dtype=np.int64)
+        self._local_index = np.asarray(local_index, dtype=np.int64)
+        self._bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+
+        self._cells_per_source = cells_per_source
+        counts = np.fromiter((len(c) for c in cell_zones), dtype=np.int64,
+                             count=len(cell_zones))
+        self._cell_start = np.zeros(len(cell_zones) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self._cell_start[1:])
+        self._cell_zones = np.fromiter((z for c in cell_zones for z in c),
+                                       dtype=np.int64, count=int(counts.sum()))
+
+    def _cell(self, x: float, y: float):
+        col = min(max(int(x // self.cell_size), 0), self._cols - 1)
+        row = min(max(int(y // self.cell_size), 0), self._rows - 1)
+        return col, row
+
+    def evaluate(self, source_ids: Sequence[int], class_ids: Sequence[int],
+                 confidences: Sequence[float], xs: Sequence[float],
+                 ys: Sequence[float]) -> ZoneHits:
+        """Evaluate thresholds and zones for all the detections of a batch
+
+        Args:
+            source_ids (Sequence[int]): Source of every detection
+            class_ids (Sequence[int]): Class id of every detection
+            confidences (Sequence[float]): Confidence of every detection
+            xs (Sequence[float]): Horizontal feet point of every detection
+            ys (Sequence[float]): Vertical feet point of every detection
+
+        Returns:
+            ZoneHits: Threshold and zone results per detection
+        """
+        source_ids = np.asarray(source_ids, dtype=np.int64)
+        class_ids = np.asarray(class_ids, dtype=np.int64)
+        confidences = np.asarray(confidences, dtype=np.float64)
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        num_objects = len(source_ids)
+
+        thresholds = np.full(num_objects, np.inf)
+        # Frames of sources removed at runtime can still be in flight
+        known = (class_ids >= 0) & (class_ids < NUM_CLASSES) & \
+            (source_ids >= 0) & (source_ids < self._num_sources)
+        thresholds[known] = self._thresholds[source_ids[known], class_ids[known]]
+        confident = confidences >= thresholds
+        zone = np.full(num_objects, -1, dtype=np.int64)
+
+        candidates = np.flatnonzero(
+            confident & known & (xs >= 0) & (xs < self.frame_width)
+            & (ys >= 0) & (ys < self.frame_height)
+        )
+        empty = np.empty(0, dtype=np.int64)
+        if len(candidates) == 0:
+            return ZoneHits(confident, zone, empty, empty)
+
+        # Candidate (object, zone) pairs from the grid cell of every point
+        cols = (xs[candidates] // self.cell_size).astype(np.int64)
+        rows = (ys[candidates] // self.cell_size).astype(np.int64)
+        cells = source_ids[candidates] * self._cells_per_source + rows * self._cols + cols
+        starts = self._cell_start[cells]
+        counts = self._cell_start[cells + 1] - starts
+        pair_object = np.repeat(candidates, counts)
+        pair_zone = self._cell_zones[_expand(starts, counts)]
+
+        # Bounding box reject before the edge tests
+        px, py = xs[pair_object], ys[pair_object]
+        bounds = self._bounds[pair_zone]
+        keep = (px > bounds[:, 0]) & (py > bounds[:, 1]) & (px < bounds[:, 2]) & (py < bounds[:, 3])
+        pair_object, pair_zone, px, py = pair_object[keep], pair_zone[keep], px[keep], py[keep]
+        if len(pair_zone) == 0:
+            return ZoneHits(confident, zone, empty, empty)
+
+        # Even-odd crossing test of every pair against every edge of its zone
+        edge_counts = self._edge_count[pair_zone]
+        edges = _expand(self._edge_start[pair_zone], edge_counts)
+        edge_pair = np.repeat(np.arange(len(pair_zone)), edge_counts)
+        ex, ey = px[edge_pair], py[edge_pair]
+        x1, x2 = self._edge_x1[edges], self._edge_x2[edges]
+        y1, y2 = self._edge_y1[edges], self._edge_y2[edges]
+        crossing = ((y1 > ey) != (y2 > ey)) & \
+            (ex < x1 + self._edge_slope[edges] * (ey - y1))
+        inside = np.bincount(edge_pair, weights=crossing, minlength=len(pair_zone)) % 2 == 1
+        # Points on an edge are outside whatever the crossing count says
+        on_edge = (self._edge_dx[edges] * (ey - y1) == self._edge_dy[edges] * (ex - x1)) & \
+            (ex >= np.minimum(x1, x2)) & (ex <= np.maximum(x1, x2)) & \
+            (ey >= np.minimum(y1, y2)) & (ey <= np.maximum(y1, y2))
+        inside &= np.bincount(edge_pair, weights=on_edge, minlength=len(pair_zone)) == 0
+
+        hit_objects = pair_object[inside]
+        hit_zones = self._local_index[pair_zone[inside]]
+        # Pairs are sorted by object then zone, keep the first zone per object
+        objects, first = np.unique(hit_objects, return_index=True)
+        zone[objects] = hit_zones[first]
+        return ZoneHits(confident, zone, hit_objects, hit_zones)
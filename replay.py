@@ -0,0 +1,50 @@
+import argparse
+import collections
+import json
+import logging
+import sys
+
+from pipeline.config import compile_config
+from pipeline.publisher import event_to_dict
+from pipeline.replay import ReplayStats, replay
+
+
+def main(args: argparse.Namespace) -> None:
+    with open(args.config_path, "r") as file:
+        app_config = json.load(file)
+    sources = compile_config(app_config)
+
+    stats = ReplayStats()
+    counts = collections.Counter()
+    output = open(args.output, "w") if args.output else None
+    try:
+        for recording in args.recording:
+            for event in replay(recording, sources, exit_timeout=args.exit_timeout,
+                                dwell_interval=args.dwell_interval, stats=stats):
+                counts[event.type.name] += 1
+                if output is not None:
+                    output.write(json.dumps(event_to_dict(event)) + "\n")
+    finally:
+        if output is not None:
+            output.close()
+
+    summary = stats.to_dict()
+    summary["events_by_type"] = dict(counts)
+    json.dump(summary, sys.stdout, indent=4)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Run the zone and event logic of a config over recorded detections, "
+                    "see --record_dir of main.py")
+    parser.add_argument("--config_path", required=True, type=str)
+    parser.add_argument("--recording", required=True, nargs="+",
+                        help="Recording directories, each replayed with a fresh state")
+    parser.add_argument("--output", default=None, type=str,
+                        help="Write the events as JSON lines to this file")
+    parser.add_argument("--exit_timeout", default=2.0, type=float)
+    parser.add_argument("--dwell_interval", default=0.0, type=float)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,87 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import tempfile
+from typing import List
+
+from pipeline.metrics import MetricsServer
+from pipeline.sharding import STRATEGIES, Shard, partition_sources
+from pipeline.supervisor import Supervisor
+
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+def worker_command(shard: Shard, config_path: str, metrics_port: int,
+                   passthrough: List[str]) -> List[str]:
+    command = [sys.executable, MAIN_PATH,
+               "--config_path", config_path,
+               "--gpu_id", str(shard.gpu_id),
+               "--batch_size", str(shard.batch_size)]
+    if metrics_port:
+        command += ["--metrics_port", str(metrics_port)]
+    return command + passthrough
+
+
+def main(args: argparse.Namespace, passthrough: List[str]) -> None:
+    with open(args.config_path, "r") as file:
+        app_config = json.load(file)
+
+    gpu_ids = [int(gpu_id) for gpu_id in args.gpu_ids.split(",")] if args.gpu_ids else None
+    shards = partition_sources(app_config, args.shards, args.strategy, gpu_ids)
+    for shard in shards:
+        logging.info(f"{shard} load={shard.load:.1f}")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="shards_")
+    supervisor = Supervisor(
+        shards,
+        lambda shard, path, port: worker_command(shard, path, port, passthrough),
+        work_dir,
+        metrics_base_port=args.worker_metrics_base_port,
+        max_failures=args.max_worker_failures,
+    )
+
+    stop = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.append(True))
+
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = MetricsServer(supervisor, args.metrics_port, host=args.metrics_host)
+        metrics_server.start()
+    logging.info(f"Supervising {len(shards)} workers, shard configs in {work_dir}")
+    try:
+        supervisor.run(should_stop=lambda: bool(stop))
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+    logging.info(f"Workers stopped: {json.dumps(supervisor.health())}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Run the sources of a config across several pipeline processes. "
+                    "Unknown arguments are passed to every worker.")
+    parser.add_argument("--config_path", required=True, type=str)
+    parser.add_argument("--shards", default=os.cpu_count() or 1, type=int)
+    parser.add_argument("--strategy", default="count", choices=STRATEGIES,
+                        help="count: round robin, load: balance expected_load, gpu: one shard per gpu_id")
+    parser.add_argument("--gpu_ids", default=None, type=str,
+                        help="Comma separated GPUs the shards are spread over")
+    parser.add_argument("--work_dir", default=None, type=str,
+                        help="Directory the shard configs are written to")
+    parser.add_argument("--metrics_port", default=0, type=int,
+                        help="Serve the merged metrics of the workers on this port")
+    parser.add_argument("--metrics_host", default="127.0.0.1", type=str,
+                        help="Address the merged metrics listen on, 0.0.0.0 for every interface")
+    parser.add_argument("--worker_metrics_base_port", default=0, type=int,
+                        help="Metrics port of the first worker, the next ones follow")
+    parser.add_argument("--max_worker_failures", default=0, type=int,
+                        help="Stop restarting a worker after this many crashes in a row, 0, "
+                             "the default, restarts it forever")
+    args, passthrough = parser.parse_known_args()
+    main(args, passthrough)
@@ -0,0 +1,118 @@
+import json
+
+import numpy as np
+import pyds
+
+from pipeline.aggregates import ZoneAggregator, encode_summary
+from pipeline.analytics import BatchAnalytics
+from pipeline.config import compile_config
+from pipeline.control import AnalyticsState
+from pipeline.events import Event, EventType
+from pipeline.occupancy import OccupancyTracker
+from pipeline.overlay import ZoneOverlay
+from pipeline.publisher import EventPublisher, MemoryTransport
+from pipeline.zones import ZoneEngine, ZoneHits
+
+LEFT = [[[0, 0], [960, 0]], [[960, 0], [960, 1080]], [[960, 1080], [0, 1080]], [[0, 1080], [0, 0]]]
+RIGHT = [[[960, 0], [1920, 0]], [[1920, 0], [1920, 1080]], [[1920, 1080], [960, 1080]],
+         [[960, 1080], [960, 0]]]
+
+
+def source(zones):
+    return {"uri": "file:///dev/null", "car_confidence": 0.4, "person_confidence": 0.4,
+            "restricted_zones": zones}
+
+
+def make_aggregator(window=10.0):
+    # Source 1 has no zones, source 2 follows it
+    sources = compile_config({"0": source([LEFT, RIGHT]), "1": source([]), "2": source([LEFT])})
+    aggregator = ZoneAggregator(window, grid=(2, 1))
+    aggregator.configure(sources, 1920, 1080)
+    return aggregator
+
+
+def hits(objects, zones):
+    count = max(objects, default=-1) + 1
+    return ZoneHits(np.ones(count, dtype=bool), np.zeros(count, dtype=np.int64),
+                    np.asarray(objects, dtype=np.int64), np.asarray(zones, dtype=np.int64))
+
+
+def event(type, source_id, zone, dwell=0.0):
+    return Event(type, source_id, 0, 1, zone, 0, 0.9, (0, 0, 10, 10), 0.0, dwell)
+
+
+def by_source(summaries):
+    return {summary.source_id: summary for summary in summaries}
+
+
+def test_window_accumulates_occupancy_heatmap_and_events():
+    aggregator = make_aggregator()
+    # Frame 1: two objects in the left zone of source 0, one in the zone of source 2
+    assert aggregator.update(0.0, [0, 1, 2], [0, 0, 2], hits([0, 1, 2], [0, 0, 0]),
+                             [100, 200, 100], [500, 500, 500],
+                             [event(EventType.ENTRY, 0, 0), event(EventType.ENTRY, 2, 0)]) == []
+    # Frame 2: one object left in the right zone of source 0
+    aggregator.update(1.0, [0, 1, 2], [0], hits([0], [1]), [1500], [500],
+                      [event(EventType.EXIT, 0, 0, dwell=4.0), event(EventType.EXIT, 1, 0)])
+
+    summaries = by_source(aggregator.summarize(2.0))
+    assert sorted(summaries) == [0, 2]
+    first = summaries[0]
+    assert (first.start, first.end, first.frames) == (0.0, 2.0, 2)
+    assert first.mean_occupancy.tolist() == [1.0, 0.5]
+    assert first.max_occupancy.tolist() == [2, 1]
+    assert first.entries.tolist() == [1, 0] and first.exits.tolist() == [1, 0]
+    assert first.mean_dwell.tolist() == [4.0, 0.0]
+    # Left and right column of the 2x1 grid
+    assert first.heatmap.tolist() == [[[2, 0]], [[0, 1]]]
+    assert summaries[2].heatmap.tolist() == [[[1, 0]]]
+    # Accumulators reset
+    assert aggregator.summarize(3.0) == []
+
+
+def test_elapsed_window_is_returned_by_the_next_update():
+    aggregator = make_aggregator(window=1.0)
+    aggregator.update(0.0, [0], [0], hits([0], [0]), [10], [10], [])
+    assert aggregator.update(0.5, [0], [], None, [], [], []) == []
+    summaries = aggregator.update(1.0, [0], [], None, [], [], [])
+    assert [(s.source_id, s.start, s.end, s.frames) for s in summaries] == [(0, 0.0, 1.0, 2)]
+    # The batch that closed the window starts the next one
+    assert by_source(aggregator.summarize(1.5))[0].frames == 1
+
+
+def test_summary_encoding():
+    aggregator = make_aggregator()
+    aggregator.update(0.0, [2], [2], hits([0], [0]), [10], [10],
+                      [event(EventType.ENTRY, 2, 0)])
+    key, value = encode_summary(aggregator.summarize(1.0)[0])
+    payload = json.loads(value)
+    assert key == b"2"
+    assert (payload["kind"], payload["s"], payload["in"], payload["grid"], payload["heat"]) == (
+        "zones", 2, [1], [2, 1], [[1, 0]])
+
+
+def test_summaries_closed_by_a_config_swap_are_published():
+    sources = compile_config({"0": source([LEFT])})
+    now = [0.0]
+    transport = MemoryTransport()
+    publisher = EventPublisher(transport)
+    state = AnalyticsState(sources, ZoneEngine(sources), ZoneOverlay(sources, interval=0))
+    analytics = BatchAnalytics(state, OccupancyTracker(), publisher, lambda: now[0],
+                               aggregator=ZoneAggregator(window=1.0), publish_events=False)
+
+    def batch():
+        rect = pyds.NvOSD_RectParams(100, 100, 40, 40)
+        return pyds.NvDsBatchMeta([pyds.NvDsFrameMeta(0, 0, [pyds.NvDsObjectMeta(0, 0.9, 1,
+                                                                                 rect)])])
+
+    analytics.process_batch(batch())
+    now[0] = 2.0
+    analytics.state = AnalyticsState(sources, ZoneEngine(sources),
+                                     ZoneOverlay(sources, interval=0), frozenset({0}))
+    analytics.process_batch(batch())
+
+    publisher.start()
+    publisher.close()
+    summaries = [json.loads(value) for _, value in transport.messages]
+    assert [(s["t0"], s["t1"], s["f"], s["in"], s["out"]) for s in summaries] == [
+        (0.0, 2.0, 1, [1], [1])]
@@ -0,0 +1,73 @@
+import json
+
+import pyds
+
+from pipeline.aggregates import ZoneAggregator
+from pipeline.analytics import BatchAnalytics
+from pipeline.config import compile_config
+from pipeline.control import AnalyticsState
+from pipeline.events import EventType
+from pipeline.occupancy import OccupancyTracker
+from pipeline.overlay import ZoneOverlay
+from pipeline.publisher import EventPublisher, MemoryTransport
+from pipeline.zones import ZoneEngine
+
+CAR = 0
+ZONE = [[[0, 0], [500, 0]], [[500, 0], [500, 500]], [[500, 500], [0, 500]], [[0, 500], [0, 0]]]
+
+
+class Clock():
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_analytics(clock, transport, aggregator=None):
+    sources = compile_config({"0": {"uri": "file:///dev/null", "car_confidence": 0.4,
+                                    "person_confidence": 0.4, "restricted_zones": [ZONE]}})
+    state = AnalyticsState(sources, ZoneEngine(sources), ZoneOverlay(sources, interval=0))
+    publisher = EventPublisher(transport)
+    return BatchAnalytics(state, OccupancyTracker(exit_timeout=10.0), publisher, clock,
+                          aggregator=aggregator), publisher
+
+
+def car_batch(object_id, left):
+    rect = pyds.NvOSD_RectParams(left, 100, 40, 40)
+    return pyds.NvDsBatchMeta([pyds.NvDsFrameMeta(0, 0, [pyds.NvDsObjectMeta(CAR, 0.9, object_id,
+                                                                             rect)])])
+
+
+def test_close_exits_the_objects_still_inside_a_zone():
+    clock = Clock()
+    transport = MemoryTransport()
+    analytics, publisher = make_analytics(clock, transport)
+    analytics.process_batch(car_batch(1, 100))
+    clock.now = 3.0
+    analytics.process_batch(car_batch(1, 100))
+
+    events = analytics.close()
+    assert [(e.type, e.tracking_id, e.dwell) for e in events] == [(EventType.EXIT, 1, 3.0)]
+    assert analytics.close() == []
+
+    publisher.start()
+    publisher.close()
+    published = [json.loads(value) for _, value in transport.messages]
+    assert [event["type"] for event in published] == ["ENTRY", "EXIT"]
+
+
+def test_close_publishes_the_last_window_with_the_exits():
+    clock = Clock()
+    transport = MemoryTransport()
+    analytics, publisher = make_analytics(clock, transport, ZoneAggregator(window=60.0))
+    analytics.process_batch(car_batch(1, 100))
+    clock.now = 1.0
+    analytics.close()
+
+    publisher.start()
+    publisher.close()
+    summaries = [json.loads(value) for _, value in transport.messages
+                 if json.loads(value).get("kind") == "zones"]
+    assert [(summary["in"], summary["out"], summary["f"]) for summary in summaries] == [
+        ([1], [1], 1)]
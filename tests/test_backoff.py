@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+from pipeline.backoff import Backoff
+
+
+def test_delay_doubles_up_to_the_maximum():
+    backoff = Backoff(initial=0.5, maximum=3.0, reset_after=10.0)
+    assert [backoff.next_delay(0.0) for _ in range(5)] == [0.5, 1.0, 2.0, 3.0, 3.0]
+
+
+def test_delay_starts_over_after_a_long_run():
+    backoff = Backoff(initial=1.0, maximum=60.0, reset_after=10.0)
+    backoff.next_delay(0.0)
+    backoff.next_delay(0.0)
+    assert backoff.next_delay(10.0) == 1.0
+
+
+def test_journal_and_watchdog_do_not_import_the_supervisor():
+    code = ("import sys, pipeline.journal, pipeline.watchdog; "
+            "print('pipeline.supervisor' in sys.modules)")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            check=True).stdout
+    assert output.strip() == "False"
@@ -0,0 +1,38 @@
+import pytest
+
+from pipeline.config import compile_config, validate_config
+
+SQUARE = [[[0, 0], [100, 0]], [[100, 0], [100, 100]], [[100, 100], [0, 100]], [[0, 100], [0, 0]]]
+
+
+def config(zone):
+    return {"0": {"uri": "file:///dev/null", "car_confidence": 0.4, "person_confidence": 0.4,
+                  "restricted_zones": [zone]}}
+
+
+def test_closed_chain_is_accepted():
+    validate_config(config(SQUARE))
+    # A concave zone keeps its exact shape
+    concave = [[[0, 0], [100, 0]], [[100, 0], [100, 100]], [[100, 100], [50, 50]],
+               [[50, 50], [0, 100]], [[0, 100], [0, 0]]]
+    zone = compile_config(config(concave))[0].zones[0]
+    assert zone.contains(50, 20) and not zone.contains(50, 80)
+
+
+def test_lines_out_of_order_are_rejected():
+    shuffled = [SQUARE[0], SQUARE[2], SQUARE[1], SQUARE[3]]
+    with pytest.raises(ValueError, match=r"restricted_zones\[0\]\[0\].*closed, ordered chain"):
+        validate_config(config(shuffled))
+
+
+def test_open_chain_is_rejected():
+    open_chain = SQUARE[:3] + [[[0, 100], [0, 10]]]
+    with pytest.raises(ValueError, match=r"\[3\]"):
+        validate_config(config(open_chain))
+
+
+def test_self_intersecting_zone_is_rejected():
+    bowtie = [[[0, 0], [100, 100]], [[100, 100], [100, 0]], [[100, 0], [0, 100]],
+              [[0, 100], [0, 0]]]
+    with pytest.raises(ValueError, match="Self-intersection"):
+        validate_config(config(bowtie))
@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+
+from pipeline.config import compile_config
+from pipeline.control import AnalyticsState, ConfigWatcher, diff_sources
+from pipeline.overlay import ZoneOverlay
+from pipeline.zones import ZoneEngine
+
+SQUARE = [[[0, 0], [100, 0]], [[100, 0], [100, 100]], [[100, 100], [0, 100]], [[0, 100], [0, 0]]]
+OTHER = [[[200, 200], [300, 200]], [[300, 200], [300, 300]], [[300, 300], [200, 300]],
+         [[200, 300], [200, 200]]]
+
+
+def source(uri="rtsp://camera", zones=(SQUARE,), car=0.4, **extra):
+    return {"uri": uri, "car_confidence": car, "person_confidence": 0.4,
+            "restricted_zones": list(zones), **extra}
+
+
+def write_config(path, config, mtime_ns):
+    path.write_text(json.dumps(config))
+    # Distinct stamps whatever the timestamp resolution of the file system
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_unchanged_config_has_no_difference():
+    config = {"0": source(), "1": source("rtsp://other")}
+    assert diff_sources(compile_config(config), compile_config(config)) == ([], [], [])
+
+
+def test_added_and_removed_sources_may_leave_holes():
+    old = compile_config({"0": source(), "2": source("rtsp://two")})
+    new = compile_config({"0": source(), "5": source("rtsp://five")})
+    assert diff_sources(old, new) == ([5], [2], [])
+
+
+def test_zone_and_threshold_changes_are_reported_as_changed():
+    old = compile_config({"0": source(), "1": source(), "2": source()})
+    new = compile_config({"0": source(zones=(OTHER,)), "1": source(car=0.6),
+                          "2": source(zones=(SQUARE, OTHER))})
+    assert diff_sources(old, new) == ([], [], [0, 1, 2])
+
+
+def test_new_uri_replaces_the_source():
+    old = compile_config({"0": source("rtsp://a")})
+    new = compile_config({"0": source("rtsp://b")})
+    assert diff_sources(old, new) == ([0], [0], [])
+
+
+def test_identity_only_changes_keep_the_source():
+    old = compile_config({"0": source()})
+    new = compile_config({"0": source(sensor_id=7, place_id=2, sensor_str="gate", fps=15)})
+    assert diff_sources(old, new) == ([], [], [])
+    assert new[0].sensor_str == "gate" and new[0].sensor_id == 7
+
+
+def test_state_bundles_the_compiled_config():
+    sources = compile_config({"0": source()})
+    state = AnalyticsState(sources, ZoneEngine(sources), ZoneOverlay(sources))
+    assert state.reset_sources == frozenset()
+    assert state.zone_engine.evaluate([0], [0], [0.9], [50], [50]).zone.tolist() == [0]
+
+
+def test_watcher_reads_a_change_once_it_settled(tmp_path):
+    path = tmp_path / "app_config.json"
+    write_config(path, {"0": source()}, 1_000_000_000)
+    watcher = ConfigWatcher(str(path))
+    assert watcher.check() is None
+
+    write_config(path, {"0": source(car=0.6)}, 2_000_000_000)
+    assert watcher.check() is None
+    # Still being written on the next check, the read waits again
+    write_config(path, {"0": source(car=0.7)}, 3_000_000_000)
+    assert watcher.check() is None
+    assert watcher.check()["0"]["car_confidence"] == 0.7
+    assert watcher.check() is None
+
+
+def test_watcher_skips_invalid_files_until_they_change(tmp_path, caplog):
+    path = tmp_path / "app_config.json"
+    write_config(path, {"0": source()}, 1_000_000_000)
+    watcher = ConfigWatcher(str(path))
+
+    path.write_text('{"0": {"uri": ')
+    os.utime(path, ns=(2_000_000_000, 2_000_000_000))
+    with caplog.at_level(logging.ERROR):
+        assert watcher.check() is None
+        assert watcher.check() is None
+    assert caplog.text.count("Unable to read") == 1
+    assert watcher.check() is None
+
+    write_config(path, {"0": source(car=0.9)}, 3_000_000_000)
+    watcher.check()
+    assert watcher.check()["0"]["car_confidence"] == 0.9
+
+
+def test_watcher_survives_a_missing_file(tmp_path):
+    path = tmp_path / "app_config.json"
+    watcher = ConfigWatcher(str(path))
+    assert watcher.check() is None
+    write_config(path, {"0": source()}, 1_000_000_000)
+    assert watcher.check() is None
+    assert watcher.check() == {"0": source()}
+
+
+def test_watcher_sees_a_replaced_file_with_the_same_size_and_time(tmp_path):
+    path = tmp_path / "app_config.json"
+    write_config(path, {"0": source(car=0.4)}, 1_000_000_000)
+    watcher = ConfigWatcher(str(path))
+    replacement = tmp_path / "app_config.json.new"
+    write_config(replacement, {"0": source(car=0.5)}, 1_000_000_000)
+    keep = tmp_path / "keep"
+    os.link(path, keep)
+    os.replace(replacement, path)
+    watcher.check()
+    assert watcher.check()["0"]["car_confidence"] == 0.5
@@ -0,0 +1,180 @@
+import configparser
+import json
+import os
+
+import pytest
+
+from pipeline.engines import EngineCache, EngineKey, round_batch_size, select_engine
+
+MODEL_CONFIG = """[property]
+gpu-id=0
+model-file=../model/resnet10.caffemodel
+proto-file=../model/resnet10.prototxt
+model-engine-file=../model/resnet10.caffemodel_b1_gpu0_int8.engine
+force-implicit-batch-dim=1
+batch-size=1
+network-mode=1
+"""
+
+
+class FakeClock():
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        self.now += 1.0
+        return self.now
+
+
+@pytest.fixture
+def model_config(tmp_path):
+    model_dir = tmp_path / "model"
+    model_dir.mkdir()
+    (model_dir / "resnet10.caffemodel").write_bytes(b"weights")
+    (model_dir / "resnet10.prototxt").write_text("layers")
+    for batch_size in (1, 2, 4):
+        (model_dir / f"resnet10.caffemodel_b{batch_size}_gpu0_int8.engine").write_bytes(b"")
+    config_dir = tmp_path / "configs"
+    config_dir.mkdir()
+    path = config_dir / "model_config.txt"
+    path.write_text(MODEL_CONFIG)
+    return str(path)
+
+
+def read_properties(path):
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str
+    config.read(path)
+    return config["property"]
+
+
+def cached_key(batch_size, model_hash="0123456789ab", gpu_id=0, precision="int8"):
+    return EngineKey("resnet10.caffemodel", batch_size, gpu_id, precision, model_hash)
+
+
+def add_engine(cache, tmp_path, key):
+    built = tmp_path / f"built_{key.batch_size}.engine"
+    built.write_bytes(b"engine")
+    return cache.add(str(built), key)
+
+
+@pytest.mark.parametrize("batch_size, rounded", [(1, 1), (2, 2), (3, 4), (4, 4), (5, 8), (9, 16)])
+def test_batch_size_is_rounded_to_a_power_of_two(batch_size, rounded):
+    assert round_batch_size(batch_size) == rounded
+
+
+def test_key_round_trips_through_its_file_name():
+    key = cached_key(4)
+    assert key.filename == "resnet10.caffemodel_b4_gpu0_int8_0123456789ab.engine"
+    parsed = EngineKey.parse(key.filename)
+    assert (parsed.model, parsed.batch_size, parsed.gpu_id, parsed.precision,
+            parsed.model_hash) == ("resnet10.caffemodel", 4, 0, "int8", "0123456789ab")
+    assert EngineKey.parse("resnet10.caffemodel_b2_gpu1_fp16.engine").model_hash is None
+    assert EngineKey.parse("labels.txt") is None
+
+
+def test_keys_match_on_model_gpu_precision_and_hash():
+    key = cached_key(1)
+    assert key.matches(cached_key(8))
+    assert key.matches(cached_key(8, model_hash=None))
+    assert not key.matches(cached_key(1, model_hash="ba9876543210"))
+    assert not key.matches(cached_key(1, gpu_id=1))
+    assert not key.matches(cached_key(1, precision="fp16"))
+
+
+def test_cache_finds_the_smallest_engine_large_enough(tmp_path):
+    cache = EngineCache(str(tmp_path / "engines"), clock=FakeClock())
+    for batch_size in (2, 8, 16):
+        add_engine(cache, tmp_path, cached_key(batch_size))
+    assert cache.find(cached_key(3)).batch_size == 8
+    assert cache.find(cached_key(2)).batch_size == 2
+    assert cache.find(cached_key(17)) is None
+    assert cache.find(cached_key(1, model_hash="ba9876543210")) is None
+
+
+def test_least_recently_used_engines_are_evicted(tmp_path):
+    cache_dir = tmp_path / "engines"
+    cache = EngineCache(str(cache_dir), max_entries=2, clock=FakeClock())
+    add_engine(cache, tmp_path, cached_key(1))
+    add_engine(cache, tmp_path, cached_key(2))
+    cache.touch(cached_key(1))
+    add_engine(cache, tmp_path, cached_key(4))
+    assert sorted(entry.batch_size for entry in cache.entries()) == [1, 4]
+    assert not os.path.exists(cache.path(cached_key(2)))
+    with open(cache_dir / "index.json") as file:
+        assert sorted(json.load(file)) == [cached_key(1).filename, cached_key(4).filename]
+
+
+def test_index_survives_a_restart_and_tolerates_corruption(tmp_path):
+    cache_dir = tmp_path / "engines"
+    cache = EngineCache(str(cache_dir), max_entries=2, clock=FakeClock())
+    add_engine(cache, tmp_path, cached_key(1))
+    add_engine(cache, tmp_path, cached_key(2))
+    cache.touch(cached_key(1))
+    # The restarted cache still knows that b2 is the least recently used
+    clock = FakeClock()
+    clock.now = 2000.0
+    restarted = EngineCache(str(cache_dir), max_entries=2, clock=clock)
+    add_engine(restarted, tmp_path, cached_key(4))
+    assert sorted(entry.batch_size for entry in restarted.entries()) == [1, 4]
+
+    (cache_dir / "index.json").write_text("{not json")
+    assert len(EngineCache(str(cache_dir)).entries()) == 2
+
+
+def test_cache_needs_room_for_an_engine(tmp_path):
+    with pytest.raises(ValueError):
+        EngineCache(str(tmp_path), max_entries=0)
+
+
+def test_selection_pads_the_batch_to_a_prebuilt_engine(model_config, tmp_path):
+    cache = EngineCache(str(tmp_path / "engines"))
+    selection = select_engine(model_config, cache, 3, output_dir=str(tmp_path))
+    assert selection.batch_size == 4
+    assert selection.build_path is None
+    assert selection.engine_path == str(tmp_path / "model" / "resnet10.caffemodel_b4_gpu0_int8.engine")
+    properties = read_properties(selection.config_path)
+    assert properties["model-engine-file"] == selection.engine_path
+    assert properties["batch-size"] == "4"
+    # The other paths are made absolute for the generated config
+    assert properties["model-file"] == str(tmp_path / "model" / "resnet10.caffemodel")
+
+
+def test_selection_builds_and_caches_a_missing_engine(model_config, tmp_path):
+    cache = EngineCache(str(tmp_path / "engines"))
+    selection = select_engine(model_config, cache, 5, output_dir=str(tmp_path))
+    assert selection.batch_size == 8
+    assert selection.build_path == str(tmp_path / "model" / "resnet10.caffemodel_b8_gpu0_int8.engine")
+    assert selection.adopt() is None
+
+    # nvinfer serialized the engine, it moves into the cache with the model hash
+    with open(selection.build_path, "wb") as file:
+        file.write(b"engine")
+    cached = selection.adopt()
+    assert cached == cache.path(selection.key)
+    assert os.path.isfile(cached)
+    assert not os.path.exists(str(tmp_path / "model" / "resnet10.caffemodel_b8_gpu0_int8.engine"))
+
+    # The next start with 5 to 8 sources uses the cached engine
+    again = select_engine(model_config, cache, 6, output_dir=str(tmp_path))
+    assert again.engine_path == cached
+    assert again.build_path is None
+
+
+def test_cached_engine_of_other_model_files_is_not_used(model_config, tmp_path):
+    cache = EngineCache(str(tmp_path / "engines"))
+    selection = select_engine(model_config, cache, 8, output_dir=str(tmp_path))
+    with open(selection.build_path, "wb") as file:
+        file.write(b"engine")
+    selection.adopt()
+    (tmp_path / "model" / "resnet10.caffemodel").write_bytes(b"retrained weights")
+    again = select_engine(model_config, cache, 8, output_dir=str(tmp_path))
+    assert again.build_path is not None
+
+
+def test_selection_rejects_unknown_precisions(model_config, tmp_path):
+    with open(model_config, "w") as file:
+        file.write(MODEL_CONFIG.replace("network-mode=1", "network-mode=7"))
+    with pytest.raises(ValueError):
+        select_engine(model_config, EngineCache(str(tmp_path / "engines")), 1,
+                      output_dir=str(tmp_path))
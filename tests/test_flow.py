@@ -0,0 +1,30 @@
+import pytest
+
+from pipeline.flow import QueueAccounting, QueuePolicy
+
+
+def test_queue_policy_parses_the_limits():
+    policy = QueuePolicy.parse("leaky:4:200")
+    assert (policy.mode, policy.max_buffers, policy.max_time) == ("leaky", 4, 0.2)
+    assert policy.properties()["leaky"] == 2
+    assert QueuePolicy.parse("block").properties()["leaky"] == 0
+    with pytest.raises(ValueError):
+        QueuePolicy.parse("leaky:0:0")
+    with pytest.raises(ValueError):
+        QueuePolicy.parse("drop")
+
+
+def test_only_the_overruns_of_leaky_queues_drop_buffers():
+    accounting = QueueAccounting()
+    accounting.add("output", leaky=True)
+    accounting.add("messaging", leaky=False)
+    assert [accounting.overrun("output") for _ in range(3)] == [1, 1, 1]
+    assert accounting.overrun("messaging") == 0
+    assert accounting.dropped == 3
+    assert accounting.update("output") == 3
+    assert accounting.update("output") == 0
+    accounting.overrun("output")
+    assert accounting.update("output") == 1
+    assert accounting.stats() == {"output": {"overruns": 4, "dropped": 4},
+                                  "messaging": {"overruns": 1, "dropped": 0}}
+
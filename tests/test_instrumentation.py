@@ -0,0 +1,63 @@
+import importlib
+import signal
+import sys
+import types
+
+import pytest
+
+from pipeline.metrics import MetricsRegistry
+
+
+class FakeGLib():
+    """Records the callbacks the instrumentation hands to the main loop"""
+    PRIORITY_DEFAULT = 0
+
+    def __init__(self) -> None:
+        self.signal_handlers = {}
+
+    def timeout_add(self, interval, callback):
+        return 1
+
+    def idle_add(self, callback, *args):
+        return 1
+
+    def unix_signal_add(self, priority, signum, handler):
+        self.signal_handlers[signum] = handler
+        return 1
+
+
+@pytest.fixture
+def glib(monkeypatch):
+    """pipeline.instrumentation imported against a GLib stand-in, no GStreamer
+    element is attached so Gst is never used"""
+    glib = FakeGLib()
+    gi = types.ModuleType("gi")
+    gi.require_version = lambda name, version: None
+    repository = types.ModuleType("gi.repository")
+    repository.GLib = glib
+    repository.Gst = types.SimpleNamespace(Element=object, Pad=object)
+    gi.repository = repository
+    monkeypatch.setitem(sys.modules, "gi", gi)
+    monkeypatch.setitem(sys.modules, "gi.repository", repository)
+    monkeypatch.delitem(sys.modules, "pipeline.instrumentation", raising=False)
+    glib.module = importlib.import_module("pipeline.instrumentation")
+    yield glib
+    sys.modules.pop("pipeline.instrumentation", None)
+
+
+def test_signal_toggle_survives_a_later_attach(glib):
+    instrumentation = glib.module.Instrumentation(MetricsRegistry(), enabled=False)
+    instrumentation.toggle_on_signal(signal.SIGUSR1)
+    instrumentation.attach({}, "streammux")
+    assert not instrumentation.enabled
+
+    glib.signal_handlers[signal.SIGUSR1]()
+    assert instrumentation.enabled
+    # The pipeline attaches the elements again after a rebuild
+    instrumentation.attach({}, "streammux")
+    assert instrumentation.enabled
+
+    glib.signal_handlers[signal.SIGUSR1]()
+    instrumentation.attach({}, "streammux")
+    assert not instrumentation.enabled
+
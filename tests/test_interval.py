@@ -0,0 +1,66 @@
+import pytest
+
+from pipeline.interval import IntervalController
+
+
+def run(controller, latencies, **sample):
+    return [controller.observe(latency, **sample) for latency in latencies]
+
+
+def test_latency_above_the_target_raises_the_interval_once_per_cooldown():
+    controller = IntervalController(0.1, max_interval=4, cooldown=3)
+    assert run(controller, [0.2] * 9) == [1, None, None, None, 2, None, None, None, 3]
+    assert controller.changes == 3
+
+
+def test_interval_falls_back_after_the_cooldown():
+    controller = IntervalController(0.1, max_interval=4, cooldown=3, interval=2)
+    assert controller.observe(0.2) == 3
+    # Headroom again, the cooldown still has to pass before every change
+    assert run(controller, [0.03] * 8) == [None, None, None, 2, None, None, None, 1]
+
+
+def test_latency_between_the_low_ratio_and_the_target_keeps_the_interval():
+    controller = IntervalController(0.1, low_ratio=0.6, cooldown=0, interval=2)
+    assert run(controller, [0.07, 0.09, 0.065, 0.1]) == [None] * 4
+    assert controller.interval == 2
+
+
+def test_latency_spike_is_smoothed():
+    controller = IntervalController(0.1, smoothing=0.2, cooldown=0, interval=1)
+    assert run(controller, [0.08, 0.08, 0.15, 0.08]) == [None] * 4
+    # A sustained overload crosses the target
+    assert controller.observe(0.15) == 2
+
+
+def test_interval_stays_within_its_bounds():
+    controller = IntervalController(0.1, min_interval=1, max_interval=3, cooldown=2)
+    assert controller.interval == 1
+    run(controller, [1.0] * 50)
+    assert controller.interval == 3
+    run(controller, [0.001] * 50)
+    assert controller.interval == 1
+    assert IntervalController(0.1, min_interval=1, max_interval=3, interval=9).interval == 3
+    assert IntervalController(0.1, min_interval=1, max_interval=3, interval=0).interval == 1
+
+
+def test_invalid_settings_are_rejected():
+    with pytest.raises(ValueError):
+        IntervalController(0.0)
+    with pytest.raises(ValueError):
+        IntervalController(0.1, min_interval=3, max_interval=2)
+    with pytest.raises(ValueError):
+        IntervalController(0.1, low_ratio=1.0)
+
+
+def test_drops_of_a_leaky_queue_raise_the_interval():
+    controller = IntervalController(0.1, max_queue=4, cooldown=0)
+    # Within the latency target and the leaky queue never deeper than its limit
+    assert controller.observe(0.05, queue_depth=0, dropped=2) == 1
+    assert controller.observe(0.05, queue_depth=0, dropped=0) == 0
+
+
+def test_blocking_queue_depth_raises_the_interval():
+    controller = IntervalController(0.1, max_queue=4, cooldown=0)
+    assert controller.observe(0.05, queue_depth=5) == 1
+    assert controller.observe(0.05, queue_depth=2) is None
@@ -0,0 +1,143 @@
+import time
+from typing import List
+
+from pipeline.journal import SegmentJournal, SpillingTransport
+from pipeline.publisher import Message, MemoryTransport
+
+
+class PausableTransport(MemoryTransport):
+    """Stand-in broker that can be taken down or slowed down
+
+    Args:
+        delay (float): Seconds every send takes
+    """
+
+    def __init__(self, delay: float = 0.0) -> None:
+        super().__init__()
+        self.delay = delay
+        self.paused = False
+
+    def pause(self) -> None:
+        self.paused = True
+
+    def resume(self) -> None:
+        self.paused = False
+
+    def send(self, messages: List[Message]) -> None:
+        if self.delay:
+            time.sleep(self.delay)
+        if self.paused:
+            raise ConnectionError("Broker paused")
+        super().send(messages)
+
+
+class Clock():
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def messages(start, count):
+    return [(str(i % 3).encode(), f"event-{i}".encode()) for i in range(start, start + count)]
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_messages_spill_while_the_broker_is_paused(tmp_path):
+    broker = PausableTransport()
+    transport = SpillingTransport(broker, SegmentJournal(str(tmp_path)), initial_backoff=0.01)
+    try:
+        transport.send(messages(0, 2))
+        broker.pause()
+        transport.send(messages(2, 3))
+        transport.send(messages(5, 3))
+        assert transport.spilling
+        assert transport.stats.failures >= 1 and transport.stats.spilled == 6
+        assert broker.messages == messages(0, 2)
+    finally:
+        transport.close()
+
+
+def test_spilled_messages_are_replayed_in_order_on_resume(tmp_path):
+    broker = PausableTransport()
+    broker.pause()
+    transport = SpillingTransport(broker, SegmentJournal(str(tmp_path), segment_size=256),
+                                  initial_backoff=0.01, max_backoff=0.05, max_batch=4)
+    try:
+        for start in range(0, 40, 5):
+            transport.send(messages(start, 5))
+        broker.resume()
+        wait_until(lambda: not transport.spilling)
+        transport.send(messages(40, 2))
+        assert broker.messages == messages(0, 42)
+        assert transport.stats.replayed == 40 and transport.stats.direct == 2
+        # Replayed segments are deleted
+        assert len(transport.journal) == 0
+    finally:
+        transport.close()
+
+
+def test_slow_broker_spills_until_it_catches_up(tmp_path):
+    broker = PausableTransport(delay=0.05)
+    transport = SpillingTransport(broker, SegmentJournal(str(tmp_path)), slow_send=0.01,
+                                  initial_backoff=0.01)
+    try:
+        transport.send(messages(0, 1))
+        assert transport.spilling and transport.stats.slow_sends == 1
+        transport.send(messages(1, 2))
+        broker.delay = 0.0
+        wait_until(lambda: len(broker.messages) == 3 and not transport.spilling)
+        assert broker.messages == messages(0, 3)
+    finally:
+        transport.close()
+
+
+def test_retention_drops_the_oldest_segments_by_size(tmp_path):
+    journal = SegmentJournal(str(tmp_path), segment_size=256, max_bytes=3 * 256)
+    journal.append(messages(0, 60))
+    assert journal.size <= 3 * 256
+    assert journal.stats.expired > 0
+    assert len(journal) == 60 - journal.stats.expired
+    # What is left is the newest messages, in order
+    _, kept = journal.read(100)
+    assert kept == messages(60 - len(kept), len(kept))
+    journal.close()
+
+
+def test_retention_drops_the_oldest_segments_by_age(tmp_path):
+    clock = Clock()
+    journal = SegmentJournal(str(tmp_path), segment_size=256, max_age=10.0, clock=clock)
+    journal.append(messages(0, 5))
+    first = len(journal)
+    clock.now = 5.0
+    journal.append(messages(5, 20))
+    assert journal.stats.expired == 0
+    clock.now = 30.0
+    journal.append(messages(25, 1))
+    # Only the segment being written is kept
+    assert journal.stats.expired >= first
+    _, kept = journal.read(100)
+    assert kept[-1] == messages(25, 1)[0]
+    journal.close()
+
+
+def test_replay_resumes_at_the_cursor_after_reopening(tmp_path):
+    journal = SegmentJournal(str(tmp_path), segment_size=256)
+    journal.append(messages(0, 20))
+    start, batch = journal.read(7)
+    assert batch == messages(0, 7)
+    journal.commit(start + len(batch))
+    journal.close()
+
+    reopened = SegmentJournal(str(tmp_path), segment_size=256)
+    assert len(reopened) == 13
+    _, batch = reopened.read(100)
+    assert batch == messages(7, 13)
+    reopened.close()
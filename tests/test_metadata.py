@@ -0,0 +1,56 @@
+import configparser
+
+import pytest
+
+from pipeline.config import compile_config
+from pipeline.metadata import (check_event_meta_layout, deepstream_version, msgconv_sections,
+                               write_msgconv_config)
+
+TEMPLATE = "configs/msgconv_config.txt"
+ZONE = [[[0, 0], [100, 0]], [[100, 0], [100, 100]], [[100, 100], [0, 100]], [[0, 100], [0, 0]]]
+
+
+def make_sources(*identities):
+    return compile_config({str(source_id): dict({"uri": "file:///dev/null",
+                                                 "car_confidence": 0.4,
+                                                 "person_confidence": 0.4,
+                                                 "restricted_zones": [ZONE]}, **identity)
+                           for source_id, identity in enumerate(identities)})
+
+
+def test_every_source_gets_a_sensor_and_place_section():
+    sections = msgconv_sections(TEMPLATE, make_sources({}, {}, {"sensor_id": 7, "place_id": 3,
+                                                                "sensor_str": "gate"}))
+    assert sections["sensor7"]["id"] == "gate"
+    assert sections["sensor1"] == dict(sections["sensor0"], id="sensor-1")
+    assert sections["place3"] == sections["place0"]
+
+
+def test_sections_round_trip_through_the_generated_config(tmp_path):
+    sections = msgconv_sections(TEMPLATE, make_sources({}, {"sensor_id": 4}))
+    path = tmp_path / "msgconv.txt"
+    write_msgconv_config(sections, str(path))
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str
+    parser.read(path)
+    assert {section: dict(parser[section]) for section in parser.sections()} == sections
+
+
+def test_only_identity_changes_alter_the_sections():
+    base = msgconv_sections(TEMPLATE, make_sources({}, {}))
+    # Zones and thresholds do not matter to nvmsgconv, removed sources leave their sections
+    assert msgconv_sections(TEMPLATE, make_sources({})).items() <= base.items()
+    renamed = msgconv_sections(TEMPLATE, make_sources({}, {"sensor_str": "dock"}))
+    assert renamed["sensor1"] != base["sensor1"]
+
+
+def test_event_meta_layout_is_checked_against_the_deepstream_version(tmp_path):
+    path = tmp_path / "version"
+    path.write_text("Version: 6.1.1\n")
+    assert deepstream_version(str(path)) == "6.1"
+    check_event_meta_layout(str(path))
+    path.write_text("Version: 6.3\n")
+    with pytest.raises(RuntimeError, match="6.3"):
+        check_event_meta_layout(str(path))
+    with pytest.raises(RuntimeError):
+        check_event_meta_layout(str(tmp_path / "missing"))
@@ -0,0 +1,61 @@
+import threading
+import time
+import urllib.request
+
+from pipeline.metrics import MetricsRegistry, MetricsServer
+
+
+def test_server_listens_on_the_loopback_interface_by_default():
+    registry = MetricsRegistry()
+    registry.counter("events_total", "Events").inc(3)
+    toggles = []
+    server = MetricsServer(registry, 0, toggle=toggles.append)
+    server.start()
+    try:
+        assert server._server.server_address[0] == "127.0.0.1"
+        base = f"http://127.0.0.1:{server.port}"
+        with urllib.request.urlopen(f"{base}/metrics") as response:
+            assert "events_total 3" in response.read().decode()
+        request = urllib.request.Request(f"{base}/instrumentation/enable", method="POST")
+        with urllib.request.urlopen(request) as response:
+            assert response.status == 204
+        assert toggles == [True]
+    finally:
+        server.close()
+
+
+
+class YieldingLabel():
+    """Label value giving the other threads a turn whenever it is hashed,
+    between the read and the write back of an unguarded increment"""
+
+    def __hash__(self) -> int:
+        time.sleep(0)
+        return 0
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, YieldingLabel)
+
+    def __str__(self) -> str:
+        return "0"
+
+
+def test_concurrent_updates_are_not_lost():
+    registry = MetricsRegistry()
+    counter = registry.counter("frames_total", "Frames", ("source",))
+    histogram = registry.histogram("probe_seconds", "Probe time", ("source",))
+    labels = (YieldingLabel(),)
+    threads, increments = 4, 1000
+
+    def update():
+        for _ in range(increments):
+            counter.inc(1, labels)
+            histogram.observe(1e-3, labels)
+
+    workers = [threading.Thread(target=update) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert counter.get(labels) == threads * increments
+    assert histogram.snapshot()["0"]["count"] == threads * increments
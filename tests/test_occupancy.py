@@ -0,0 +1,117 @@
+import pytest
+
+from pipeline.events import EventType
+from pipeline.occupancy import OccupancyTracker
+
+BBOX = (10.0, 20.0, 30.0, 40.0)
+
+
+def see(tracker, now, tracking_id=1, zone=0, source_id=0, frame_num=0):
+    events = []
+    tracker.observe(now, source_id, tracking_id, zone, frame_num, 2, 0.9, BBOX, events)
+    return events
+
+
+def summary(events):
+    return [(event.type, event.source_id, event.tracking_id, event.zone) for event in events]
+
+
+def test_first_sighting_is_an_entry_and_the_next_ones_are_silent():
+    tracker = OccupancyTracker(exit_timeout=2.0)
+    events = see(tracker, 0.0)
+    assert summary(events) == [(EventType.ENTRY, 0, 1, 0)]
+    assert events[0].dwell == 0.0 and events[0].left == 10.0
+    for frame in range(1, 30):
+        assert see(tracker, frame / 30, frame_num=frame) == []
+    assert len(tracker) == 1
+
+
+def test_occupancies_are_keyed_by_source_track_and_zone():
+    tracker = OccupancyTracker()
+    events = (see(tracker, 0.0) + see(tracker, 0.0, tracking_id=2) + see(tracker, 0.0, zone=1)
+              + see(tracker, 0.0, source_id=3) + see(tracker, 0.1))
+    assert summary(events) == [(EventType.ENTRY, 0, 1, 0), (EventType.ENTRY, 0, 2, 0),
+                               (EventType.ENTRY, 0, 1, 1), (EventType.ENTRY, 3, 1, 0)]
+    assert len(tracker) == 4
+
+
+def test_dwell_events_follow_the_interval():
+    tracker = OccupancyTracker(exit_timeout=2.0, dwell_interval=1.0)
+    events = []
+    for step in range(31):
+        events += see(tracker, step * 0.1, frame_num=step)
+    dwells = [event for event in events if event.type is EventType.DWELL]
+    assert [round(event.timestamp, 1) for event in dwells] == [1.0, 2.0, 3.0]
+    assert [round(event.dwell, 1) for event in dwells] == [1.0, 2.0, 3.0]
+
+
+def test_no_dwell_events_by_default():
+    tracker = OccupancyTracker(exit_timeout=2.0)
+    events = []
+    for step in range(100):
+        events += see(tracker, step * 0.1)
+    assert [event.type for event in events] == [EventType.ENTRY]
+
+
+def test_exit_once_the_object_left_for_the_exit_timeout():
+    tracker = OccupancyTracker(exit_timeout=2.0)
+    see(tracker, 0.0, frame_num=0)
+    see(tracker, 1.5, frame_num=45)
+    events = []
+    tracker.expire(3.0, events)
+    assert events == []
+    tracker.expire(3.5, events)
+    assert summary(events) == [(EventType.EXIT, 0, 1, 0)]
+    # The exit reports the last sighting and the time spent inside
+    assert events[0].frame_num == 45 and events[0].dwell == 1.5
+    assert events[0].timestamp == 3.5
+    assert len(tracker) == 0
+
+
+def test_object_back_after_its_exit_enters_again():
+    tracker = OccupancyTracker(exit_timeout=1.0)
+    see(tracker, 0.0)
+    events = []
+    tracker.expire(1.0, events)
+    assert summary(see(tracker, 1.2)) == [(EventType.ENTRY, 0, 1, 0)]
+
+
+def test_only_the_absent_objects_exit():
+    tracker = OccupancyTracker(exit_timeout=1.0)
+    see(tracker, 0.0, tracking_id=1)
+    see(tracker, 0.0, tracking_id=2)
+    for step in range(1, 16):
+        see(tracker, step * 0.1, tracking_id=2)
+    events = []
+    tracker.expire(1.5, events)
+    assert summary(events) == [(EventType.EXIT, 0, 1, 0)]
+    assert len(tracker) == 1
+
+
+def test_least_recently_seen_occupancy_exits_at_the_entry_bound():
+    tracker = OccupancyTracker(exit_timeout=10.0, max_entries=2)
+    see(tracker, 0.0, tracking_id=1)
+    see(tracker, 0.1, tracking_id=2)
+    see(tracker, 0.2, tracking_id=1)
+    events = see(tracker, 0.3, tracking_id=3)
+    assert summary(events) == [(EventType.EXIT, 0, 2, 0), (EventType.ENTRY, 0, 3, 0)]
+    assert len(tracker) == 2
+
+
+def test_flush_exits_the_given_sources_or_everything():
+    tracker = OccupancyTracker()
+    see(tracker, 0.0, source_id=0)
+    see(tracker, 0.0, source_id=1)
+    see(tracker, 0.0, source_id=2)
+    events = []
+    tracker.flush(1.0, events, source_ids={1})
+    assert summary(events) == [(EventType.EXIT, 1, 1, 0)]
+    events = []
+    tracker.flush(1.0, events)
+    assert sorted(summary(events)) == [(EventType.EXIT, 0, 1, 0), (EventType.EXIT, 2, 1, 0)]
+    assert len(tracker) == 0
+
+
+def test_exit_timeout_must_be_positive():
+    with pytest.raises(ValueError):
+        OccupancyTracker(exit_timeout=0.0)
@@ -0,0 +1,41 @@
+import json
+
+from pipeline.config import compile_config
+from pipeline.events import Event, EventType
+from pipeline.payload import CompactEncoder, decode, load_static_metadata
+
+ZONE = [[[0, 0], [100, 0]], [[100, 0], [100, 100]], [[100, 100], [0, 100]], [[0, 100], [0, 0]]]
+
+
+def make_sources(sensor_ids):
+    return compile_config({str(source_id): {"uri": "file:///dev/null", "car_confidence": 0.4,
+                                            "person_confidence": 0.4, "restricted_zones": [ZONE],
+                                            "sensor_id": sensor_id}
+                           for source_id, sensor_id in enumerate(sensor_ids)})
+
+
+def event(source_id):
+    return Event(EventType.ENTRY, source_id, 7, 1, 0, 0, 0.9, (1, 2, 3, 4), 10.0)
+
+
+def test_frames_reference_a_sensor_of_the_static_message():
+    static = load_static_metadata("configs/msgconv_config.txt")
+    for binary in (False, True):
+        encoder = CompactEncoder(static, binary=binary, sources=make_sources([12, 30]))
+        messages = encoder([event(0), event(1)])
+        sensors = decode(messages[0][1])["sensors"]
+        assert [(key, decode(value)["s"]) for key, value in messages[1:]] == [
+            (b"0", 12), (b"1", 30)]
+        assert sensors["sensor12"]["id"] == "sensor-12"
+        assert sensors["sensor30"]["id"] == "sensor-30"
+
+
+def test_static_message_is_sent_again_after_a_config_change():
+    encoder = CompactEncoder(load_static_metadata("configs/msgconv_config.txt"),
+                             sources=make_sources([0]))
+    assert len(encoder([event(0)])) == 2
+    assert len(encoder([event(0)])) == 1
+    encoder.configure(make_sources([0, 5]))
+    messages = encoder([event(1)])
+    assert "sensor5" in json.loads(messages[0][1])["sensors"]
+    assert decode(messages[1][1])["s"] == 5
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+
+from pipeline.events import Event, EventType
+from pipeline.publisher import EventPublisher, MemoryTransport
+
+
+class FailingTransport(MemoryTransport):
+    def send(self, messages):
+        raise ConnectionError("Broker down")
+
+
+class SlowTransport(MemoryTransport):
+    def __init__(self, delay: float) -> None:
+        super().__init__()
+        self.delay = delay
+        self.batches = []
+
+    def send(self, messages):
+        time.sleep(self.delay)
+        self.batches.append(len(messages))
+        super().send(messages)
+
+
+class StuckTransport(MemoryTransport):
+    """Blocks in send until released"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.release = threading.Event()
+        self.sending = threading.Event()
+        self.closed = False
+
+    def send(self, messages):
+        self.sending.set()
+        self.release.wait(10.0)
+        super().send(messages)
+
+    def close(self):
+        self.closed = True
+
+
+def event(tracking_id):
+    return Event(EventType.ENTRY, 0, 0, tracking_id, 0, 0, 0.9, (0, 0, 10, 10), 0.0)
+
+
+def test_full_batch_is_published_without_waiting_for_the_linger():
+    transport = MemoryTransport()
+    publisher = EventPublisher(transport, max_batch=10, linger=30.0)
+    publisher.start()
+    start = time.monotonic()
+    for i in range(10):
+        publisher.submit(event(i))
+    while len(transport.messages) < 10:
+        assert time.monotonic() - start < 5.0
+        time.sleep(0.001)
+    publisher.close()
+    assert time.monotonic() - start < 5.0
+
+
+def test_close_publishes_the_pending_events_without_lingering():
+    transport = MemoryTransport()
+    publisher = EventPublisher(transport, max_batch=100, linger=30.0)
+    publisher.start()
+    for i in range(3):
+        publisher.submit(event(i))
+    start = time.monotonic()
+    publisher.close()
+    assert time.monotonic() - start < 5.0
+    assert len(transport.messages) == 3
+
+
+def test_block_waits_for_room_instead_of_dropping():
+    transport = SlowTransport(0.01)
+    publisher = EventPublisher(transport, max_queue=5, backpressure="block", max_batch=5,
+                               linger=0.001)
+    publisher.start()
+    submitter = threading.Thread(target=lambda: [publisher.submit(event(i)) for i in range(50)])
+    submitter.start()
+    submitter.join(10.0)
+    publisher.close()
+    assert publisher.stats.dropped == 0
+    assert [int(value.split(b'"tracking_id": ')[1].split(b",")[0])
+            for _, value in transport.messages] == list(range(50))
+    assert max(transport.batches) <= 5
+
+
+def test_drop_oldest_keeps_the_newest_events():
+    transport = MemoryTransport()
+    publisher = EventPublisher(transport, max_queue=3)
+    assert [publisher.submit(event(i)) for i in range(5)] == [True, True, True, False, False]
+    publisher.start()
+    publisher.close()
+    assert publisher.stats.dropped == 2 and len(transport.messages) == 3
+
+
+def test_failed_batch_logs_the_lost_events(caplog):
+    publisher = EventPublisher(FailingTransport(), linger=0.001)
+    for i in range(4):
+        publisher.submit(event(i))
+    publisher.submit_message((b"0", b"summary"))
+    with caplog.at_level(logging.ERROR):
+        publisher.start()
+        publisher.close()
+    assert publisher.stats.lost_events == 4
+    assert "4 events and 1 messages lost" in caplog.text
+
+
+def test_close_keeps_the_transport_of_a_worker_still_sending(caplog):
+    transport = StuckTransport()
+    publisher = EventPublisher(transport, max_batch=1, linger=0.001)
+    publisher.start()
+    for i in range(3):
+        publisher.submit(event(i))
+    assert transport.sending.wait(5.0)
+    with caplog.at_level(logging.ERROR):
+        publisher.close(timeout=0.05)
+    assert not transport.closed
+    assert "2 events pending" in caplog.text
+
+    transport.release.set()
+    publisher.close()
+    assert transport.closed
+    assert len(transport.messages) == 3
@@ -0,0 +1,152 @@
+import logging
+import os
+import shutil
+
+import numpy as np
+import pyds
+import pytest
+
+from benchmarks.batch_benchmark import FPS, FRAME_HEIGHT, FRAME_WIDTH, Scene, make_config
+from pipeline.analytics import BatchAnalytics
+from pipeline.config import CLASS_CAR, CLASS_PERSON, compile_config
+from pipeline.control import AnalyticsState
+from pipeline.occupancy import OccupancyTracker
+from pipeline.overlay import ZoneOverlay
+from pipeline.publisher import EventPublisher, MemoryTransport
+from pipeline.recording import DetectionRecorder, iter_chunks, list_chunks, load_chunk
+from pipeline.replay import ReplayStats, replay
+from pipeline.zones import ZoneEngine
+
+EXIT_TIMEOUT = 0.5
+DWELL_INTERVAL = 1.0
+
+
+class Clock():
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def event_key(event):
+    # Confidences and boxes are recorded as float32
+    return (event.type, event.source_id, event.frame_num, event.tracking_id, event.zone,
+            event.class_id, np.float32(event.confidence), np.float32(event.left),
+            np.float32(event.height), round(event.timestamp, 6), round(event.dwell, 6))
+
+
+@pytest.fixture(scope="module")
+def sources():
+    return compile_config(make_config(3, "grid", 4))
+
+
+def run_live(sources, batches, recorder):
+    """Run the probe analytics over the batches, recording them"""
+    clock = Clock()
+    state = AnalyticsState(sources, ZoneEngine(sources, FRAME_WIDTH, FRAME_HEIGHT),
+                           ZoneOverlay(sources, interval=0))
+    occupancy = OccupancyTracker(exit_timeout=EXIT_TIMEOUT, dwell_interval=DWELL_INTERVAL)
+    publisher = EventPublisher(MemoryTransport(), max_queue=len(batches) * 1000)
+    analytics = BatchAnalytics(state, occupancy, publisher, clock, recorder=recorder)
+    events = []
+    for batch in batches:
+        _, batch_events = analytics.process_batch(batch)
+        events.extend(batch_events)
+        clock.now += 1 / FPS
+    occupancy.flush(clock.now - 1 / FPS, events)
+    return events
+
+
+def record(sources, directory, num_batches=300, chunk_size=512, seed=1):
+    scene = Scene(3, 12, {CLASS_CAR: 0.5, CLASS_PERSON: 0.5}, [4.0, 2.0], 0.05, seed)
+    batches = [scene.next_batch() for _ in range(num_batches)]
+    recorder = DetectionRecorder(str(directory), FRAME_WIDTH, FRAME_HEIGHT, chunk_size=chunk_size)
+    events = run_live(sources, batches, recorder)
+    recorder.close()
+    return events, recorder
+
+
+def test_replay_emits_the_live_events(sources, tmp_path):
+    live, recorder = record(sources, tmp_path)
+    assert len(list_chunks(str(tmp_path))) > 2
+    stats = ReplayStats()
+    replayed = list(replay(str(tmp_path), sources, exit_timeout=EXIT_TIMEOUT,
+                           dwell_interval=DWELL_INTERVAL, stats=stats))
+    assert len(live) > 50
+    assert [event_key(event) for event in replayed] == [event_key(event) for event in live]
+    assert stats.batches == 300 and stats.frames == recorder.frames == 900
+    assert stats.detections == recorder.detections
+    assert stats.recorded_seconds == pytest.approx(299 / FPS)
+
+
+def test_chunks_hold_whole_batches_with_consistent_offsets(sources, tmp_path):
+    record(sources, tmp_path, chunk_size=100)
+    batches = []
+    for frames, detections in iter_chunks(str(tmp_path)):
+        batches.append(frames["batch"].tolist())
+        counts, firsts = frames["count"].tolist(), frames["first"].tolist()
+        assert firsts[0] == 0
+        assert [a + n for a, n in zip(firsts, counts)][:-1] == firsts[1:]
+        for first, count, source_id in zip(firsts, counts, frames["source_id"].tolist()):
+            assert set(detections["source_id"][first:first + count].tolist()) <= {source_id}
+    # Every batch is in exactly one chunk, in order
+    flat = [batch for chunk in batches for batch in chunk]
+    assert flat == sorted(flat)
+    assert len({chunk[-1] for chunk in batches}) == len(batches)
+    assert sorted(set(flat)) == list(range(300))
+
+
+def test_truncated_chunk_is_skipped(sources, tmp_path, caplog):
+    recording = tmp_path / "recording"
+    record(sources, recording)
+    chunks = list_chunks(str(recording))
+    # Same recording without its second chunk, the expected replay
+    reference = tmp_path / "reference"
+    shutil.copytree(recording, reference)
+    shutil.rmtree(reference / chunks[1])
+
+    column = recording / chunks[1] / "detections.left.npy"
+    with open(column, "r+b") as file:
+        file.truncate(os.path.getsize(column) // 2)
+    with caplog.at_level(logging.WARNING):
+        replayed = list(replay(str(recording), sources, exit_timeout=EXIT_TIMEOUT))
+    assert f"Skipping chunk {chunks[1]}" in caplog.text
+    expected = list(replay(str(reference), sources, exit_timeout=EXIT_TIMEOUT))
+    assert [event_key(event) for event in replayed] == [event_key(event) for event in expected]
+
+
+def test_chunk_with_a_missing_or_short_column_is_rejected(sources, tmp_path):
+    record(sources, tmp_path)
+    first, second = list_chunks(str(tmp_path))[:2]
+    os.remove(tmp_path / first / "frames.count.npy")
+    with pytest.raises(OSError):
+        load_chunk(str(tmp_path / first))
+    # A column of another chunk has another length
+    shutil.copy(tmp_path / list_chunks(str(tmp_path))[-1] / "detections.top.npy",
+                tmp_path / second / "detections.top.npy")
+    with pytest.raises(ValueError):
+        load_chunk(str(tmp_path / second))
+    assert len(list(iter_chunks(str(tmp_path)))) == len(list_chunks(str(tmp_path))) - 2
+
+
+def test_unfinished_chunk_is_not_read_and_the_recording_goes_on(sources, tmp_path):
+    record(sources, tmp_path, num_batches=100)
+    chunks = list_chunks(str(tmp_path))
+    # A chunk being written when the process died
+    shutil.copytree(tmp_path / chunks[0], tmp_path / ".chunk-999999")
+    assert list_chunks(str(tmp_path)) == chunks
+    # The last chunk got truncated, the next recording numbers its chunks
+    # and batches after the previous ones
+    column = tmp_path / chunks[-1] / "frames.batch.npy"
+    with open(column, "r+b") as file:
+        file.truncate(64)
+    last_readable = load_chunk(str(tmp_path / chunks[-2]))[0]["batch"][-1]
+    recorder = DetectionRecorder(str(tmp_path), FRAME_WIDTH, FRAME_HEIGHT, chunk_size=512)
+    recorder.record(10.0, {0: pyds.NvDsFrameMeta(0, 7, [])}, [], [], [])
+    recorder.close()
+    new_chunks = list_chunks(str(tmp_path))
+    assert new_chunks == chunks + [f"chunk-{len(chunks):06d}"]
+    frames, _ = load_chunk(str(tmp_path / new_chunks[-1]))
+    assert frames["batch"].tolist() == [last_readable + 1]
+    assert frames["frame_num"].tolist() == [7]
@@ -0,0 +1,78 @@
+import configparser
+
+from pipeline.config import compile_config
+from pipeline.roi import Roi, merge_rois, source_rois, write_preprocess_config, zone_rois
+
+
+def square(left, top, size):
+    points = [[left, top], [left + size, top], [left + size, top + size], [left, top + size]]
+    return [[points[i], points[(i + 1) % 4]] for i in range(4)]
+
+
+def make_sources(zones_by_source):
+    return compile_config({
+        str(source_id): {"uri": "file:///dev/null", "car_confidence": 0.4,
+                         "person_confidence": 0.4, "restricted_zones": zones}
+        for source_id, zones in zones_by_source.items()
+    })
+
+
+def test_zone_roi_is_padded_and_extended_upwards():
+    sources = make_sources({0: [square(400, 400, 100)]})
+    rois = zone_rois(sources[0], 1920, 1080, padding=16, object_height=200)
+    assert rois == [Roi(384, 184, 132, 332)]
+
+
+def test_zone_roi_is_clamped_to_the_frame():
+    sources = make_sources({0: [square(0, 50, 100), square(1850, 1000, 70)]})
+    rois = zone_rois(sources[0], 1920, 1080, padding=16, object_height=200)
+    for roi in rois:
+        assert roi.left >= 0 and roi.top >= 0
+        assert roi.right <= 1920 and roi.bottom <= 1080
+    assert Roi(0, 0, 116, 166) in rois
+    assert Roi(1834, 784, 86, 296) in rois
+
+
+def test_zone_roi_is_aligned_outwards():
+    sources = make_sources({0: [square(401, 401, 101)]})
+    (roi,) = zone_rois(sources[0], 1920, 1080, padding=0, object_height=0, align=4)
+    assert roi.params() == (400, 400, 104, 104)
+
+
+def test_overlapping_rois_are_merged():
+    merged = merge_rois([Roi(0, 0, 100, 100), Roi(50, 50, 100, 100), Roi(500, 0, 10, 10)])
+    assert merged == [Roi(0, 0, 150, 150), Roi(500, 0, 10, 10)]
+
+
+def test_rois_merged_transitively():
+    # The third region only overlaps the union of the first two
+    merged = merge_rois([Roi(0, 0, 10, 10), Roi(100, 0, 10, 10), Roi(5, 5, 100, 2)])
+    assert merged == [Roi(0, 0, 110, 10)]
+
+
+def test_too_many_rois_collapse_to_their_bounds():
+    zones = [square(200 * i, 600, 50) for i in range(6)]
+    sources = make_sources({0: zones})
+    rois = zone_rois(sources[0], 1920, 1080, padding=0, object_height=0, max_rois=4)
+    assert rois == [Roi(0, 600, 1050, 50)]
+
+
+def test_source_rois_covers_every_active_source():
+    sources = make_sources({0: [square(100, 300, 50)], 2: []})
+    rois = dict(source_rois(sources, 1920, 1080, padding=0, object_height=100))
+    assert rois == {0: [Roi(100, 200, 50, 150)], 2: []}
+
+
+def test_preprocess_config_skips_sources_without_zones(tmp_path):
+    template = tmp_path / "template.txt"
+    template.write_text("[property]\nnetwork-input-shape=1;3;368;640\n\n[user-configs]\n")
+    output = tmp_path / "preprocess.txt"
+    rois = [(0, [Roi(0, 0, 100, 100), Roi(200, 0, 10, 10)]), (1, [])]
+    assert write_preprocess_config(str(template), rois, str(output), gpu_id=1) == 2
+
+    config = configparser.ConfigParser()
+    config.read(output)
+    assert config["property"]["network-input-shape"] == "2;3;368;640"
+    assert config["group-0"]["src-ids"] == "0"
+    assert config["group-0"]["roi-params-src-0"] == "0;0;100;100;200;0;10;10"
+    assert "roi-params-src-1" not in config["group-0"]
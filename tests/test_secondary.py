@@ -0,0 +1,175 @@
+import threading
+
+import pyds
+import pytest
+
+from pipeline.config import compile_config
+from pipeline.control import AnalyticsState
+from pipeline.analytics import BatchAnalytics
+from pipeline.events import EventType
+from pipeline.occupancy import OccupancyTracker
+from pipeline.overlay import ZoneOverlay
+from pipeline.publisher import EventPublisher, MemoryTransport
+from pipeline.secondary import GATE_COMPONENT_ID, PRIMARY_COMPONENT_ID, AttributeCache, \
+    SecondaryClassifier, SecondaryGate, read_class_ids
+from pipeline.zones import ZoneEngine
+
+CAR, PERSON = 0, 2
+ZONE = [[[0, 0], [500, 0]], [[500, 0], [500, 500]], [[500, 500], [0, 500]], [[0, 500], [0, 0]]]
+
+
+class Clock():
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def sources():
+    return compile_config({"0": {"uri": "file:///dev/null", "car_confidence": 0.4,
+                                 "person_confidence": 0.4, "restricted_zones": [ZONE]}})
+
+
+def obj(class_id, object_id, left, top, confidence=0.9):
+    return pyds.NvDsObjectMeta(class_id, confidence, object_id,
+                               pyds.NvOSD_RectParams(left, top, 40, 40))
+
+
+def batch(objects, source_id=0):
+    return pyds.NvDsBatchMeta([pyds.NvDsFrameMeta(source_id, 0, objects)])
+
+
+def classify(objects, unique_id, label):
+    """What the secondary nvinfer does to the objects handed over"""
+    for obj_meta in objects:
+        if obj_meta.unique_component_id == GATE_COMPONENT_ID:
+            obj_meta.classifier_meta_list = pyds.glist(
+                [pyds.NvDsClassifierMeta(unique_id, [pyds.NvDsLabelInfo(0, label, 0.9)])])
+
+
+def make_gate(clock, ttl=30.0, retry=1.0):
+    classifier = SecondaryClassifier("vehicle_type", "unused.txt", 2, class_ids=frozenset({CAR}))
+    return SecondaryGate([classifier], AttributeCache(ttl=ttl, retry=retry), clock)
+
+
+def test_read_class_ids(tmp_path):
+    config = tmp_path / "sgie.txt"
+    config.write_text("[property]\noperate-on-class-ids=0;2;\n")
+    assert read_class_ids(str(config)) == frozenset({0, 2})
+    config.write_text("[property]\ngpu-id=0\n")
+    assert read_class_ids(str(config)) is None
+
+
+def test_parse_classifiers_assigns_ids_after_the_primary(tmp_path):
+    config = tmp_path / "sgie.txt"
+    config.write_text("[property]\noperate-on-class-ids=0\n")
+    classifiers = SecondaryClassifier.parse_all([f"type={config}", f"color={config}"])
+    assert [(c.name, c.unique_id) for c in classifiers] == [("type", 2), ("color", 3)]
+    with pytest.raises(ValueError):
+        SecondaryClassifier.parse_all([f"type={config}", f"type={config}"])
+
+
+def test_gate_only_hands_over_gated_classes_inside_zones(sources):
+    gate = make_gate(Clock())
+    objects = [obj(CAR, 1, 100, 100), obj(PERSON, 2, 100, 100), obj(CAR, 3, 1000, 800),
+               obj(CAR, 4, 100, 100, confidence=0.1)]
+    assert gate.gate(batch(objects), ZoneEngine(sources)) == 1
+    assert [o.unique_component_id for o in objects] == [GATE_COMPONENT_ID] + \
+        [PRIMARY_COMPONENT_ID] * 3
+
+
+def test_classified_track_is_not_handed_over_until_expiry(sources):
+    clock = Clock()
+    gate = make_gate(clock, ttl=10.0)
+    engine = ZoneEngine(sources)
+
+    car = obj(CAR, 1, 100, 100)
+    assert gate.gate(batch([car]), engine) == 1
+    classify([car], 2, "sedan")
+    gate.collect(car, 0)
+    assert car.unique_component_id == PRIMARY_COMPONENT_ID
+    assert gate.attributes(0, 1) == {"vehicle_type": "sedan"}
+
+    for clock.now in (1.0, 5.0, 9.5):
+        assert gate.gate(batch([obj(CAR, 1, 100, 100)]), engine) == 0
+    clock.now = 10.0
+    assert gate.gate(batch([obj(CAR, 1, 100, 100)]), engine) == 1
+
+
+def test_pending_track_is_not_handed_over_twice(sources):
+    clock = Clock()
+    gate = make_gate(clock)
+    engine = ZoneEngine(sources)
+    assert gate.gate(batch([obj(CAR, 1, 100, 100)]), engine) == 1
+    # The next frame reaches the gate before the first one was collected
+    assert gate.gate(batch([obj(CAR, 1, 100, 100)]), engine) == 0
+
+
+def test_unlabeled_track_is_retried_after_retry():
+    cache = AttributeCache(ttl=30.0, retry=1.0)
+    cache.put((0, 1), {"vehicle_type": "sedan"}, 0.0)
+    cache.put((0, 2), {}, 1.0)
+    cache.expire(2.5)
+    assert (0, 2) not in cache
+    assert cache.get((0, 1)) == {"vehicle_type": "sedan"}
+    cache.expire(30.0)
+    assert len(cache) == 0
+
+
+def test_cache_merges_and_extends_labels():
+    cache = AttributeCache(ttl=10.0, retry=1.0)
+    cache.put((0, 1), {}, 0.0)
+    cache.put((0, 1), {"color": "red"}, 0.5)
+    cache.put((0, 1), {"vehicle_type": "suv"}, 5.0)
+    # The stale expiries of the earlier puts do not drop the entry
+    cache.expire(12.0)
+    assert cache.get((0, 1)) == {"color": "red", "vehicle_type": "suv"}
+    cache.expire(15.0)
+    assert cache.get((0, 1)) is None
+
+
+def test_cache_evicts_the_first_to_expire():
+    cache = AttributeCache(ttl=10.0, retry=1.0, max_entries=2)
+    cache.put((0, 1), {"color": "red"}, 0.0)
+    cache.put((0, 2), {}, 0.0)
+    cache.put((0, 3), {"color": "blue"}, 0.0)
+    assert (0, 2) not in cache
+    assert (0, 1) in cache and (0, 3) in cache
+
+
+def test_cache_is_safe_across_threads():
+    cache = AttributeCache(ttl=0.5, retry=0.1, max_entries=1000)
+
+    def writer(offset):
+        for i in range(20000):
+            cache.put((offset, i % 3000), {"color": "red"} if i % 2 else {}, i / 1000)
+            cache.expire(i / 1000)
+
+    threads = [threading.Thread(target=writer, args=(offset,)) for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache) <= 1000
+
+
+def test_events_carry_the_track_attributes(sources):
+    clock = Clock()
+    gate = make_gate(clock)
+    engine = ZoneEngine(sources)
+    state = AnalyticsState(sources, engine, ZoneOverlay(sources, interval=0))
+    analytics = BatchAnalytics(state, OccupancyTracker(), EventPublisher(MemoryTransport()),
+                               clock, secondary=gate)
+
+    objects = [obj(CAR, 1, 100, 100), obj(PERSON, 2, 100, 100)]
+    gate.gate(batch(objects), engine)
+    classify(objects, 2, "sedan")
+    _, events = analytics.process_batch(batch(objects))
+
+    assert {(e.type, e.tracking_id): e.attributes for e in events} == {
+        (EventType.ENTRY, 1): {"vehicle_type": "sedan"},
+        (EventType.ENTRY, 2): None,
+    }
+    assert all(o.unique_component_id == PRIMARY_COMPONENT_ID for o in objects)
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from pipeline.sharding import partition_sources
+from supervisor import worker_command
+
+ZONE = [[[0, 0], [100, 0]], [[100, 0], [100, 100]], [[100, 100], [0, 100]], [[0, 100], [0, 0]]]
+
+
+def make_config(loads):
+    return {str(i): {"uri": f"rtsp://camera-{i}", "car_confidence": 0.4,
+                     "person_confidence": 0.4, "restricted_zones": [ZONE],
+                     "expected_load": load}
+            for i, load in enumerate(loads)}
+
+
+def test_count_deals_the_sources_round_robin_keeping_their_ids():
+    shards = partition_sources(make_config([1.0] * 5), 2, "count", [0, 1])
+    assert [sorted(shard.config, key=int) for shard in shards] == [["0", "2", "4"], ["1", "3"]]
+    assert [shard.gpu_id for shard in shards] == [0, 1]
+    assert [shard.batch_size for shard in shards] == [3, 2]
+
+
+def test_load_balances_the_expected_load():
+    shards = partition_sources(make_config([4.0, 1.0, 1.0, 1.0, 1.0]), 2, "load")
+    assert sorted(shard.load for shard in shards) == [4.0, 4.0]
+
+
+def test_gpu_groups_the_sources_by_gpu_id():
+    config = make_config([1.0] * 3)
+    config["1"]["gpu_id"] = 1
+    shards = partition_sources(config, 8, "gpu")
+    assert [(shard.gpu_id, sorted(shard.config)) for shard in shards] == [
+        (0, ["0", "2"]), (1, ["1"])]
+
+
+def test_invalid_partitions_are_rejected():
+    with pytest.raises(ValueError):
+        partition_sources(make_config([1.0]), 0)
+    with pytest.raises(ValueError):
+        partition_sources(make_config([1.0]), 1, "random")
+
+
+def test_worker_command_does_not_depend_on_the_working_directory():
+    shard = partition_sources(make_config([1.0] * 2), 1)[0]
+    command = worker_command(shard, "shard-0.json", 9100, ["--no_display"])
+    assert os.path.isabs(command[1]) and os.path.isfile(command[1])
+    assert command[2:] == ["--config_path", "shard-0.json", "--gpu_id", "0", "--batch_size", "2",
+                           "--metrics_port", "9100", "--no_display"]
@@ -0,0 +1,55 @@
+import threading
+
+import numpy as np
+
+from pipeline import snapshots
+from pipeline.events import Event, EventType
+from pipeline.snapshots import SnapshotPool, SnapshotStore
+
+FRAME = np.full((200, 200, 4), 128, dtype=np.uint8)
+
+
+def event(type, tracking_id, timestamp):
+    return Event(type, 0, 0, tracking_id, 0, 0, 0.9, (50, 50, 40, 40), timestamp)
+
+
+def test_later_events_of_a_track_wait_for_its_snapshot(tmp_path, monkeypatch):
+    release = threading.Event()
+    encode = snapshots.encode_snapshot
+
+    def slow_encode(*args):
+        release.wait(5)
+        return encode(*args)
+
+    monkeypatch.setattr(snapshots, "encode_snapshot", slow_encode)
+    published = []
+    pool = SnapshotPool(SnapshotStore(str(tmp_path)), published.append, min_interval=0)
+
+    entry = event(EventType.ENTRY, 1, 0.0)
+    assert pool.submit(entry, lambda: FRAME)
+    # Exits are never snapshotted, the frame of the source may be missing
+    assert pool.submit(event(EventType.EXIT, 1, 1.0), None)
+    # Other tracks are not held back
+    assert not pool.submit(event(EventType.EXIT, 2, 1.0), None)
+    assert published == []
+
+    release.set()
+    pool.close()
+    assert [(e.type, e.timestamp) for e in published] == [(EventType.ENTRY, 0.0),
+                                                          (EventType.EXIT, 1.0)]
+    assert published[0].snapshot is not None
+    assert pool.stats.deferred == 1
+    # Nothing pending, the next events are published by the caller
+    assert not pool.submit(event(EventType.EXIT, 1, 2.0), None)
+
+
+def test_events_without_snapshot_are_left_to_the_caller(tmp_path):
+    published = []
+    pool = SnapshotPool(SnapshotStore(str(tmp_path)), published.append, min_interval=10.0,
+                        clock=lambda: 0.0)
+    assert not pool.submit(event(EventType.ENTRY, 1, 0.0), None)
+    assert pool.submit(event(EventType.ENTRY, 1, 0.0), lambda: FRAME)
+    pool.close()
+    assert not pool.submit(event(EventType.DWELL, 1, 1.0), lambda: FRAME)
+    assert pool.stats.rate_limited == 1
+    assert len(published) == 1
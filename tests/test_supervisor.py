@@ -0,0 +1,194 @@
+import subprocess
+import sys
+
+import pytest
+
+from pipeline.backoff import Backoff
+from pipeline.sharding import partition_sources
+from pipeline.supervisor import Supervisor, add_label, merge_expositions
+
+ZONE = [[[0, 0], [100, 0]], [[100, 0], [100, 100]], [[100, 100], [0, 100]], [[0, 100], [0, 0]]]
+CONFIG = {str(i): {"uri": f"rtsp://camera-{i}", "car_confidence": 0.4, "person_confidence": 0.4,
+                   "restricted_zones": [ZONE]}
+          for i in range(4)}
+
+
+class FakeClock():
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeProcess():
+    """Stand-in worker process, exits when told to"""
+
+    def __init__(self, command) -> None:
+        self.command = command
+        self.returncode = None
+        self.terminated = False
+        self.killed = False
+        # Keeps running after terminate, like a worker stuck in teardown
+        self.ignore_terminate = False
+
+    def exit(self, code: int) -> None:
+        self.returncode = code
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self) -> None:
+        self.terminated = True
+        if not self.ignore_terminate:
+            self.returncode = -15
+
+    def kill(self) -> None:
+        self.killed = True
+        self.returncode = -9
+
+    def wait(self, timeout=None):
+        if self.returncode is None:
+            raise subprocess.TimeoutExpired(self.command, timeout)
+        return self.returncode
+
+
+def make_supervisor(tmp_path, **kwargs):
+    clock = FakeClock()
+    spawned = []
+
+    def spawn(command):
+        spawned.append(FakeProcess(command))
+        return spawned[-1]
+
+    shards = partition_sources(CONFIG, 2)
+    supervisor = Supervisor(shards, lambda shard, path, port: ["worker", path, str(port)],
+                            str(tmp_path), metrics_base_port=9100, spawn=spawn, clock=clock,
+                            backoff_factory=lambda: Backoff(1.0, 8.0, reset_after=30.0),
+                            **kwargs)
+    return supervisor, clock, spawned
+
+
+def advance(supervisor, clock, seconds, step=0.5):
+    end = clock.now + seconds
+    while clock.now < end:
+        clock.now = min(clock.now + step, end)
+        supervisor.poll()
+
+
+def test_one_worker_per_shard_with_its_config_and_port(tmp_path):
+    supervisor, _, spawned = make_supervisor(tmp_path)
+    supervisor.start()
+    assert [process.command for process in spawned] == [
+        ["worker", str(tmp_path / "shard_0.json"), "9100"],
+        ["worker", str(tmp_path / "shard_1.json"), "9101"]]
+    assert (tmp_path / "shard_1.json").is_file()
+    assert all(state["running"] for state in supervisor.health().values())
+
+
+def test_crashed_worker_is_restarted_with_backoff(tmp_path):
+    supervisor, clock, spawned = make_supervisor(tmp_path)
+    supervisor.start()
+    restarts = []
+    for _ in range(3):
+        crashed = spawned[-1] if len(spawned) > 2 else spawned[0]
+        crashed.exit(1)
+        count = len(spawned)
+        supervisor.poll()
+        down = clock.now
+        while len(spawned) == count:
+            advance(supervisor, clock, 0.5)
+        restarts.append(clock.now - down)
+    assert restarts == [1.0, 2.0, 4.0]
+    health = supervisor.health()
+    assert health["0"]["restarts"] == 3 and health["0"]["last_exit_code"] == 1
+    assert health["1"]["restarts"] == 0 and health["1"]["running"]
+    assert "supervisor_worker_restarts_total{shard=\"0\"} 3" in supervisor.registry.render()
+
+
+def test_backoff_starts_over_after_a_long_run(tmp_path):
+    supervisor, clock, spawned = make_supervisor(tmp_path)
+    supervisor.start()
+    spawned[0].exit(1)
+    supervisor.poll()
+    advance(supervisor, clock, 1.0)
+    advance(supervisor, clock, 40.0)
+    spawned[2].exit(1)
+    supervisor.poll()
+    advance(supervisor, clock, 1.0)
+    assert len(spawned) == 4
+
+
+def test_worker_is_given_up_after_repeated_failures(tmp_path):
+    supervisor, clock, spawned = make_supervisor(tmp_path, max_failures=2)
+    supervisor.start()
+    spawned[0].exit(1)
+    supervisor.poll()
+    advance(supervisor, clock, 1.0)
+    spawned[2].exit(1)
+    advance(supervisor, clock, 60.0)
+    assert len(spawned) == 3
+    health = supervisor.health()
+    assert health["0"]["failed"] and not health["0"]["running"]
+    assert not supervisor.failed
+    spawned[1].exit(1)
+    supervisor.poll()
+    advance(supervisor, clock, 1.0)
+    spawned[3].exit(1)
+    supervisor.poll()
+    assert supervisor.failed
+
+
+def test_run_returns_once_every_worker_is_given_up(tmp_path):
+    supervisor, clock, spawned = make_supervisor(tmp_path, max_failures=1)
+    supervisor.start()
+    for process in spawned:
+        process.exit(1)
+    supervisor.start = lambda: None
+    supervisor.run(poll_interval=0.0, should_stop=lambda: False)
+    assert supervisor.failed
+
+
+def test_stop_terminates_the_workers_and_kills_stuck_ones(tmp_path):
+    supervisor, clock, spawned = make_supervisor(tmp_path)
+    supervisor.start()
+    spawned[1].ignore_terminate = True
+    supervisor.stop(timeout=0.0)
+    assert [process.terminated for process in spawned] == [True, True]
+    assert [process.killed for process in spawned] == [False, True]
+    # Workers that exit while stopping are not restarted
+    advance(supervisor, clock, 60.0)
+    assert len(spawned) == 2
+    assert not any(state["running"] for state in supervisor.health().values())
+
+
+def test_stop_reaches_real_worker_processes(tmp_path):
+    shards = partition_sources(CONFIG, 2)
+    command = [sys.executable, "-c", "import time; time.sleep(60)"]
+    supervisor = Supervisor(shards, lambda shard, path, port: command, str(tmp_path))
+    supervisor.start()
+    processes = [worker.process for worker in supervisor.workers]
+    try:
+        supervisor.poll()
+        assert all(worker.running for worker in supervisor.workers)
+        supervisor.stop(timeout=5.0)
+        assert all(process.poll() is not None for process in processes)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+
+
+def test_negative_failure_limit_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        make_supervisor(tmp_path, max_failures=-1)
+
+
+def test_worker_metrics_are_merged_by_family():
+    first = add_label("# HELP events_total Events\n# TYPE events_total counter\n"
+                      "events_total{sink=\"kafka\"} 3\n", "shard", "0")
+    second = add_label("# HELP events_total Events\n# TYPE events_total counter\n"
+                       "events_total 5\n", "shard", "1")
+    assert merge_expositions([first, second]).splitlines() == [
+        "# HELP events_total Events", "# TYPE events_total counter",
+        "events_total{shard=\"0\",sink=\"kafka\"} 3", "events_total{shard=\"1\"} 5"]
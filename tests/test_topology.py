@@ -0,0 +1,124 @@
+import itertools
+
+import pytest
+
+from pipeline.topology import ElementFactory, build_graph, load_profiles
+
+PROFILES = load_profiles("configs/topology.json")
+# Elements ending the graph
+SINKS = {"nveglglessink", "fakesink", "filesink", "udpsink", "nvmsgbroker"}
+# Linked by the pipeline through the secondary classifiers
+EXTERNAL_LINKS = {("secondary-entry", "secondary-exit")}
+
+
+class FakeElement():
+    def __init__(self, factory_name: str, name: str) -> None:
+        self.factory_name = factory_name
+        self.name = name
+        self.properties = {}
+
+    def set_property(self, key, value) -> None:
+        self.properties[key] = value
+
+
+class FakeFactory(ElementFactory):
+    def __init__(self) -> None:
+        self.links = []
+
+    def make(self, factory_name, name):
+        return FakeElement(factory_name, name)
+
+    def caps(self, caps):
+        return f"caps({caps})"
+
+    def link(self, src, dst, request_pad):
+        assert request_pad == (src.factory_name == "tee")
+        self.links.append((src.name, dst.name))
+        return True
+
+
+class FakeContainer():
+    def __init__(self) -> None:
+        self.elements = []
+
+    def add(self, element) -> None:
+        self.elements.append(element)
+
+
+def flag_combinations():
+    """Every combination main.py and the pipeline accept"""
+    for sink, aarch64, tracker, roi, snapshot, secondary, rtsp in itertools.product(
+            ("msgbroker", "async"), *[(False, True)] * 6):
+        if snapshot and sink != "async":
+            continue
+        if secondary and not tracker:
+            continue
+        flags = {sink}
+        for flag, enabled in (("aarch64", aarch64), ("tracker", tracker), ("roi", roi),
+                              ("snapshot", snapshot), ("secondary", secondary), ("rtsp", rtsp)):
+            if enabled:
+                flags.add(flag)
+        yield frozenset(flags)
+
+
+def test_factory_must_implement_every_method():
+    with pytest.raises(TypeError):
+        ElementFactory()
+
+    class Partial(ElementFactory):
+        def make(self, factory_name, name):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+@pytest.mark.parametrize("profile_name", sorted(PROFILES))
+def test_every_profile_builds_a_chain_with_every_flag_combination(profile_name):
+    profile = PROFILES[profile_name]
+    for flags in flag_combinations():
+        factory = FakeFactory()
+        container = FakeContainer()
+        graph = build_graph(profile, factory, container, flags)
+        elements = graph.elements
+        assert [element.name for element in container.elements] == list(elements)
+
+        links = factory.links + [link for link in EXTERNAL_LINKS
+                                 if link[0] in elements and link[1] in elements]
+        upstream = {}
+        downstream = {}
+        for src, dst in links:
+            upstream.setdefault(dst, []).append(src)
+            downstream.setdefault(src, []).append(dst)
+        for name, element in elements.items():
+            context = f"{profile_name} {sorted(flags)} {name}"
+            if name == "stream-muxer":
+                assert name not in upstream, context
+            else:
+                assert len(upstream.get(name, ())) == 1, context
+            if element.factory_name in SINKS:
+                assert name not in downstream, context
+            elif element.factory_name == "tee":
+                assert len(downstream.get(name, ())) >= 1, context
+            else:
+                assert len(downstream.get(name, ())) == 1, context
+
+        assert graph.probe_element in elements
+        assert ("secondary-entry" in elements) == ("secondary" in flags)
+        assert ("preprocess" in elements) == ("roi" in flags)
+        assert all(elements[name].factory_name == "queue" for name in graph.branches)
+        caps = [value for element in elements.values()
+                for key, value in element.properties.items() if key == "caps"]
+        assert all(value.startswith("caps(") for value in caps)
+
+
+def test_encode_profile_serves_rtsp_instead_of_writing_a_file():
+    profile = PROFILES["encode"]
+    for rtsp, present, absent in ((False, "file-sink", "rtsp-sink"),
+                                  (True, "rtsp-sink", "file-sink")):
+        factory = FakeFactory()
+        flags = {"msgbroker", "tracker"} | ({"rtsp"} if rtsp else set())
+        elements = build_graph(profile, factory, FakeContainer(), flags).elements
+        assert present in elements and absent not in elements
+    assert ("encoder", "rtsp-payloader") in factory.links
+    assert elements["rtsp-sink"].properties["port"] == 5400
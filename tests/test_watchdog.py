@@ -0,0 +1,149 @@
+import pytest
+
+from pipeline.metrics import MetricsRegistry
+from pipeline.watchdog import SourceState, SourceWatchdog
+
+
+class FakeClock():
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeBins():
+    """Records the teardowns and restarts asked by the watchdog"""
+
+    def __init__(self) -> None:
+        self.calls = []
+
+    def teardown(self, source_id: int) -> None:
+        self.calls.append(("teardown", source_id))
+
+    def restart(self, source_id: int) -> None:
+        self.calls.append(("restart", source_id))
+
+
+def make_watchdog(**kwargs):
+    clock = FakeClock()
+    bins = FakeBins()
+    registry = MetricsRegistry()
+    watchdog = SourceWatchdog(bins.teardown, bins.restart, stale_timeout=5.0,
+                              startup_timeout=10.0, initial_backoff=1.0, max_backoff=4.0,
+                              clock=clock, registry=registry, **kwargs)
+    return watchdog, clock, bins, registry
+
+
+def advance(watchdog, clock, seconds, step=0.5, sources=()):
+    """Move the clock on, the sources sending a buffer at every step"""
+    end = clock.now + seconds
+    while clock.now < end:
+        clock.now = min(clock.now + step, end)
+        for source_id in sources:
+            watchdog.buffer(source_id)
+        watchdog.check()
+
+
+def test_source_is_up_on_its_first_buffer():
+    watchdog, clock, bins, registry = make_watchdog()
+    watchdog.add(0)
+    assert watchdog.state(0) is SourceState.STARTING
+    advance(watchdog, clock, 1.0, sources=(0,))
+    assert watchdog.state(0) is SourceState.UP
+    assert registry.snapshot()["pipeline_source_up"] == {"0": 1}
+    assert bins.calls == []
+
+
+def test_stalled_source_is_torn_down_alone():
+    watchdog, clock, bins, registry = make_watchdog()
+    watchdog.add(0)
+    watchdog.add(1)
+    advance(watchdog, clock, 1.0, sources=(0, 1))
+    # Source 1 stops sending, source 0 keeps going
+    advance(watchdog, clock, 5.0, sources=(0,))
+    assert watchdog.state(1) is SourceState.UP
+    advance(watchdog, clock, 0.5, sources=(0,))
+    assert watchdog.state(1) is SourceState.DOWN
+    assert watchdog.state(0) is SourceState.UP
+    assert bins.calls == [("teardown", 1)]
+    assert registry.snapshot()["pipeline_source_down_total"] == {"1": 1}
+
+
+def test_restarts_back_off_exponentially():
+    watchdog, clock, bins, registry = make_watchdog()
+    watchdog.add(0)
+    restarts = []
+    for _ in range(4):
+        watchdog.error(0)
+        down = clock.now
+        while ("restart", 0) not in bins.calls:
+            advance(watchdog, clock, 0.25, step=0.25)
+        restarts.append(clock.now - down)
+        bins.calls.clear()
+    assert restarts == [1.0, 2.0, 4.0, 4.0]
+    assert watchdog.state(0) is SourceState.RECONNECTING
+    assert watchdog.stats()[0] == {"state": "reconnecting", "reconnects": 4, "failures": 4}
+    assert registry.snapshot()["pipeline_source_reconnects_total"] == {"0": 4}
+
+
+def test_restarted_source_without_frames_goes_down_again():
+    watchdog, clock, bins, _ = make_watchdog()
+    watchdog.add(0)
+    watchdog.error(0)
+    advance(watchdog, clock, 1.0)
+    assert watchdog.state(0) is SourceState.RECONNECTING
+    advance(watchdog, clock, 10.5)
+    assert watchdog.state(0) is SourceState.DOWN
+    assert bins.calls == [("teardown", 0), ("restart", 0), ("teardown", 0)]
+
+
+def test_reconnected_source_recovers_and_resets_its_backoff():
+    watchdog, clock, bins, registry = make_watchdog()
+    watchdog.add(0)
+    watchdog.error(0)
+    watchdog.error(0)
+    advance(watchdog, clock, 1.0)
+    assert watchdog.state(0) is SourceState.RECONNECTING
+    advance(watchdog, clock, 1.0, sources=(0,))
+    assert watchdog.state(0) is SourceState.UP
+    assert registry.snapshot()["pipeline_source_up"] == {"0": 1}
+    # Up for longer than the stale timeout, the next failure starts over
+    advance(watchdog, clock, 6.0, sources=(0,))
+    bins.calls.clear()
+    watchdog.error(0)
+    advance(watchdog, clock, 1.0)
+    assert bins.calls == [("teardown", 0), ("restart", 0)]
+
+
+def test_source_is_given_up_after_repeated_failures():
+    watchdog, clock, bins, _ = make_watchdog(max_failures=3)
+    watchdog.add(0)
+    for _ in range(2):
+        watchdog.error(0)
+        advance(watchdog, clock, 4.0)
+        assert watchdog.state(0) is SourceState.RECONNECTING
+    watchdog.error(0)
+    assert watchdog.state(0) is SourceState.FAILED
+    bins.calls.clear()
+    advance(watchdog, clock, 60.0)
+    watchdog.error(0)
+    assert watchdog.state(0) is SourceState.FAILED
+    assert bins.calls == []
+    assert watchdog.stats()[0]["failures"] == 3
+
+
+def test_removed_source_is_no_longer_watched():
+    watchdog, clock, bins, _ = make_watchdog()
+    watchdog.add(0)
+    watchdog.remove(0)
+    advance(watchdog, clock, 30.0)
+    assert watchdog.state(0) is None
+    assert bins.calls == []
+
+
+def test_invalid_settings_are_rejected():
+    with pytest.raises(ValueError):
+        SourceWatchdog(lambda _: None, lambda _: None, stale_timeout=0.0)
+    with pytest.raises(ValueError):
+        SourceWatchdog(lambda _: None, lambda _: None, max_failures=-1)
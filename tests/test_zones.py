@@ -0,0 +1,153 @@
+import math
+import random
+
+import numpy as np
+import pytest
+import shapely
+
+from pipeline.config import CLASS_BICYCLE, CLASS_CAR, CLASS_PERSON, compile_config
+from pipeline.zones import ZoneEngine
+
+# Concave U shape, the notch opens at the bottom
+U_SHAPE = [(100, 100), (400, 100), (400, 400), (300, 400), (300, 200), (200, 200),
+           (200, 400), (100, 400)]
+
+
+def lines(points):
+    return [[list(points[i]), list(points[(i + 1) % len(points)])] for i in range(len(points))]
+
+
+def make_sources(*zones_per_source, car=0.5, person=0.5):
+    config = {str(source_id): {"uri": "file:///dev/null", "car_confidence": car,
+                               "person_confidence": person,
+                               "restricted_zones": [lines(zone) for zone in zones]}
+              for source_id, zones in enumerate(zones_per_source)}
+    return compile_config(config)
+
+
+def evaluate(engine, points, source_id=0, class_id=CLASS_PERSON, confidence=1.0):
+    count = len(points)
+    return engine.evaluate([source_id] * count, [class_id] * count, [confidence] * count,
+                           [x for x, _ in points], [y for _, y in points])
+
+
+def test_concave_zone_keeps_its_notch_outside():
+    engine = ZoneEngine(make_sources([U_SHAPE]))
+    hits = evaluate(engine, [(150, 350), (350, 350), (250, 150), (250, 300), (250, 450)])
+    assert hits.zone.tolist() == [0, 0, 0, -1, -1]
+
+
+def test_points_on_edges_and_vertices_are_outside():
+    sources = make_sources([U_SHAPE])
+    engine = ZoneEngine(sources)
+    points = list(U_SHAPE)
+    for i, (ax, ay) in enumerate(U_SHAPE):
+        bx, by = U_SHAPE[(i + 1) % len(U_SHAPE)]
+        points.append(((ax + bx) / 2, (ay + by) / 2))
+    assert evaluate(engine, points).zone.tolist() == [-1] * len(points)
+    assert not any(sources[0].zones[0].contains(x, y) for x, y in points)
+
+
+def test_slanted_edges_exclude_their_points():
+    triangle = [(0, 0), (300, 150), (0, 300)]
+    engine = ZoneEngine(make_sources([triangle]))
+    hits = evaluate(engine, [(100, 50), (200, 100), (100, 51), (200, 200), (100, 150)])
+    assert hits.zone.tolist() == [-1, -1, 0, -1, 0]
+
+
+def test_points_on_grid_cell_boundaries():
+    # The zone spans several 64 px cells and ends on a cell boundary
+    square = [(32, 32), (192, 32), (192, 192), (32, 192)]
+    engine = ZoneEngine(make_sources([square]), cell_size=64)
+    points = [(64, 64), (128, 128), (64, 100), (100, 128), (191.5, 191.5), (192, 100),
+              (128, 192), (32, 64), (63.999, 127.999)]
+    assert evaluate(engine, points).zone.tolist() == [0, 0, 0, 0, 0, -1, -1, -1, 0]
+
+
+def test_overlapping_zones_report_every_hit_and_the_first_zone():
+    first = [(0, 0), (200, 0), (200, 200), (0, 200)]
+    second = [(100, 100), (300, 100), (300, 300), (100, 300)]
+    engine = ZoneEngine(make_sources([first, second]))
+    hits = evaluate(engine, [(50, 50), (150, 150), (250, 250), (400, 400)])
+    assert hits.zone.tolist() == [0, 0, 1, -1]
+    assert list(zip(hits.hit_objects.tolist(), hits.hit_zones.tolist())) == [
+        (0, 0), (1, 0), (1, 1), (2, 1)]
+
+
+def test_zones_are_per_source():
+    square = [(0, 0), (100, 0), (100, 100), (0, 100)]
+    other = [(500, 500), (600, 500), (600, 600), (500, 600)]
+    engine = ZoneEngine(make_sources([square], [other]))
+    assert evaluate(engine, [(50, 50), (550, 550)], source_id=0).zone.tolist() == [0, -1]
+    assert evaluate(engine, [(50, 50), (550, 550)], source_id=1).zone.tolist() == [-1, 0]
+
+
+def test_classes_and_confidences_are_filtered_by_source():
+    square = [(0, 0), (100, 0), (100, 100), (0, 100)]
+    engine = ZoneEngine(make_sources([square], [square], car=0.5, person=0.8))
+    hits = engine.evaluate(
+        source_ids=[0, 0, 0, 0, 0, 0, 7, 1],
+        class_ids=[CLASS_CAR, CLASS_CAR, CLASS_PERSON, CLASS_BICYCLE, -1, 9, CLASS_CAR, CLASS_CAR],
+        confidences=[0.5, 0.49, 0.79, 1.0, 1.0, 1.0, 1.0, 0.6],
+        xs=[50] * 8, ys=[50] * 8)
+    assert hits.confident.tolist() == [True, False, False, False, False, False, False, True]
+    assert hits.zone.tolist() == [0, -1, -1, -1, -1, -1, -1, 0]
+
+
+def test_points_outside_the_frame_are_ignored():
+    frame = [(0, 0), (1920, 0), (1920, 1080), (0, 1080)]
+    engine = ZoneEngine(make_sources([frame]))
+    hits = evaluate(engine, [(-1, 500), (1920, 500), (500, 1080), (500, 500)])
+    assert hits.zone.tolist() == [-1, -1, -1, 0]
+
+
+def test_sources_without_zones_hit_nothing():
+    config = {"0": {"uri": "file:///dev/null", "car_confidence": 0.1, "person_confidence": 0.1,
+                    "restricted_zones": [lines([(0, 0), (100, 0), (100, 100), (0, 100)])]},
+              "2": {"uri": "file:///dev/null", "car_confidence": 0.1, "person_confidence": 0.1,
+                    "restricted_zones": []}}
+    engine = ZoneEngine(compile_config(config))
+    hits = engine.evaluate([2, 1, 0], [CLASS_CAR] * 3, [1.0] * 3, [50] * 3, [50] * 3)
+    assert hits.confident.tolist() == [True, False, True]
+    assert hits.zone.tolist() == [-1, -1, 0]
+
+
+def star_polygon(rng, cx, cy, radius, count):
+    """Random simple polygon, concave in general, with integer vertices"""
+    angles = sorted(rng.uniform(0, 2 * math.pi) for _ in range(count))
+    points = []
+    for angle in angles:
+        r = rng.uniform(0.3, 1.0) * radius
+        point = (round(cx + r * math.cos(angle)), round(cy + r * math.sin(angle)))
+        if point not in points:
+            points.append(point)
+    return points
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_zones_match_shapely(seed):
+    rng = random.Random(seed)
+    zones = []
+    while len(zones) < 12:
+        zone = star_polygon(rng, rng.uniform(100, 1820), rng.uniform(100, 980),
+                            rng.uniform(40, 300), rng.randint(5, 12))
+        if len(zone) >= 3 and shapely.Polygon(zone).is_valid:
+            zones.append(zone)
+    sources = make_sources(zones)
+    engine = ZoneEngine(sources, cell_size=rng.choice((16, 64, 100)))
+
+    # Random points, points on the integer lattice and the vertices themselves
+    xs = [rng.uniform(0, 1920) for _ in range(3000)] + [rng.randint(0, 1919) for _ in range(3000)]
+    ys = [rng.uniform(0, 1080) for _ in range(3000)] + [rng.randint(0, 1079) for _ in range(3000)]
+    for zone in zones:
+        xs.extend(x for x, _ in zone)
+        ys.extend(y for _, y in zone)
+    hits = evaluate(engine, list(zip(xs, ys)))
+
+    polygons = [zone.polygon for zone in sources[0].zones]
+    expected = np.stack([shapely.contains_xy(polygon, xs, ys) for polygon in polygons], axis=1)
+    objects, zone_indices = np.nonzero(expected)
+    assert hits.hit_objects.tolist() == objects.tolist()
+    assert hits.hit_zones.tolist() == zone_indices.tolist()
+    first = np.where(expected.any(axis=1), expected.argmax(axis=1), -1)
+    assert hits.zone.tolist() == first.tolist()